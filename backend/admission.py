@@ -0,0 +1,182 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+# Linear cost model of one generate request. A "value" is one sample of one
+# channel. Peaks come from tracemalloc and CPU times from process_time,
+# measured on 16-channel EEG and 1-12 lead ECG records of 60-1200 s at
+# 256-512 Hz. The fixed parts are mostly the plot. ECG costs follow the
+# samples of the single simulated lead (NeuroKit2 simulation and HRV),
+# EEG costs the values written out. Chunked EEG memory follows the values
+# of one block instead of the record.
+COST_MODEL = {
+    "eeg": {
+        "fixed_bytes": 16e6,
+        "bytes_per_sample": 0,
+        "bytes_per_value": {"float64": 66, "float32": 42},
+        "chunked_bytes_per_value": {"float64": 96, "float32": 66},
+        "fixed_seconds": 1.2,
+        "seconds_per_sample": 0,
+        "seconds_per_value": {"float64": 3.3e-6, "float32": 2.3e-6}
+    },
+    "ecg": {
+        "fixed_bytes": 8e6,
+        "bytes_per_sample": 1600,
+        "bytes_per_value": {"float64": 8, "float32": 4},
+        "chunked_bytes_per_value": None,  # ECG is always generated in one piece
+        "fixed_seconds": 1.0,
+        "seconds_per_sample": 180e-6,
+        "seconds_per_value": {"float64": 3e-6, "float32": 2e-6}
+    }
+}
+
+# Bytes of CSV text per value; the .npy and pyramid add about 9/7 of the item size
+CSV_BYTES_PER_VALUE = {"float64": 21, "float32": 11}
+
+
+def estimate_cost(signal, n_channels, duration, sampling_rate, dtype=np.float64, block_samples=None):
+    """Estimated peak memory, CPU time and disk use of a generate request
+
+    With block_samples, also the peak memory of generating the record
+    block by block, for signals that support it.
+    """
+    model = COST_MODEL[signal]
+    dtype = np.dtype(dtype)
+    n_samples = duration * sampling_rate
+    values = n_samples * n_channels
+    estimate = {
+        "signal": signal,
+        "channels": n_channels,
+        "samples": n_samples,
+        "values": values,
+        "dtype": dtype.name,
+        "peak_bytes": int(model["fixed_bytes"] + model["bytes_per_sample"] * n_samples
+                          + model["bytes_per_value"][dtype.name] * values),
+        "cpu_seconds": round(model["fixed_seconds"] + model["seconds_per_sample"] * n_samples
+                             + model["seconds_per_value"][dtype.name] * values, 2),
+        "disk_bytes": int(values * (CSV_BYTES_PER_VALUE[dtype.name] + dtype.itemsize * 9 / 7))
+    }
+    if block_samples and model["chunked_bytes_per_value"]:
+        block_values = min(n_samples, block_samples) * n_channels
+        estimate["chunked_peak_bytes"] = int(model["fixed_bytes"]
+                                             + model["chunked_bytes_per_value"][dtype.name] * block_values)
+    return estimate
+
+
+def combine_estimates(signal, *estimates):
+    """Estimate of a request that generates several signals into one record"""
+    combined = {"signal": signal, "channels": 0, "samples": estimates[0]["samples"], "values": 0,
+                "dtype": estimates[0]["dtype"], "peak_bytes": 0, "cpu_seconds": 0, "disk_bytes": 0}
+    for estimate in estimates:
+        for key in ("channels", "values", "peak_bytes", "cpu_seconds", "disk_bytes"):
+            combined[key] += estimate[key]
+    combined["cpu_seconds"] = round(combined["cpu_seconds"], 2)
+    return combined
+
+
+class AdmissionError(Exception):
+    """A request turned away by admission control, with the HTTP status to answer"""
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _mib(n_bytes):
+    return f"{n_bytes / 1024 ** 2:.0f} MiB"
+
+
+class AdmissionController:
+    """Run generate requests within a budget of estimated peak memory
+
+    decide() picks how a request runs: in memory when its estimated peak
+    fits the budget, block by block when only the chunked peak fits, and
+    not at all (413) when neither does or its files would not fit in
+    storage. admit() reserves the estimated bytes while the request runs.
+    A request that does not fit next to the running ones waits in a FIFO
+    queue for up to queue_timeout seconds (503 when the queue is full or
+    the wait times out). A budget of 0 admits everything in memory.
+    """
+
+    def __init__(self, budget_bytes, max_queue=16, queue_timeout=30, max_disk_bytes=None):
+        self.budget_bytes = budget_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_disk_bytes = max_disk_bytes
+        self._reserved = 0
+        self._running = 0
+        self._queue = []  # tickets of waiting requests, oldest first
+        self._cond = threading.Condition()
+        self._counts = {"inline": 0, "chunked": 0, "queued": 0, "rejected": 0, "timeouts": 0,
+                        "queue_full": 0}
+
+    def decide(self, estimate):
+        """How a request with this estimate runs: {"mode", "reserve_bytes", "reason"}"""
+        if self.max_disk_bytes and estimate["disk_bytes"] > self.max_disk_bytes:
+            return {"mode": "rejected", "reserve_bytes": 0,
+                    "reason": f"Output would take about {_mib(estimate['disk_bytes'])}, "
+                              f"more than the {_mib(self.max_disk_bytes)} of artifact storage"}
+        if not self.budget_bytes or estimate["peak_bytes"] <= self.budget_bytes:
+            return {"mode": "inline", "reserve_bytes": estimate["peak_bytes"] if self.budget_bytes else 0,
+                    "reason": None}
+        chunked = estimate.get("chunked_peak_bytes")
+        if chunked is not None and chunked <= self.budget_bytes:
+            return {"mode": "chunked", "reserve_bytes": chunked,
+                    "reason": f"Estimated peak of {_mib(estimate['peak_bytes'])} exceeds the memory budget"}
+        return {"mode": "rejected", "reserve_bytes": 0,
+                "reason": f"Request needs about {_mib(estimate['peak_bytes'])} of memory, "
+                          f"more than the {_mib(self.budget_bytes)} budget"}
+
+    @contextmanager
+    def admit(self, decision):
+        """Hold the request's reservation while the block runs, queueing for it if needed"""
+        n_bytes = decision["reserve_bytes"]
+        with self._cond:
+            if decision["mode"] == "rejected":
+                self._counts["rejected"] += 1
+                raise AdmissionError(decision["reason"], 413)
+            if self._queue or self._reserved + n_bytes > self.budget_bytes > 0:
+                self._wait(n_bytes)
+            self._reserved += n_bytes
+            self._running += 1
+            self._counts[decision["mode"]] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._reserved -= n_bytes
+                self._running -= 1
+                self._cond.notify_all()
+
+    def _wait(self, n_bytes):
+        """Wait (holding the condition) until this request is first in line and fits"""
+        retry_after = max(1, math.ceil(self.queue_timeout))
+        if len(self._queue) >= self.max_queue:
+            self._counts["queue_full"] += 1
+            raise AdmissionError("Too many requests are waiting for memory", 503, retry_after)
+        ticket = object()
+        self._queue.append(ticket)
+        self._counts["queued"] += 1
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            # A request bigger than what is free never fits next to others; it waits until they finish
+            while self._queue[0] is not ticket or \
+                    (self._reserved + n_bytes > self.budget_bytes and self._running):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counts["timeouts"] += 1
+                    raise AdmissionError("Timed out waiting for memory", 503, retry_after)
+                self._cond.wait(remaining)
+        finally:
+            self._queue.remove(ticket)
+            self._cond.notify_all()  # the next in line may fit now
+
+    def stats(self):
+        """Budget, current reservations and decision counters"""
+        with self._cond:
+            return {"budget_bytes": self.budget_bytes, "reserved_bytes": self._reserved,
+                    "running": self._running, "waiting": len(self._queue),
+                    "max_queue": self.max_queue, "queue_timeout": self.queue_timeout, **self._counts}
@@ -1,81 +1,328 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 import os
+import threading
+import time
 import uuid
 import json
 from datetime import datetime
-from generator.eeg_generator import EEGGenerator
-from generator.ecg_generator import ECGGenerator
-from generator.utils import create_output_directories
+import numpy as np
+from generator.eeg_generator import EEGGenerator, EEG_TYPES, check_eeg_type
+from generator.leads import LEAD_SETS, resolve_leads
+from generator.montages import DEFAULT_MONTAGE, MONTAGE_DEFINITIONS, get_montage, resolve_montage_name
+from generator.ecg_generator import ECGGenerator, ECG_TYPES
+from generator.multimodal import MultimodalGenerator, check_ecg_bleed
+from generator.utils import check_epoch_seconds, check_record_size, check_seed, create_output_directories, resolve_dtype, resolve_quality, set_noise_bank
+from generator.noise_bank import NoiseBank
+from generator.pyramid import read_window
+from generator.annotations import EVENT_CODES, EVENT_NAMES, channel_mask, select_events
+from generator.components import ComponentCache
+from generator.outputs import OutputStages, configure as configure_outputs, start_render_workers, stop_render_workers
+from generator.warmup import warm_up
+from config import Config
+from storage import ARTIFACT_TEMPLATES, StorageManager, artifact_path
+import metrics
+from profiling import MODE_ARTIFACTS, profile_call, requested_mode
+from downloads import COMPRESSIBLE_TYPES, negotiate_encoding, precompressed_path, stream_zip
+import signal_data
+from coalescer import RequestCoalescer
+from admission import AdmissionController, AdmissionError, combine_estimates, estimate_cost
+from session_index import FILTER_COLUMNS, SessionIndex
 
 app = Flask(__name__)
+app.config.from_object(Config)
 CORS(app)
 
-# Initialize generators
-eeg_generator = EEGGenerator()
+# Initialize generators, keeping EEG components around for quick edits
+component_cache = None
+if app.config['COMPONENT_CACHE_MAX_BYTES'] > 0:
+    component_cache = ComponentCache(
+        max_bytes=app.config['COMPONENT_CACHE_MAX_BYTES'],
+        max_sessions=app.config['COMPONENT_CACHE_MAX_SESSIONS']
+    )
+eeg_generator = EEGGenerator(component_cache=component_cache)
 ecg_generator = ECGGenerator()
+multimodal_generator = MultimodalGenerator(eeg_generator, ecg_generator)
 
 # Create output directories
 create_output_directories()
 
+# Index sessions, their parameters and artifacts, so lookups never probe the filesystem
+session_index = SessionIndex(
+    app.config['SESSION_INDEX_PATH'],
+    checksums=app.config['SESSION_INDEX_CHECKSUMS']
+)
+
+# Evict generated artifacts by TTL and size budget, tracked in the shared index
+storage = StorageManager(
+    session_index,
+    max_bytes=app.config['STORAGE_MAX_BYTES'],
+    ttl_seconds=app.config['STORAGE_TTL_SECONDS'],
+    sweep_interval=app.config['STORAGE_SWEEP_INTERVAL']
+)
+session_index.sync(storage.scan())
+
+# Bound the memory of concurrent generate requests; oversized EEG records are generated in blocks
+admission = AdmissionController(
+    budget_bytes=app.config['ADMISSION_MEMORY_BUDGET'],
+    max_queue=app.config['ADMISSION_MAX_QUEUE'],
+    queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT'],
+    max_disk_bytes=app.config['STORAGE_MAX_BYTES']
+)
+
+# Merge concurrent EEG requests of the same shape into batches
+coalescer = None
+if app.config['COALESCE_WINDOW_MS'] > 0:
+    coalescer = RequestCoalescer(
+        window=app.config['COALESCE_WINDOW_MS'] / 1000,
+        max_batch=app.config['COALESCE_MAX_BATCH']
+    )
+
+# Optionally serve band-limited noise from a pre-filtered pool
+noise_bank = None
+if app.config['NOISE_BANK_ENABLED']:
+    noise_bank = NoiseBank(
+        max_bytes=app.config['NOISE_BANK_MAX_BYTES'],
+        segment_seconds=app.config['NOISE_BANK_SEGMENT_SECONDS'],
+        max_reuse=app.config['NOISE_BANK_MAX_REUSE']
+    )
+    set_noise_bank(noise_bank)
+
+# CSV, features and plot of a record run alongside each other, on threads and forked render processes
+configure_outputs(threads=app.config['OUTPUT_THREADS'], render_processes=app.config['RENDER_PROCESSES'])
+
+def start_background_tasks():
+    """Fork the render processes, then start the noise bank refresh thread"""
+    start_render_workers()
+    if noise_bank is not None:
+        noise_bank.start()
+
+def stop_background_tasks():
+    """Stop the render processes and background threads started by start_background_tasks"""
+    stop_render_workers()
+    if noise_bank is not None:
+        noise_bank.stop()
+
+# Readiness: set once the optional warm-up has finished
+ready = threading.Event()
+warmup_state = {"timings": None, "error": None}
+
+def run_warmup():
+    try:
+        warmup_state["timings"] = warm_up(noise_bank=noise_bank)
+    except Exception as e:
+        warmup_state["error"] = str(e)
+        print(f"Warm-up failed: {e}")
+    finally:
+        ready.set()
+
+# Under serve.py the master warms up once and sweeps storage, and each forked worker starts its own threads
+if not app.config['PREFORK']:
+    start_background_tasks()
+    storage.start()
+    if app.config['WARMUP_ON_START']:
+        threading.Thread(target=run_warmup, name="warm-up", daemon=True).start()
+    else:
+        ready.set()
+
+def register_session(signal, session_id, result, extra_files=None):
+    """Record the artifacts of a freshly generated session and index it"""
+    files = {
+        "csv": result.get("csv_path"),
+        "npy": result.get("npy_path"),
+        "meta": result.get("meta_path"),
+        "pyramid": result.get("pyramid_path"),
+        "features": result.get("features_path"),
+        "epochs": result.get("epochs_path"),
+        "annotations": result.get("annotations_path"),
+        "plot": result.get("plot_path")
+    }
+    files.update(extra_files or {})
+    record = storage.register(session_id, files)
+    session_index.record(session_id, signal, result, record.files, record.sizes, record.created)
+
+def register_artifact(session_id, file_type, path):
+    """Record an artifact written after its session was registered"""
+    session_index.add_file(session_id, file_type, path)
+
+# What a generate request waits for before answering (?wait=): every artifact, or only the saved record
+WAIT_MODES = ("all", "data")
+
+def requested_wait(value):
+    if value is None:
+        return "all"
+    if value not in WAIT_MODES:
+        raise ValueError(f"wait must be one of: {', '.join(WAIT_MODES)}")
+    return value
+
+def run_generate(signal, generate, session_id, wait="all", **kwargs):
+    """Run a generator method for a request, optionally under a profiler
+
+    With wait="data" the request answers once the record is saved; the CSV,
+    features and plot still being written are listed as pending and
+    registered with the session as they complete.
+    """
+    kwargs["trace_memory"] = app.config['METRICS_TRACE_MEMORY']
+    outputs = None
+    if wait == "data":
+        outputs = kwargs["outputs"] = OutputStages(wait=False)
+    
+    profile_mode = None
+    if app.config['PROFILING_ENABLED']:
+        profile_mode = requested_mode(request.args.get('profile'), request.headers.get('X-Profile'))
+    
+    extra_files = {}
+    if profile_mode:
+        file_type = MODE_ARTIFACTS[profile_mode]
+        profile_path = artifact_path(session_id, file_type)
+        result = profile_call(profile_mode, profile_path, generate,
+                              session_id=session_id, **kwargs)
+        if result is None:
+            return None
+        extra_files[file_type] = profile_path
+        result["profile_url"] = f"/api/download/{session_id}/{file_type}"
+    else:
+        result = generate(session_id=session_id, **kwargs)
+        if result is None:
+            return None
+    
+    register_session(signal, session_id, result, extra_files)
+    if outputs is not None and result.get("pending"):
+        outputs.when_done(lambda file_type, path: register_artifact(session_id, file_type, path),
+                          result["pending"])
+    metrics.observe_timings(signal, result["timings"])
+    return result
+
+def run_eeg_batch(eeg_type, duration, sampling_rate, montage, dtype, quality, requests):
+    """Generate a coalesced batch of EEG requests and record each session"""
+    results = eeg_generator.generate_batch(
+        eeg_type, requests,
+        duration=duration,
+        sampling_rate=sampling_rate,
+        montage=montage,
+        dtype=dtype,
+        trace_memory=app.config['METRICS_TRACE_MEMORY'],
+        quality=quality
+    )
+    for request_item, result in zip(requests, results):
+        register_session('eeg', request_item["session_id"], result)
+        metrics.observe_timings('eeg', result["timings"])
+    return [(request_item["session_id"], result) for request_item, result in zip(requests, results)]
+
+def coalesce_eeg(session_id, eeg_type, duration, sampling_rate, montage, dtype, quality, seed, gains,
+                 epoch_seconds, artifacts):
+    """Generate one EEG record through the coalescer, returning (session_id, result)
+
+    Requests with a seed and otherwise identical parameters share one
+    record; the others with the same shape are batched together.
+    """
+    shape = (eeg_type, duration, sampling_rate, montage, str(dtype), quality)
+    item = {"session_id": session_id, "seed": seed, "gains": gains,
+            "epoch_seconds": epoch_seconds, "artifacts": artifacts}
+    identity = None
+    if seed is not None:
+        identity = shape + (json.dumps({k: v for k, v in item.items() if k != "session_id"}, sort_keys=True),)
+    return coalescer.submit(
+        shape, item,
+        lambda items: run_eeg_batch(eeg_type, duration, sampling_rate, montage, dtype, quality, items),
+        identity_key=identity
+    )
+
+def request_cost(signal, duration, sampling_rate, dtype, montage=None, leads=None):
+    """Validate the size of a generate request and estimate its cost"""
+    check_record_size(duration, sampling_rate)
+    if signal == 'eeg':
+        return estimate_cost('eeg', len(get_montage(montage)), duration, sampling_rate, dtype,
+                             app.config['STREAM_BLOCK_SAMPLES'])
+    n_channels = 1 if leads is None else len(resolve_leads(leads)[0])
+    ecg_estimate = estimate_cost('ecg', n_channels, duration, sampling_rate, dtype)
+    if signal == 'multimodal':
+        # Generated in one piece: the EEG record is held while the ECG is simulated
+        eeg_estimate = estimate_cost('eeg', len(get_montage(montage)), duration, sampling_rate, dtype)
+        return combine_estimates('multimodal', eeg_estimate, ecg_estimate)
+    return ecg_estimate
+
+def admission_response(error, estimate):
+    response = jsonify({"error": str(error), "estimate": estimate})
+    response.status_code = error.status
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def session_expired(session_id):
+    """Whether a session's artifacts were evicted"""
+    return session_index.is_expired(session_id)
+
+def expired_response(session_id):
+    return jsonify({"error": "Session expired", "session_id": session_id}), 410
+
+# Upper bound on the points per channel a window request may ask for
+MAX_WINDOW_POINTS = 100000
+
+# Upper bound on the events an annotations request may return
+MAX_ANNOTATIONS = 100000
+
+# Generate endpoints and the signal label they report in metrics
+GENERATE_ENDPOINTS = {'generate_eeg': 'eeg', 'generate_ecg': 'ecg', 'generate_multimodal': 'multimodal',
+                      'modify_session': 'eeg'}
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    signal = GENERATE_ENDPOINTS.get(request.endpoint)
+    if signal:
+        metrics.IN_PROGRESS.inc(signal=signal)
+        g.in_progress_signal = signal
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if response.status_code >= 500:
+        metrics.ERRORS.inc(endpoint=endpoint)
+    if 'request_start' in g:
+        metrics.REQUEST_DURATION.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    signal = g.pop('in_progress_signal', None)
+    if signal:
+        metrics.IN_PROGRESS.dec(signal=signal)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "message": "EEG/ECG Generator API is running"})
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 until the warm-up phase has finished"""
+    if not ready.is_set():
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True, "warmup": warmup_state})
+
 @app.route('/api/eeg/types', methods=['GET'])
 def get_eeg_types():
     """Get available EEG types and subtypes"""
+    return jsonify(EEG_TYPES)
+
+@app.route('/api/eeg/montages', methods=['GET'])
+def get_eeg_montages():
+    """Get available EEG montages with electrode positions"""
     return jsonify({
-        "normal": {
-            "Normal Awake": "normal_awake",
-            "Sleep Stage 1": "sleep_stage1", 
-            "Sleep Stage 2": "sleep_stage2",
-            "Sleep Stage 3": "sleep_stage3",
-            "REM Sleep": "rem_sleep"
-        },
-        "abnormal": {
-            "Interictal Spikes": "interictal_spikes",
-            "3 Hz Spike-Wave": "spike_wave_3hz",
-            "Focal Spikes": "focal_spikes", 
-            "Polyspike": "polyspike",
-            "Hypsarrhythmia": "hypsarrhythmia",
-            "Focal Slowing": "focal_slowing",
-            "Diffuse Slowing": "diffuse_slowing",
-            "Triphasic Waves": "triphasic_waves",
-            "Periodic Discharges": "periodic_discharges",
-            "Burst Suppression": "burst_suppression",
-            "Alpha Coma": "alpha_coma",
-            "Flat EEG": "flat_eeg"
-        }
+        "default": DEFAULT_MONTAGE,
+        "montages": [get_montage(name).to_dict() for name in MONTAGE_DEFINITIONS]
     })
 
 @app.route('/api/ecg/types', methods=['GET'])
 def get_ecg_types():
     """Get available ECG types and subtypes"""
-    return jsonify({
-        "normal": {
-            "Normal Sinus Rhythm": "normal_sinus",
-            "Sinus Bradycardia": "sinus_bradycardia",
-            "Sinus Tachycardia": "sinus_tachycardia"
-        },
-        "abnormal": {
-            "First Degree Heart Block": "first_degree_block",
-            "Second Degree Mobitz I": "second_degree_mobitz1",
-            "Second Degree Mobitz II": "second_degree_mobitz2", 
-            "Third Degree Heart Block": "third_degree_block",
-            "Left Bundle Branch Block": "lbbb",
-            "Right Bundle Branch Block": "rbbb",
-            "STEMI": "stemi",
-            "NSTEMI": "nstemi",
-            "Atrial Fibrillation": "atrial_fibrillation",
-            "Ventricular Tachycardia": "ventricular_tachycardia",
-            "Hyperkalemia": "hyperkalemia",
-            "Hypokalemia": "hypokalemia",
-            "Pericarditis": "pericarditis",
-            "Pulmonary Embolism": "pulmonary_embolism",
-            "Digitalis Effect": "digitalis_effect"
-        }
-    })
+    return jsonify(ECG_TYPES)
+
+@app.route('/api/ecg/leads', methods=['GET'])
+def get_ecg_leads():
+    """Get available ECG lead sets"""
+    return jsonify(LEAD_SETS)
 
 @app.route('/api/generate/eeg', methods=['POST'])
 def generate_eeg():
@@ -88,24 +335,122 @@ def generate_eeg():
         
         if not eeg_type:
             return jsonify({"error": "EEG type is required"}), 400
+        
+        try:
+            montage = resolve_montage_name(data.get('montage'))
+            dtype = resolve_dtype(data.get('dtype'))
+            artifacts = eeg_generator.artifact_config(eeg_type, data.get('artifacts'))
+            eeg_generator.check_gains(eeg_type, data.get('gains'), artifacts)
+            epoch_seconds = check_epoch_seconds(data.get('epoch_seconds'), duration)
+            seed = check_seed(data.get('seed'))
+            quality = resolve_quality(data.get('quality'))
+            wait = requested_wait(request.args.get('wait'))
+            estimate = request_cost('eeg', duration, sampling_rate, dtype, montage=montage)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        decision = admission.decide(estimate)
             
         # Generate unique ID for this session
         session_id = str(uuid.uuid4())
         
-        # Generate EEG data
-        result = eeg_generator.generate(
-            eeg_type=eeg_type,
-            duration=duration,
-            sampling_rate=sampling_rate,
-            session_id=session_id
-        )
-        
+        profiled = app.config['PROFILING_ENABLED'] and \
+            requested_mode(request.args.get('profile'), request.headers.get('X-Profile'))
+        with admission.admit(decision):
+            if decision["mode"] == "chunked":
+                # Too large to hold in memory: generated and written block by block
+                result = run_generate(
+                    'eeg', eeg_generator.generate_chunked, session_id,
+                    eeg_type=eeg_type,
+                    duration=duration,
+                    sampling_rate=sampling_rate,
+                    montage=montage,
+                    dtype=dtype,
+                    gains=data.get('gains'),
+                    epoch_seconds=epoch_seconds,
+                    artifacts=data.get('artifacts'),
+                    seed=seed,
+                    block_size=app.config['STREAM_BLOCK_SAMPLES'],
+                    quality=quality
+                )
+            elif coalescer is not None and not profiled and wait == "all":
+                # Batched with concurrent requests; a shared request reports the first caller's session
+                session_id, result = coalesce_eeg(session_id, eeg_type, duration, sampling_rate, montage, dtype,
+                                                  quality, seed, data.get('gains'), epoch_seconds,
+                                                  data.get('artifacts'))
+            else:
+                # Generate EEG data
+                result = run_generate(
+                    'eeg', eeg_generator.generate, session_id, wait,
+                    eeg_type=eeg_type,
+                    duration=duration,
+                    sampling_rate=sampling_rate,
+                    montage=montage,
+                    dtype=dtype,
+                    gains=data.get('gains'),
+                    epoch_seconds=epoch_seconds,
+                    artifacts=data.get('artifacts'),
+                    seed=seed,
+                    quality=quality
+                )
+
         return jsonify({
             "success": True,
             "session_id": session_id,
+            "data": result,
+            "estimate": estimate
+        })
+        
+    except AdmissionError as e:
+        return admission_response(e, estimate)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/session/<session_id>/modify', methods=['POST'])
+def modify_session(session_id):
+    """Derive a new EEG session by changing the type or component gains of a cached one"""
+    try:
+        data = request.get_json() or {}
+        eeg_type = data.get('type')
+        gains = data.get('gains')
+        
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        entry = component_cache.get(session_id) if component_cache else None
+        if entry is None:
+            return jsonify({"error": "Session components are not cached, generate it again"}), 404
+        
+        try:
+            new_type = check_eeg_type(eeg_type) if eeg_type is not None else entry["params"]["eeg_type"]
+            artifacts = eeg_generator.artifact_config(new_type, data.get('artifacts'), entry["params"])
+            eeg_generator.check_gains(new_type, gains, artifacts)
+            wait = requested_wait(request.args.get('wait'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        params = entry["params"]
+        estimate = request_cost('eeg', params["duration"], params["sampling_rate"], params["dtype"],
+                                montage=params["montage"])
+        
+        new_session_id = str(uuid.uuid4())
+        with admission.admit(admission.decide(estimate)):
+            result = run_generate(
+                'eeg', eeg_generator.modify, new_session_id, wait,
+                parent_session_id=session_id,
+                eeg_type=eeg_type,
+                gains=gains,
+                artifacts=data.get('artifacts')
+            )
+        if result is None:
+            return jsonify({"error": "Session components are not cached, generate it again"}), 404
+        
+        return jsonify({
+            "success": True,
+            "session_id": new_session_id,
             "data": result
         })
         
+    except AdmissionError as e:
+        return admission_response(e, estimate)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -120,22 +465,138 @@ def generate_ecg():
         
         if not ecg_type:
             return jsonify({"error": "ECG type is required"}), 400
+        
+        leads = data.get('leads')
+        try:
+            if leads is not None:
+                resolve_leads(leads)
+            dtype = resolve_dtype(data.get('dtype'))
+            ecg_generator.artifact_config(data.get('artifacts'))
+            seed = check_seed(data.get('seed'))
+            quality = resolve_quality(data.get('quality'))
+            wait = requested_wait(request.args.get('wait'))
+            estimate = request_cost('ecg', duration, sampling_rate, dtype, leads=leads)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
             
         # Generate unique ID for this session
         session_id = str(uuid.uuid4())
         
         # Generate ECG data
-        result = ecg_generator.generate(
-            ecg_type=ecg_type,
-            duration=duration,
-            sampling_rate=sampling_rate,
-            session_id=session_id
-        )
+        with admission.admit(admission.decide(estimate)):
+            result = run_generate(
+                'ecg', ecg_generator.generate, session_id, wait,
+                ecg_type=ecg_type,
+                duration=duration,
+                sampling_rate=sampling_rate,
+                leads=leads,
+                dtype=dtype,
+                artifacts=data.get('artifacts'),
+                seed=seed,
+                quality=quality
+            )
+
+        return jsonify({
+            "success": True,
+            "session_id": session_id,
+            "data": result,
+            "estimate": estimate
+        })
+        
+    except AdmissionError as e:
+        return admission_response(e, estimate)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/generate/multimodal', methods=['POST'])
+def generate_multimodal():
+    """Generate EEG and ECG on one timeline as a single multi-channel record"""
+    try:
+        data = request.get_json()
+        eeg_type = data.get('eeg_type')
+        ecg_type = data.get('ecg_type')
+        duration = data.get('duration', 30)
+        sampling_rate = data.get('sampling_rate', 256)
+        
+        if not eeg_type or not ecg_type:
+            return jsonify({"error": "EEG and ECG types are required"}), 400
+        
+        leads = data.get('leads')
+        try:
+            montage = resolve_montage_name(data.get('montage'))
+            if leads is not None:
+                resolve_leads(leads)
+            dtype = resolve_dtype(data.get('dtype'))
+            eeg_artifacts = eeg_generator.artifact_config(eeg_type, data.get('eeg_artifacts'))
+            eeg_generator.check_gains(eeg_type, data.get('gains'), eeg_artifacts)
+            ecg_generator.artifact_config(data.get('ecg_artifacts'))
+            ecg_bleed = check_ecg_bleed(data.get('ecg_bleed'))
+            seed = check_seed(data.get('seed'))
+            quality = resolve_quality(data.get('quality'))
+            wait = requested_wait(request.args.get('wait'))
+            estimate = request_cost('multimodal', duration, sampling_rate, dtype, montage=montage, leads=leads)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Generate unique ID for this session
+        session_id = str(uuid.uuid4())
+        
+        with admission.admit(admission.decide(estimate)):
+            result = run_generate(
+                'multimodal', multimodal_generator.generate, session_id, wait,
+                eeg_type=eeg_type,
+                ecg_type=ecg_type,
+                duration=duration,
+                sampling_rate=sampling_rate,
+                montage=montage,
+                leads=leads,
+                dtype=dtype,
+                gains=data.get('gains'),
+                eeg_artifacts=data.get('eeg_artifacts'),
+                ecg_artifacts=data.get('ecg_artifacts'),
+                ecg_bleed=ecg_bleed,
+                seed=seed,
+                quality=quality
+            )
         
         return jsonify({
             "success": True,
             "session_id": session_id,
-            "data": result
+            "data": result,
+            "estimate": estimate
+        })
+        
+    except AdmissionError as e:
+        return admission_response(e, estimate)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/estimate', methods=['POST'])
+def estimate_request():
+    """Estimate the memory, CPU time and disk use of a generate request and how it would be admitted"""
+    try:
+        data = request.get_json() or {}
+        signal = data.get('signal', 'eeg')
+        if signal not in ('eeg', 'ecg', 'multimodal'):
+            return jsonify({"error": "signal must be 'eeg', 'ecg' or 'multimodal'"}), 400
+        try:
+            dtype = resolve_dtype(data.get('dtype'))
+            montage = resolve_montage_name(data.get('montage')) if signal != 'ecg' else None
+            estimate = request_cost(signal, data.get('duration', 30), data.get('sampling_rate', 256), dtype,
+                                    montage=montage, leads=data.get('leads'))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        
+        decision = admission.decide(estimate)
+        usage = admission.stats()
+        return jsonify({
+            "estimate": estimate,
+            "mode": decision["mode"],
+            "reason": decision["reason"],
+            "would_queue": decision["mode"] != "rejected" and usage["budget_bytes"] > 0 and
+                           (usage["waiting"] > 0 or
+                            usage["reserved_bytes"] + decision["reserve_bytes"] > usage["budget_bytes"]),
+            "admission": usage
         })
         
     except Exception as e:
@@ -145,21 +606,42 @@ def generate_ecg():
 def download_file(session_id, file_type):
     """Download generated files"""
     try:
-        file_path = None
-        
-        if file_type == 'csv':
-            file_path = f"static/csv/{session_id}_data.csv"
-        elif file_type == 'features':
-            file_path = f"static/csv/{session_id}_features.csv"
-        elif file_type == 'plot':
-            file_path = f"static/plots/{session_id}_plot.png"
-        else:
+        if file_type not in ARTIFACT_TEMPLATES:
             return jsonify({"error": "Invalid file type"}), 400
-            
-        if not os.path.exists(file_path):
+        
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        file_path = session_index.artifact(session_id, file_type)
+        if file_path is None:
             return jsonify({"error": "File not found"}), 404
-            
-        return send_file(file_path, as_attachment=True)
+        
+        storage.touch(session_id)
+        
+        # Serve a cached compressed copy when the client accepts one
+        encoding = None
+        if file_type in COMPRESSIBLE_TYPES:
+            encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        
+        # Artifact paths are relative to the working directory, send_file would resolve them against the app root
+        if encoding:
+            compressed_path = precompressed_path(file_path, encoding)
+            session_index.add_file(session_id, file_type + compressed_path[len(file_path):], compressed_path,
+                                   checksum=False)
+            response = send_file(
+                os.path.abspath(compressed_path),
+                mimetype='text/csv',
+                as_attachment=True,
+                download_name=os.path.basename(file_path)
+            )
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_file(os.path.abspath(file_path), as_attachment=True)
+        
+        # Range requests are answered by send_file with 206 Partial Content
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.vary.add('Accept-Encoding')
+        return response
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -168,24 +650,303 @@ def download_file(session_id, file_type):
 def get_session_files(session_id):
     """Get all files for a session"""
     try:
-        files = {
-            "csv": f"static/csv/{session_id}_data.csv",
-            "features": f"static/csv/{session_id}_features.csv", 
-            "plot": f"static/plots/{session_id}_plot.png"
-        }
-        
-        available_files = {}
-        for file_type, file_path in files.items():
-            if os.path.exists(file_path):
-                available_files[file_type] = file_path
-                
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        files = session_index.files(session_id)
+        if files is None:
+            return jsonify({"error": "Session not found"}), 404
+        
+        storage.touch(session_id)
         return jsonify({
             "session_id": session_id,
-            "files": available_files
+            "files": files
         })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/session/<session_id>/data', methods=['GET'])
+def get_session_data(session_id):
+    """Serve the samples of a session as an Arrow IPC stream or raw little-endian binary"""
+    try:
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        files = session_index.files(session_id)
+        if not files or 'npy' not in files:
+            return jsonify({"error": "Session not found"}), 404
+        
+        data_format = signal_data.negotiate_format(request.args.get('format'), request.headers.get('Accept'))
+        if data_format not in ('arrow', 'raw'):
+            return jsonify({"error": f"Unknown format: {data_format}. Available: arrow, raw"}), 400
+        if data_format not in signal_data.supported_formats():
+            return jsonify({"error": "Arrow output requires the pyarrow package"}), 406
+        
+        data, meta = signal_data.load_signal(files['npy'], files.get('meta'), files.get('csv'))
+        try:
+            indices = signal_data.select_channels(meta["channels"], request.args.get('channels'))
+            dtype = resolve_dtype(request.args.get('dtype', 'float32'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        storage.touch(session_id)
+        if data_format == 'arrow':
+            return Response(signal_data.stream_arrow(data, meta, indices, dtype),
+                            mimetype=signal_data.ARROW_MIMETYPE)
+        
+        length, body = signal_data.stream_raw(data, meta, indices, dtype)
+        response = Response(body, mimetype=signal_data.RAW_MIMETYPE)
+        response.content_length = length
+        return response
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/session/<session_id>/window', methods=['GET'])
+def get_session_window(session_id):
+    """Return a time window of a session, decimated to min/max pairs beyond max_points"""
+    try:
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        files = session_index.files(session_id)
+        if not files or 'npy' not in files:
+            return jsonify({"error": "Session not found"}), 404
+        
+        data, meta = signal_data.load_signal(files['npy'], files.get('meta'), files.get('csv'))
+        sampling_rate = meta.get("sampling_rate") or 1
+        n_samples = data.shape[1]
+        try:
+            indices = signal_data.select_channels(meta["channels"], request.args.get('channels'))
+            start = max(0, int(float(request.args.get('start', 0)) * sampling_rate))
+            end = min(n_samples, int(float(request.args.get('end', n_samples / sampling_rate)) * sampling_rate))
+            max_points = int(request.args.get('max_points', 2000))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if end <= start:
+            return jsonify({"error": "Window end must be after its start"}), 400
+        if not 2 <= max_points <= MAX_WINDOW_POINTS:
+            return jsonify({"error": f"max_points must be between 2 and {MAX_WINDOW_POINTS}"}), 400
+        
+        pyramid, levels = signal_data.load_pyramid(files.get('pyramid'), meta)
+        bin_size, first, values = read_window(data, pyramid, levels, indices, start, end, max_points)
+        
+        channels = {}
+        for name, row in zip((meta["channels"][i] for i in indices), values):
+            if bin_size == 1:
+                channels[name] = {"values": row.tolist()}
+            else:
+                channels[name] = {"min": row[:, 0].tolist(), "max": row[:, 1].tolist()}
+        
+        storage.touch(session_id)
+        return jsonify({
+            "session_id": session_id,
+            "sampling_rate": meta.get("sampling_rate"),
+            "start": first / sampling_rate,
+            "end": end / sampling_rate,
+            "bin_size": bin_size,
+            "step": bin_size / sampling_rate,
+            "channels": channels
+        })
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/session/<session_id>/annotations', methods=['GET'])
+def get_session_annotations(session_id):
+    """Return the ground-truth events of a session overlapping a time window"""
+    try:
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        files = session_index.files(session_id)
+        if not files or 'annotations' not in files:
+            return jsonify({"error": "Session has no annotations"}), 404
+        
+        with open(files['meta']) as f:
+            meta = json.load(f)
+        events = np.load(files['annotations'], mmap_mode='r')
+        sampling_rate = meta["sampling_rate"]
+        try:
+            start = max(0, int(float(request.args.get('start', 0)) * sampling_rate))
+            end = request.args.get('end')
+            end = int(float(end) * sampling_rate) if end is not None else None
+            codes = None
+            if request.args.get('events'):
+                names = [name.strip() for name in request.args['events'].split(',') if name.strip()]
+                unknown = [name for name in names if name not in EVENT_CODES]
+                if unknown:
+                    raise ValueError(f"Unknown events: {', '.join(unknown)}. Available: {', '.join(EVENT_CODES)}")
+                codes = [EVENT_CODES[name] for name in names]
+            channels = None
+            if request.args.get('channels'):
+                channels = signal_data.select_channels(meta["channels"], request.args['channels'])
+            limit = int(request.args.get('limit', 10000))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if end is not None and end <= start:
+            return jsonify({"error": "Window end must be after its start"}), 400
+        if not 1 <= limit <= MAX_ANNOTATIONS:
+            return jsonify({"error": f"limit must be between 1 and {MAX_ANNOTATIONS}"}), 400
+        
+        selected = select_events(events, start, np.iinfo(np.int64).max if end is None else end,
+                                 meta["annotations"]["max_duration"], codes, channels)
+        truncated = len(selected) > limit
+        selected = selected[:limit]
+        masks = channel_mask(selected, len(meta["channels"]))
+        
+        storage.touch(session_id)
+        return jsonify({
+            "session_id": session_id,
+            "sampling_rate": sampling_rate,
+            "events": [
+                {
+                    "event": EVENT_NAMES.get(int(event["code"]), int(event["code"])),
+                    "onset": int(event["onset"]) / sampling_rate,
+                    "duration": int(event["duration"]) / sampling_rate,
+                    "onset_sample": int(event["onset"]),
+                    "duration_samples": int(event["duration"]),
+                    # None when the event covers every channel
+                    "channels": None if mask.all() else [meta["channels"][i] for i in np.flatnonzero(mask)]
+                }
+                for event, mask in zip(selected, masks)
+            ],
+            "truncated": truncated
+        })
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/session/<session_id>/bundle', methods=['GET'])
+def download_session_bundle(session_id):
+    """Stream a zip archive of all files for a session"""
+    try:
+        if session_expired(session_id):
+            return expired_response(session_id)
+        
+        files = session_index.files(session_id)
+        if files is None:
+            return jsonify({"error": "Session not found"}), 404
+        
+        storage.touch(session_id)
+        return Response(
+            stream_zip([(os.path.basename(path), path) for path in files.values()]),
+            mimetype='application/zip',
+            headers={"Content-Disposition": f"attachment; filename={session_id}.zip"}
+        )
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Session list filters compared as integers
+INTEGER_FILTERS = ('sampling_rate', 'duration', 'seed')
+# Query parameters of the session list besides the filters
+LIST_PARAMETERS = ('status', 'since', 'until', 'limit', 'cursor')
+
+def query_number(name, parse, default=None):
+    """Parse a numeric query parameter, raising ValueError for a malformed one"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = parse(value)
+    except ValueError:
+        number = None
+    if number is None or not np.isfinite(number):
+        kind = "an integer" if parse is int else "a number"
+        raise ValueError(f"{name} must be {kind}, got {value!r}")
+    return number
+
+@app.route('/api/sessions', methods=['GET'])
+def list_sessions():
+    """List indexed sessions, newest first, filtered by parameters and paged by cursor"""
+    try:
+        try:
+            unknown = sorted(set(request.args) - set(FILTER_COLUMNS) - set(LIST_PARAMETERS))
+            if unknown:
+                raise ValueError(f"Unknown parameters: {', '.join(unknown)}. "
+                                 f"Available: {', '.join((*FILTER_COLUMNS, *LIST_PARAMETERS))}")
+            filters = {}
+            for name in FILTER_COLUMNS:
+                value = query_number(name, int) if name in INTEGER_FILTERS else request.args.get(name)
+                if value is not None:
+                    filters[name] = value
+            status = request.args.get('status', 'active')
+            if status not in ('active', 'expired', 'all'):
+                raise ValueError(f"Unknown status: {status}. Available: active, expired, all")
+            since = query_number('since', float)
+            until = query_number('until', float)
+            limit = query_number('limit', int, 50)
+            sessions, next_cursor = session_index.list_sessions(
+                filters, status=status, since=since, until=until, limit=limit,
+                cursor=request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({
+            "sessions": sessions,
+            "next_cursor": next_cursor
+        })
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session_record(session_id):
+    """Get the parameters, timings and artifacts (with sizes and checksums) of a session"""
+    try:
+        session = session_index.get(session_id)
+        if session is None:
+            return jsonify({"error": "Session not found"}), 404
+        return jsonify(session)
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Expose request and pipeline stage metrics in Prometheus text format"""
+    usage = storage.usage()
+    metrics.STORAGE_BYTES.set(usage["bytes"])
+    metrics.STORAGE_SESSIONS.set(usage["sessions"])
+    if noise_bank is not None:
+        metrics.observe_noise_bank(noise_bank.stats())
+    metrics.observe_admission(admission.stats())
+    if coalescer is not None:
+        metrics.observe_coalescer(coalescer.stats())
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/storage', methods=['GET'])
+def get_storage_usage():
+    """Get current artifact storage usage"""
+    return jsonify(storage.usage())
+
+@app.route('/api/component-cache', methods=['GET'])
+def get_component_cache_stats():
+    """Get memory use of the cached EEG session components"""
+    if component_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **component_cache.stats()})
+
+@app.route('/api/noise-bank', methods=['GET'])
+def get_noise_bank_stats():
+    """Get noise bank memory use and draw counters"""
+    if noise_bank is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **noise_bank.stats()})
+
+@app.route('/api/admission', methods=['GET'])
+def get_admission_stats():
+    """Get the memory budget, current reservations and admission counters"""
+    return jsonify(admission.stats())
+
+@app.route('/api/coalescer', methods=['GET'])
+def get_coalescer_stats():
+    """Get how many EEG requests were shared, batched or run alone"""
+    if coalescer is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **coalescer.stats()})
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
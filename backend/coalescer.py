@@ -0,0 +1,117 @@
+import threading
+
+
+class _Call:
+    """Result slot that one or more waiting requests read from"""
+
+    def __init__(self, identity_key=None):
+        self.identity_key = identity_key
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class _Batch:
+    def __init__(self):
+        self.calls = []  # (item, _Call)
+        self.full = threading.Event()
+
+
+class RequestCoalescer:
+    """Merge concurrent requests into shared or batched computations
+
+    A request whose identity key matches one already in flight waits for
+    that computation and gets the same result. Other requests with the same
+    batch key that arrive within `window` seconds of the first are handed to
+    one `run_batch(items)` call, which returns a result per item. The first
+    request of a batch runs it on its own thread; a batch reaching
+    `max_batch` items runs without waiting for the window to end. The first
+    request only waits while a batch with its key is already running, so a
+    lone request starts at once and a burst queues up behind the first one.
+    """
+
+    def __init__(self, window=0.02, max_batch=16):
+        self.window = window
+        self.max_batch = max_batch
+        self._inflight = {}  # identity key -> _Call
+        self._open = {}  # batch key -> _Batch still accepting requests
+        self._running = {}  # batch key -> batches being computed
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "shared": 0, "batched": 0, "alone": 0,
+                        "batches": 0, "largest_batch": 0}
+
+    def submit(self, batch_key, item, run_batch, identity_key=None):
+        """Run `item` as part of a batch, or share an identical in-flight request"""
+        with self._lock:
+            self._counts["requests"] += 1
+            existing = self._inflight.get(identity_key) if identity_key is not None else None
+            if existing is not None:
+                self._counts["shared"] += 1
+            else:
+                call = _Call(identity_key)
+                if identity_key is not None:
+                    self._inflight[identity_key] = call
+                batch = self._open.get(batch_key)
+                leader = batch is None
+                if leader:
+                    batch = self._open[batch_key] = _Batch()
+                batch.calls.append((item, call))
+                if len(batch.calls) >= self.max_batch:
+                    del self._open[batch_key]
+                    batch.full.set()
+
+        if existing is not None:
+            return existing.wait()
+        if leader:
+            with self._lock:
+                busy = self._running.get(batch_key, 0) > 0
+            if busy:
+                batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(batch_key) is batch:
+                    del self._open[batch_key]
+                calls = list(batch.calls)
+                self._running[batch_key] = self._running.get(batch_key, 0) + 1
+            self._run(batch_key, calls, run_batch)
+        return call.wait()
+
+    def _run(self, batch_key, calls, run_batch):
+        try:
+            results = run_batch([item for item, _ in calls])
+            for (_, call), result in zip(calls, results):
+                call.resolve(result)
+        except Exception as e:
+            for _, call in calls:
+                call.resolve(error=e)
+        finally:
+            with self._lock:
+                self._running[batch_key] -= 1
+                if not self._running[batch_key]:
+                    del self._running[batch_key]
+                for _, call in calls:
+                    if call.identity_key is not None and self._inflight.get(call.identity_key) is call:
+                        del self._inflight[call.identity_key]
+                size = len(calls)
+                if size > 1:
+                    self._counts["batches"] += 1
+                    self._counts["batched"] += size
+                else:
+                    self._counts["alone"] += 1
+                self._counts["largest_batch"] = max(self._counts["largest_batch"], size)
+
+    def stats(self):
+        """Request counts by outcome and batch sizes"""
+        with self._lock:
+            return {"window": self.window, "max_batch": self.max_batch,
+                    "inflight": len(self._inflight), **self._counts}
@@ -0,0 +1,71 @@
+import os
+
+
+def _env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_bool(name, default=False):
+    """Read a boolean flag from the environment"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    """Backend configuration, overridable through environment variables"""
+
+    # Artifact storage lifecycle
+    STORAGE_MAX_BYTES = _env_int('STORAGE_MAX_BYTES', 2 * 1024 ** 3)  # 2 GiB
+    STORAGE_TTL_SECONDS = _env_int('STORAGE_TTL_SECONDS', 24 * 60 * 60)  # 1 day
+    STORAGE_SWEEP_INTERVAL = _env_int('STORAGE_SWEEP_INTERVAL', 60)  # seconds
+
+    # SQLite index of generated sessions, their parameters and artifacts
+    SESSION_INDEX_PATH = os.environ.get('SESSION_INDEX_PATH', 'data/sessions.db')
+    SESSION_INDEX_CHECKSUMS = _env_bool('SESSION_INDEX_CHECKSUMS', True)  # SHA-256 of every artifact
+
+    # Record tracemalloc peaks per pipeline stage (slows generation noticeably)
+    METRICS_TRACE_MEMORY = _env_bool('METRICS_TRACE_MEMORY')
+
+    # Allow clients to profile individual generate requests (?profile=1 or X-Profile)
+    PROFILING_ENABLED = _env_bool('PROFILING_ENABLED')
+
+    # Import heavy modules and prebuild filters in the background at startup
+    WARMUP_ON_START = _env_bool('WARMUP_ON_START', True)
+
+    # Serve band-limited noise from a pool of pre-filtered segments (faster, less fresh)
+    NOISE_BANK_ENABLED = _env_bool('NOISE_BANK_ENABLED')
+    NOISE_BANK_MAX_BYTES = _env_int('NOISE_BANK_MAX_BYTES', 256 * 1024 ** 2)  # 256 MiB
+    NOISE_BANK_SEGMENT_SECONDS = _env_int('NOISE_BANK_SEGMENT_SECONDS', 120)
+    NOISE_BANK_MAX_REUSE = _env_int('NOISE_BANK_MAX_REUSE', 50)  # draws before a segment is rebuilt
+
+    # Keep EEG signal components of recent sessions for /api/session/<id>/modify (0 disables)
+    COMPONENT_CACHE_MAX_BYTES = _env_int('COMPONENT_CACHE_MAX_BYTES', 512 * 1024 ** 2)  # 512 MiB
+    COMPONENT_CACHE_MAX_SESSIONS = _env_int('COMPONENT_CACHE_MAX_SESSIONS', 64)
+
+    # Admission control: estimated peak memory of the generate requests running at once (0 disables)
+    ADMISSION_MEMORY_BUDGET = _env_int('ADMISSION_MEMORY_BUDGET', 1024 ** 3)  # 1 GiB
+    ADMISSION_MAX_QUEUE = _env_int('ADMISSION_MAX_QUEUE', 16)  # requests waiting for memory
+    ADMISSION_QUEUE_TIMEOUT = _env_int('ADMISSION_QUEUE_TIMEOUT', 30)  # seconds before answering 503
+    STREAM_BLOCK_SAMPLES = _env_int('STREAM_BLOCK_SAMPLES', 2 ** 17)  # per channel, for chunked EEG records
+
+    # Output stages of a record (CSV, features, plot) run alongside each other once it is saved
+    OUTPUT_THREADS = _env_int('OUTPUT_THREADS', 8)  # 0 runs them one after the other
+    RENDER_PROCESSES = _env_int('RENDER_PROCESSES', 0)  # forked processes for CSV and plots (0 uses threads)
+
+    # Merge concurrent EEG generate requests with the same shape into one batch (0 disables)
+    COALESCE_WINDOW_MS = _env_int('COALESCE_WINDOW_MS', 20)  # how long the first request waits for others
+    COALESCE_MAX_BATCH = _env_int('COALESCE_MAX_BATCH', 16)
+
+    # Production server (serve.py): preforked workers sharing the warmed-up master state
+    PREFORK = _env_bool('PREFORK')  # set by serve.py, defers background threads to the workers
+    SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+    SERVER_PORT = _env_int('SERVER_PORT', 5000)
+    SERVER_WORKERS = _env_int('SERVER_WORKERS', 0)  # 0 sizes the pool from the CPU count
+    SERVER_WORKERS_PER_CORE = _env_int('SERVER_WORKERS_PER_CORE', 1)
+    SERVER_MAX_REQUESTS = _env_int('SERVER_MAX_REQUESTS', 1000)  # requests before a worker is recycled (0 never)
+    SERVER_MAX_REQUESTS_JITTER = _env_int('SERVER_MAX_REQUESTS_JITTER', 50)  # spreads recycling out
+    SERVER_GRACEFUL_TIMEOUT = _env_int('SERVER_GRACEFUL_TIMEOUT', 30)  # seconds to finish in-flight requests
@@ -0,0 +1,123 @@
+import gzip
+import os
+import shutil
+import zipfile
+
+try:
+    import zstandard
+except ImportError:  # zstd encoding is only offered when the package is installed
+    zstandard = None
+
+# Suffix of the cached precompressed copy for each content encoding
+ENCODING_SUFFIXES = {
+    "zstd": ".zst",
+    "gzip": ".gz"
+}
+
+# Artifact types worth compressing (plots are already compressed PNGs)
+COMPRESSIBLE_TYPES = ('csv', 'features')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def supported_encodings():
+    """Content encodings this server can produce, in order of preference"""
+    encodings = ["gzip"]
+    if zstandard is not None:
+        encodings.insert(0, "zstd")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the preferred content encoding accepted by the client"""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token] = quality
+
+    for encoding in supported_encodings():
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def precompressed_path(path, encoding):
+    """Return a cached compressed copy of a file, creating it if needed"""
+    target = path + ENCODING_SUFFIXES[encoding]
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+
+    # Write to a temporary name so concurrent requests never see partial files
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with open(path, 'rb') as src:
+        if encoding == "gzip":
+            with gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        else:
+            with open(tmp_path, 'wb') as raw:
+                compressor = zstandard.ZstdCompressor(level=3)
+                with compressor.stream_writer(raw) as dst:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.replace(tmp_path, target)
+    return target
+
+
+class _ChunkBuffer:
+    """Write-only sink that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files):
+    """Yield a zip archive of (arcname, path) pairs chunk by chunk"""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in files:
+            compress_type = zipfile.ZIP_STORED if path.endswith('.png') else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compress_type
+            force_zip64 = info.file_size > zipfile.ZIP64_LIMIT
+            with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=force_zip64) as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
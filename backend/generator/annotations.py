@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import numpy as np
+
+# Event codes stored in the annotation sidecar. Codes are part of the file
+# format: add new events with new codes, never renumber.
+EVENT_CODES = {
+    # EEG patterns
+    "spike": 1,
+    "spike_wave": 2,
+    "polyspike": 3,
+    "hypsarrhythmia": 4,
+    "triphasic_wave": 5,
+    "periodic_discharge": 6,
+    "burst": 7,
+    "suppression": 8,
+    "spindle": 9,
+    # Artifacts
+    "blink": 20,
+    "emg": 21,
+    "electrode_pop": 22,
+    "motion": 23,
+    # ECG
+    "r_peak": 40,
+    "dropped_beat": 41
+}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+# Event log collecting annotations for the synthesis running in this context
+_active_log = ContextVar('active_event_log', default=None)
+# Channels marked by annotate() calls that name none, e.g. the channels a latent source reaches
+_default_channels = ContextVar('default_event_channels', default=None)
+
+
+def annotation_dtype(n_channels):
+    """Record layout of the sidecar: onset and duration in samples, event code and a channel bitmask"""
+    return np.dtype([("onset", "<i8"), ("duration", "<i4"), ("code", "<u2"),
+                     ("channels", "u1", ((n_channels + 7) // 8,))])
+
+
+class EventLog:
+    """Ground-truth events placed while a signal is synthesized
+
+    Generators call annotate() as they place events; the calls land in the
+    log activated for the current context and are no-ops otherwise. Onsets
+    are relative to the block being synthesized: window() shifts them for
+    records generated block by block and drops events that start past the
+    block. Channels are indices into the signal's channels, None for all.
+    """
+
+    def __init__(self):
+        self.groups = []  # (onsets, durations, code, channels)
+        self.offset = 0
+        self.limit = None
+
+    def __len__(self):
+        return sum(len(onsets) for onsets, _, _, _ in self.groups)
+
+    @contextmanager
+    def activate(self):
+        """Make this log collect the events of the current context"""
+        token = _active_log.set(self)
+        try:
+            yield self
+        finally:
+            _active_log.reset(token)
+
+    @contextmanager
+    def window(self, offset, n_samples):
+        """Record the events of a block starting `offset` samples into the record"""
+        previous = self.offset, self.limit
+        self.offset, self.limit = offset, n_samples
+        try:
+            yield self
+        finally:
+            self.offset, self.limit = previous
+
+    def add(self, onsets, durations, name, channels=None):
+        onsets = np.atleast_1d(np.asarray(onsets, dtype=np.int64))
+        durations = np.broadcast_to(np.asarray(durations, dtype=np.int64), onsets.shape)
+        if self.limit is not None:
+            inside = onsets < self.limit
+            onsets, durations = onsets[inside], durations[inside]
+        if len(onsets):
+            channels = None if channels is None else np.asarray(channels, dtype=np.int64)
+            self.groups.append((onsets + self.offset, durations, EVENT_CODES[name], channels))
+
+    def shifted(self, first_channel, n_channels):
+        """Copy whose channels index a record where this signal's channels start at first_channel"""
+        log = EventLog()
+        for onsets, durations, code, channels in self.groups:
+            channels = np.arange(n_channels) if channels is None else channels
+            log.groups.append((onsets, durations, code, channels + first_channel))
+        return log
+
+    @classmethod
+    def merge(cls, logs):
+        log = cls()
+        for other in logs:
+            log.groups.extend(other.groups)
+        return log
+
+    def to_array(self, n_channels, n_samples):
+        """Events sorted by onset as an annotation_dtype array, clipped to the record, duplicates merged"""
+        events = np.zeros(len(self), dtype=annotation_dtype(n_channels))
+        mask = np.zeros((len(events), n_channels), dtype=bool)
+        start = 0
+        for onsets, durations, code, channels in self.groups:
+            end = start + len(onsets)
+            events["onset"][start:end] = onsets
+            events["duration"][start:end] = np.minimum(durations, n_samples - onsets)
+            events["code"][start:end] = code
+            mask[start:end, slice(None) if channels is None else channels] = True
+            start = end
+        inside = events["onset"] < n_samples
+        events, mask = events[inside], mask[inside]
+        # Sources placing events at the same times (e.g. periodic patterns) give one event on all their channels
+        key = np.stack([events["onset"], events["duration"], events["code"]], axis=1)
+        _, first, inverse = np.unique(key, axis=0, return_index=True, return_inverse=True)
+        merged = np.zeros((len(first), n_channels), dtype=bool)
+        np.logical_or.at(merged, inverse.reshape(-1), mask)
+        order = np.argsort(first)
+        events = events[first[order]]
+        events["channels"] = np.packbits(merged[order], axis=1, bitorder='little')
+        return events[np.argsort(events["onset"], kind='stable')]
+
+
+def annotate(onsets, durations, name, channels=None):
+    """Record events (onset and duration in samples) in the active event log, if any"""
+    log = _active_log.get()
+    if log is not None:
+        log.add(onsets, durations, name, _default_channels.get() if channels is None else channels)
+
+
+@contextmanager
+def on_channels(channels):
+    """Annotate the events placed in this context without channels of their own on `channels`"""
+    token = _default_channels.set(channels)
+    try:
+        yield
+    finally:
+        _default_channels.reset(token)
+
+
+def recording_events():
+    """Whether an event log is collecting in this context"""
+    return _active_log.get() is not None
+
+
+def channel_mask(events, n_channels):
+    """(events x channels) boolean mask of the channels each event covers"""
+    return np.unpackbits(events["channels"], axis=1, count=n_channels, bitorder='little').astype(bool)
+
+
+def select_events(events, start, end, max_duration, codes=None, channels=None):
+    """Events overlapping samples [start, end), optionally of some codes or touching some channels
+
+    `events` is sorted by onset, so the search only scans the events that
+    start within max_duration before the window.
+    """
+    first = np.searchsorted(events["onset"], start - max_duration, side='left')
+    last = np.searchsorted(events["onset"], end, side='left')
+    window = events[first:last]
+    keep = window["onset"] + window["duration"] > start
+    if codes is not None:
+        keep &= np.isin(window["code"], codes)
+    if channels is not None:
+        keep &= channel_mask(window, max(channels) + 1)[:, channels].any(axis=1)
+    return window[keep]
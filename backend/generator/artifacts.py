@@ -0,0 +1,301 @@
+import json
+import numpy as np
+from .annotations import annotate
+
+# Artifact stages add to a whole (channels x samples) block at once. Waveforms
+# shared by all channels (wander, mains, blink and motion shapes) are computed
+# once per block and spread over the channels with per-channel gains. Stages
+# keep their random state, phases and the tails of events that run past the
+# end of a block, so a record produced chunk by chunk stays continuous across
+# chunk boundaries. Default parameters are in microvolts (EEG scale).
+
+# Direction of the eyes on the unit head sphere (in front of and below Fpz)
+EYES = np.array([0.0, np.cos(np.deg2rad(10)), -np.sin(np.deg2rad(10))])
+
+
+class ArtifactStage:
+    """Base class of a pipeline stage with validated parameters"""
+
+    name = None
+    defaults = {}
+    needs_montage = False
+
+    def __init__(self, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {self.name}: {', '.join(sorted(unknown))}")
+        for key, value in params.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"{self.name}.{key} must be a non-negative number")
+        self.params = {**self.defaults, **params}
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        """Fix the shape, rate and random generator used by every later block"""
+        self.n_channels = n_channels
+        self.sampling_rate = sampling_rate
+        self.montage = montage
+        self.rng = rng
+
+    def apply(self, block, offset):
+        """Add the stage to a block whose first sample is `offset` samples into the record"""
+        raise NotImplementedError
+
+    def _time(self, n_samples, offset):
+        return (offset + np.arange(n_samples)) / self.sampling_rate
+
+
+class BaselineWander(ArtifactStage):
+    """Slow drift and respiratory baseline shared by all channels"""
+
+    name = "wander"
+    defaults = {"amplitude": 10.0, "frequency": 0.1, "respiration": 0.0, "respiration_frequency": 0.2}
+
+    def apply(self, block, offset):
+        p = self.params
+        t = self._time(block.shape[1], offset)
+        wave = p["amplitude"] * np.sin(2 * np.pi * p["frequency"] * t)
+        if p["respiration"]:
+            wave += p["respiration"] * np.sin(2 * np.pi * p["respiration_frequency"] * t)
+        block += wave.astype(block.dtype)
+
+
+class MainsInterference(ArtifactStage):
+    """Power line hum with odd harmonics and a different coupling per electrode"""
+
+    name = "mains"
+    defaults = {"amplitude": 2.0, "frequency": 50.0, "harmonics": 3}
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        super().bind(n_channels, sampling_rate, montage, rng)
+        self.gains = rng.uniform(0.5, 1.5, n_channels)
+        self.phase = rng.uniform(0, 2 * np.pi)
+
+    def apply(self, block, offset):
+        p = self.params
+        t = self._time(block.shape[1], offset)
+        wave = np.zeros(block.shape[1])
+        for k in range(1, 2 * int(p["harmonics"]), 2):
+            if k * p["frequency"] < self.sampling_rate / 2:
+                wave += np.sin(2 * np.pi * k * p["frequency"] * t + k * self.phase) / k
+        block += np.multiply.outer(self.gains * p["amplitude"], wave).astype(block.dtype)
+
+
+class SensorNoise(ArtifactStage):
+    """White amplifier noise, independent on every channel"""
+
+    name = "noise"
+    defaults = {"scale": 1.0}
+
+    def apply(self, block, offset):
+        # Drawn in float64 row by row, so a seed gives the same noise in every dtype
+        # without a float64 copy of the whole block
+        scale = self.params["scale"]
+        for row in block:
+            row += self.rng.standard_normal(block.shape[1]) * scale
+
+
+class EventStage(ArtifactStage):
+    """Stage made of short events placed at random with a given rate per minute
+
+    Each event renders a (channels x length) kernel. The part of a kernel
+    that runs past the end of a block is kept and added to the next block.
+    Events are annotated on the channels that get at least a tenth of the
+    event's largest amplitude.
+    """
+
+    event = None  # annotation event name
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        super().bind(n_channels, sampling_rate, montage, rng)
+        self.length = max(1, int(self.params["duration"] * sampling_rate))
+        self.carry = np.zeros((n_channels, self.length))
+
+    def kernel(self):
+        raise NotImplementedError
+
+    def apply(self, block, offset):
+        n_samples = block.shape[1]
+        head = min(n_samples, self.length)
+        block[:, :head] += self.carry[:, :head]
+        carry = np.zeros_like(self.carry)
+        carry[:, :self.length - head] = self.carry[:, head:]
+
+        n_events = self.rng.poisson(self.params["rate"] * n_samples / self.sampling_rate / 60)
+        for start in self.rng.integers(0, n_samples, n_events):
+            kernel = self.kernel()
+            peaks = np.abs(kernel).max(axis=1)
+            annotate(start, self.length, self.event, np.flatnonzero(peaks >= 0.1 * peaks.max()))
+            inside = min(self.length, n_samples - start)
+            block[:, start:start + inside] += kernel[:, :inside]
+            carry[:, :self.length - inside] += kernel[:, inside:]
+        self.carry = carry
+
+
+class EyeBlinks(EventStage):
+    """Blinks: one smooth bump per event, decaying with distance from the eyes"""
+
+    name = "blinks"
+    event = "blink"
+    defaults = {"rate": 12.0, "amplitude": 100.0, "duration": 0.4}
+    needs_montage = True
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        super().bind(n_channels, sampling_rate, montage, rng)
+        shape = np.sin(np.linspace(0, np.pi, self.length)) ** 2
+        # Frontal electrodes see the full blink, central ones a small fraction
+        self.shared = np.multiply.outer(montage.focal_gain(EYES, width_deg=35), shape)
+
+    def kernel(self):
+        return self.shared * (self.params["amplitude"] * self.rng.uniform(0.7, 1.3))
+
+
+class MuscleBursts(EventStage):
+    """EMG: bursts of broadband activity around a random electrode"""
+
+    name = "emg"
+    event = "emg"
+    defaults = {"rate": 4.0, "amplitude": 20.0, "duration": 0.5}
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        super().bind(n_channels, sampling_rate, montage, rng)
+        self.envelope = np.hanning(self.length)
+
+    def kernel(self):
+        if self.montage is not None:
+            gains = self.montage.focal_gain(self.montage.positions[self.rng.integers(self.n_channels)],
+                                            width_deg=25)
+        else:
+            gains = self.rng.uniform(0.2, 1.0, self.n_channels)
+        burst = self.rng.standard_normal((self.n_channels, self.length)) * self.envelope
+        return burst * (gains * self.params["amplitude"])[:, None]
+
+
+class ElectrodePops(EventStage):
+    """Sudden impedance changes: a step on one electrode that decays back"""
+
+    name = "pops"
+    event = "electrode_pop"
+    defaults = {"rate": 1.0, "amplitude": 150.0, "duration": 1.0, "decay": 0.2}
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        super().bind(n_channels, sampling_rate, montage, rng)
+        self.shape = np.exp(-np.arange(self.length) / max(self.params["decay"] * sampling_rate, 1))
+
+    def kernel(self):
+        kernel = np.zeros((self.n_channels, self.length))
+        sign = self.rng.choice((-1, 1))
+        kernel[self.rng.integers(self.n_channels)] = sign * self.params["amplitude"] * self.shape
+        return kernel
+
+
+class MotionArtifacts(EventStage):
+    """Head or cable movement: a slow swing seen by all channels with different gains"""
+
+    name = "motion"
+    event = "motion"
+    defaults = {"rate": 1.0, "amplitude": 80.0, "duration": 1.5}
+
+    def bind(self, n_channels, sampling_rate, montage, rng):
+        super().bind(n_channels, sampling_rate, montage, rng)
+        self.shape = np.sin(np.linspace(0, 2 * np.pi, self.length)) * np.hanning(self.length)
+
+    def kernel(self):
+        gains = self.rng.uniform(0.3, 1.0, self.n_channels) * self.rng.choice((-1, 1))
+        return np.multiply.outer(gains * self.params["amplitude"], self.shape)
+
+
+ARTIFACT_STAGES = {
+    stage.name: stage
+    for stage in (BaselineWander, MainsInterference, SensorNoise,
+                  MuscleBursts, ElectrodePops, EyeBlinks, MotionArtifacts)
+}
+
+# Default artifacts of each signal; a request's `artifacts` is merged on top
+EEG_ARTIFACTS = {
+    "normal": {"wander": {"amplitude": 10.0, "frequency": 0.1}, "blinks": {}},
+    "abnormal": {}
+}
+ECG_ARTIFACTS = {
+    "wander": {"amplitude": 0.1, "frequency": 0.1, "respiration": 0.05, "respiration_frequency": 0.2},
+    "noise": {"scale": 0.05}
+}
+
+# Millivolt amplitudes for stages enabled on ECG requests
+ECG_STAGE_DEFAULTS = {
+    "wander": {"amplitude": 0.1},
+    "mains": {"amplitude": 0.02},
+    "noise": {"scale": 0.05},
+    "emg": {"amplitude": 0.1},
+    "pops": {"amplitude": 0.5},
+    "motion": {"amplitude": 0.3}
+}
+
+
+def resolve_artifacts(defaults, overrides=None, stage_defaults=None, montage=True):
+    """Merge per-request stage settings onto defaults, returning {stage: params}
+
+    A stage set to false or null is removed, a dict updates its parameters
+    and true enables it with its defaults. Stages enabled by the request
+    start from `stage_defaults`. Raises ValueError for unknown stages or
+    parameters.
+    """
+    if overrides is not None and not isinstance(overrides, dict):
+        raise ValueError("Artifacts must map stage names to parameters")
+    config = {name: dict(params) for name, params in defaults.items()}
+    for name, params in (overrides or {}).items():
+        if name not in ARTIFACT_STAGES:
+            raise ValueError(f"Unknown artifact stage: {name}. Available: {', '.join(ARTIFACT_STAGES)}")
+        if params is None or params is False:
+            config.pop(name, None)
+            continue
+        if params is True:
+            params = {}
+        elif not isinstance(params, dict):
+            raise ValueError(f"Settings of {name} must be an object, true or false")
+        if name not in config:
+            config[name] = dict((stage_defaults or {}).get(name, {}))
+        config[name].update(params)
+
+    for name, params in config.items():
+        stage = ARTIFACT_STAGES[name]
+        if stage.needs_montage and not montage:
+            raise ValueError(f"The {name} stage needs electrode positions")
+        stage(**params)  # validates the parameters
+    return config
+
+
+def artifacts_key(config):
+    """Stable key of a stage configuration, used to tell cached components apart"""
+    return json.dumps(config, sort_keys=True)
+
+
+class ArtifactPipeline:
+    """Ordered artifact stages applied to consecutive blocks of one record"""
+
+    def __init__(self, config, n_channels, sampling_rate, montage=None, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.stages = []
+        for name, params in config.items():
+            stage = ARTIFACT_STAGES[name](**params)
+            stage.bind(n_channels, sampling_rate, montage, self.rng)
+            self.stages.append(stage)
+        self.n_channels = n_channels
+        self.offset = 0
+
+    def __bool__(self):
+        return bool(self.stages)
+
+    def apply(self, block, offset=None):
+        """Add every stage to a (channels x samples) block in place and return it
+
+        Blocks are taken to follow each other unless an explicit offset is given.
+        """
+        offset = self.offset if offset is None else offset
+        for stage in self.stages:
+            stage.apply(block, offset)
+        self.offset = offset + block.shape[1]
+        return block
+
+    def render(self, n_samples, dtype=np.float64):
+        """The artifacts of the next n_samples on their own"""
+        return self.apply(np.zeros((self.n_channels, n_samples), dtype=dtype))
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+
+class ComponentCache:
+    """Bounded LRU of the signal components that make up each session
+
+    An entry holds the generation parameters, the components as
+    {name: (key, array)}, the gains used to mix them and the annotated
+    events of each component. The key records
+    the inputs a component was synthesized from. A later edit only has to
+    synthesize the components whose key changed. Arrays are read-only
+    and may be shared between a session and the sessions derived from it.
+    """
+
+    def __init__(self, max_bytes, max_sessions=64):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(components):
+        return sum(array.nbytes for _, array in components.values())
+
+    def put(self, session_id, params, components, gains, events=None):
+        """Cache the components of a session, evicting old sessions to stay in budget"""
+        size = self._size(components)
+        if size > self.max_bytes:
+            return False
+        for _, array in components.values():
+            array.setflags(write=False)
+
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old["size"]
+            while self._entries and (self._bytes + size > self.max_bytes
+                                     or len(self._entries) >= self.max_sessions):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+            self._entries[session_id] = {
+                "params": dict(params),
+                "components": dict(components),
+                "gains": dict(gains),
+                "events": dict(events or {}),
+                "size": size
+            }
+            self._bytes += size
+        return True
+
+    def get(self, session_id):
+        """Cached entry of a session, or None if it was never cached or was evicted"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self._hits += 1
+            return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses
+            }
@@ -1,44 +1,163 @@
 import numpy as np
-import pandas as pd
-import neurokit2 as nk
 from .utils import (
-    extract_hrv_features, create_ecg_plot, save_data_to_csv, save_features_to_csv
+    nk, resolve_dtype, extract_hrv_features, make_random_state, random_state, use_random_state,
+    save_annotations, save_data_to_npy, save_features_to_csv, save_pyramid, save_signal_metadata, current_quality,
+    quality_tier, use_quality
 )
+from .instrumentation import StageTimer, stage
+from .outputs import OutputStages, render_ecg_plot, write_csv
+from .annotations import EventLog, annotate, recording_events
+from .leads import axis, dipole_trajectory, project_leads
+from .artifacts import ECG_ARTIFACTS, ECG_STAGE_DEFAULTS, ArtifactPipeline, resolve_artifacts
+
+# Available types and subtypes, as served by the API
+ECG_TYPES = {
+    "normal": {
+        "Normal Sinus Rhythm": "normal_sinus",
+        "Sinus Bradycardia": "sinus_bradycardia",
+        "Sinus Tachycardia": "sinus_tachycardia"
+    },
+    "abnormal": {
+        "First Degree Heart Block": "first_degree_block",
+        "Second Degree Mobitz I": "second_degree_mobitz1",
+        "Second Degree Mobitz II": "second_degree_mobitz2",
+        "Third Degree Heart Block": "third_degree_block",
+        "Left Bundle Branch Block": "lbbb",
+        "Right Bundle Branch Block": "rbbb",
+        "STEMI": "stemi",
+        "NSTEMI": "nstemi",
+        "Atrial Fibrillation": "atrial_fibrillation",
+        "Ventricular Tachycardia": "ventricular_tachycardia",
+        "Hyperkalemia": "hyperkalemia",
+        "Hypokalemia": "hypokalemia",
+        "Pericarditis": "pericarditis",
+        "Pulmonary Embolism": "pulmonary_embolism",
+        "Digitalis Effect": "digitalis_effect"
+    }
+}
+
+# Dipole directions (Frank X/Y/Z) that differ from the normal heart, per cardiac phase
+VCG_AXES = {
+    "lbbb": {"QRS": axis(-10, 0.8), "T": axis(170, -0.8)},
+    "rbbb": {"QRS_late": axis(180, -0.8)},
+    "stemi": {"T": axis(20, -1.2)},
+    "ventricular_tachycardia": {"QRS": axis(-90, -0.5), "T": axis(90, 0.5)},
+    "pulmonary_embolism": {"QRS": axis(110, 0.0), "T": axis(45, 0.5)}
+}
 
 class ECGGenerator:
     def __init__(self):
         self.sampling_rate = 256
         
-    def generate(self, ecg_type, duration=30, sampling_rate=256, session_id=None):
-        """Generate synthetic ECG data based on type"""
+    def generate(self, ecg_type, duration=30, sampling_rate=256, session_id=None,
+                 leads=None, dtype=None, artifacts=None, seed=None, trace_memory=False, outputs=None,
+                 quality=None):
+        """Generate synthetic ECG data based on type
+        
+        Without `leads` a single ECG column is produced. With a lead set
+        ("12", "frank", ...), a list of lead names or custom lead vectors,
+        every lead is derived from one vectorcardiogram. `artifacts` adjusts
+        the default baseline wander and noise stages. The same seed gives
+        the same record. quality picks a tier of utils.QUALITY_TIERS; it sets
+        the HRV features and the plot, the simulated signal is the same. Pass
+        OutputStages(wait=False) as outputs to return once the record is
+        saved, before its CSV, features and plot are.
+        """
+        dtype = resolve_dtype(dtype)
+        artifacts = self.artifact_config(artifacts)
+        timer = StageTimer(trace_memory=trace_memory)
+        with use_random_state(make_random_state(seed)), use_quality(quality), timer.activate():
+            result = self._generate(ecg_type, duration, sampling_rate, session_id, leads, dtype, artifacts,
+                                    outputs)
+        result["seed"] = seed
+        result["timings"] = timer.to_dict()
+        return result
+    
+    def artifact_config(self, artifacts=None):
+        """Artifact stages of a request, in millivolts, updated by `artifacts`"""
+        return resolve_artifacts(ECG_ARTIFACTS, artifacts, ECG_STAGE_DEFAULTS, montage=False)
+    
+    def _generate(self, ecg_type, duration, sampling_rate, session_id, leads=None, dtype=np.float64,
+                  artifacts=None, outputs=None):
+        if artifacts is None:
+            artifacts = self.artifact_config()
         n_samples = duration * sampling_rate
         
-        if ecg_type in ['normal_sinus', 'sinus_bradycardia', 'sinus_tachycardia']:
-            ecg_data = self._generate_normal_ecg(ecg_type, n_samples, sampling_rate)
-        else:
-            ecg_data = self._generate_abnormal_ecg(ecg_type, n_samples, sampling_rate)
-        
-        # Create DataFrame
-        df = pd.DataFrame({"ECG": ecg_data})
+        events = EventLog()
+        with events.activate():
+            lead_names, lead_data, _ = self.synthesize(ecg_type, n_samples, sampling_rate, leads, dtype, artifacts)
+        annotations = events.to_array(len(lead_names), n_samples)
+        ecg_data = lead_data if leads is None else self.rhythm_lead(lead_names, lead_data)
+        record = np.atleast_2d(lead_data)
+        outputs = outputs or OutputStages()
         
         # Save data
-        csv_path = save_data_to_csv(df, session_id, 'ecg')
-        
-        # Extract HRV features
-        features = extract_hrv_features(ecg_data, sampling_rate)
-        features_path = save_features_to_csv(features, session_id)
+        npy_path = save_data_to_npy(record, session_id, sync=not outputs.wait)
+        pyramid_path, pyramid_levels = save_pyramid(lead_data, session_id)
+        annotations_path = save_annotations(annotations, session_id)
+        meta_path = save_signal_metadata(session_id, lead_names, sampling_rate, 'ecg', pyramid_levels,
+                                         events=annotations)
         
-        # Create plot
+        # CSV, HRV features and plot only read the saved record
         title = f"ECG - {ecg_type.replace('_', ' ').title()}"
-        plot_path = create_ecg_plot(df, title, session_id, sampling_rate)
-        
-        return {
-            "csv_path": csv_path,
-            "features_path": features_path,
-            "plot_path": plot_path,
+        tier = quality_tier()
+        outputs.render("csv", write_csv, record, npy_path, lead_names, session_id, 'ecg')
+        outputs.render("plot", render_ecg_plot, record, npy_path, lead_names, title, session_id, sampling_rate,
+                       tier["plot_dpi"], tier["plot_seconds"])
+        outputs.thread("features", lambda: save_features_to_csv(extract_hrv_features(ecg_data, sampling_rate),
+                                                                session_id))
+        paths, pending = outputs.finish()
+        
+        result = {
+            "csv_path": paths.get("csv"),
+            "npy_path": npy_path,
+            "meta_path": meta_path,
+            "pyramid_path": pyramid_path,
+            "features_path": paths.get("features"),
+            "plot_path": paths.get("plot"),
+            "annotations_path": annotations_path,
+            "annotations": len(annotations),
+            "ecg_type": ecg_type,
+            "leads": lead_names,
+            "dtype": lead_data.dtype.name,
+            "artifacts": artifacts,
+            "quality": current_quality(),
             "duration": duration,
             "sampling_rate": sampling_rate
         }
+        if pending:
+            result["pending"] = pending
+        return result
+    
+    def synthesize(self, ecg_type, n_samples, sampling_rate, leads=None, dtype=np.float64, artifacts=None):
+        """Simulate a record without saving it, returning (lead names, lead data, clean heart signal)
+        
+        Lead data is one array without `leads`, (leads x samples) with them.
+        The clean signal is the simulated single lead before any artifacts.
+        R peaks of the clean signal and dropped beats are annotated in the
+        active event log.
+        """
+        with stage('synthesis'):
+            if ecg_type in ['normal_sinus', 'sinus_bradycardia', 'sinus_tachycardia']:
+                clean = self._generate_normal_ecg(ecg_type, n_samples, sampling_rate)
+            else:
+                clean = self._generate_abnormal_ecg(ecg_type, n_samples, sampling_rate)
+        clean = clean.astype(dtype, copy=False)
+        r_peaks = None
+        if leads is not None or recording_events():
+            r_peaks = self._find_r_peaks(clean, sampling_rate)
+            annotate(r_peaks, 1, "r_peak")
+        
+        if leads is None:
+            return ["ECG"], self._add_realistic_variations(clean, sampling_rate, artifacts), clean
+        with stage('lead_projection'):
+            lead_names, lead_data = self._project_leads(ecg_type, clean, sampling_rate, leads, artifacts, r_peaks)
+        return lead_names, lead_data, clean
+    
+    @staticmethod
+    def rhythm_lead(lead_names, lead_data):
+        """Lead used for rhythm analysis: lead II when it is available"""
+        return lead_data[lead_names.index("II") if "II" in lead_names else 0]
     
     def _generate_normal_ecg(self, ecg_type, n_samples, sampling_rate):
         """Generate normal ECG patterns"""
@@ -52,21 +171,22 @@ class ECGGenerator:
             heart_rate = 75
             
         # Generate base ECG using neurokit2
-        ecg = nk.ecg_simulate(duration=n_samples/sampling_rate, 
-                             sampling_rate=sampling_rate, 
-                             heart_rate=heart_rate)
-        
-        # Add realistic variations
-        ecg = self._add_realistic_variations(ecg, sampling_rate)
+        with stage('ecg_simulate'):
+            ecg = nk.ecg_simulate(duration=n_samples/sampling_rate, 
+                                 sampling_rate=sampling_rate, 
+                                 heart_rate=heart_rate,
+                                 random_state=random_state().randint(2 ** 31))
         
         return ecg
     
     def _generate_abnormal_ecg(self, ecg_type, n_samples, sampling_rate):
         """Generate abnormal ECG patterns"""
         # Start with normal ECG
-        base_ecg = nk.ecg_simulate(duration=n_samples/sampling_rate, 
-                                  sampling_rate=sampling_rate, 
-                                  heart_rate=75)
+        with stage('ecg_simulate'):
+            base_ecg = nk.ecg_simulate(duration=n_samples/sampling_rate, 
+                                      sampling_rate=sampling_rate, 
+                                      heart_rate=75,
+                                      random_state=random_state().randint(2 ** 31))
         
         if ecg_type == 'first_degree_block':
             ecg = self._add_first_degree_block(base_ecg, sampling_rate)
@@ -101,29 +221,34 @@ class ECGGenerator:
         else:
             ecg = base_ecg
         
-        # Add realistic variations
-        ecg = self._add_realistic_variations(ecg, sampling_rate)
-        
         return ecg
     
-    def _add_realistic_variations(self, ecg, sampling_rate):
-        """Add realistic variations to ECG signal"""
-        # Add baseline wander
-        t = np.linspace(0, len(ecg)/sampling_rate, len(ecg))
-        baseline_wander = 0.1 * np.sin(2 * np.pi * 0.1 * t)
-        
-        # Add muscle artifact
-        muscle_artifact = np.random.normal(0, 0.05, len(ecg))
-        
-        # Add respiratory variation
-        respiratory = 0.05 * np.sin(2 * np.pi * 0.2 * t)
-        
-        return ecg + baseline_wander + muscle_artifact + respiratory
+    def _project_leads(self, ecg_type, ecg, sampling_rate, leads, artifacts, r_peaks=None):
+        """Derive all requested leads from one cardiac dipole trajectory"""
+        if r_peaks is None:
+            r_peaks = self._find_r_peaks(ecg, sampling_rate)
+        vcg = dipole_trajectory(ecg, r_peaks, sampling_rate, VCG_AXES.get(ecg_type))
+        names, lead_data = project_leads(vcg, leads)
+        
+        # Noise and baseline wander are picked up by each electrode separately
+        return names, self._add_realistic_variations(lead_data, sampling_rate, artifacts)
+    
+    def _find_r_peaks(self, ecg, sampling_rate):
+        """Find R peak sample indices"""
+        with stage('ecg_peaks'):
+            return nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+    
+    def _add_realistic_variations(self, ecg, sampling_rate, artifacts):
+        """Run the artifact pipeline over one lead or a (leads x samples) block"""
+        # Copied so float32 records stay float32 and the clean signal is untouched
+        block = np.array(np.atleast_2d(ecg))
+        ArtifactPipeline(artifacts, block.shape[0], sampling_rate,
+                         seed=random_state().randint(2 ** 31)).apply(block)
+        return block.reshape(ecg.shape)
     
     def _add_first_degree_block(self, ecg, sampling_rate):
         """Add first degree AV block (prolonged PR interval)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         # Prolong PR interval by adding delay to P waves
         modified_ecg = ecg.copy()
@@ -139,8 +264,7 @@ class ECGGenerator:
     
     def _add_second_degree_mobitz1(self, ecg, sampling_rate):
         """Add second degree AV block Mobitz I (Wenckebach)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         dropped_beats = 0
@@ -151,14 +275,14 @@ class ECGGenerator:
                 start = max(0, r_peak - 50)
                 end = min(len(ecg), r_peak + 50)
                 modified_ecg[start:end] = 0
+                annotate(start, end - start, "dropped_beat")
                 dropped_beats += 1
         
         return modified_ecg
     
     def _add_second_degree_mobitz2(self, ecg, sampling_rate):
         """Add second degree AV block Mobitz II (fixed PR, sudden drops)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -168,13 +292,13 @@ class ECGGenerator:
                 start = max(0, r_peak - 50)
                 end = min(len(ecg), r_peak + 50)
                 modified_ecg[start:end] = 0
+                annotate(start, end - start, "dropped_beat")
         
         return modified_ecg
     
     def _add_third_degree_block(self, ecg, sampling_rate):
         """Add third degree AV block (complete dissociation)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -185,6 +309,7 @@ class ECGGenerator:
                 start = max(0, r_peak - 50)
                 end = min(len(ecg), r_peak + 50)
                 modified_ecg[start:end] = 0
+                annotate(start, end - start, "dropped_beat")
         
         # Add atrial activity (P waves) at different rate
         t = np.linspace(0, len(ecg)/sampling_rate, len(ecg))
@@ -200,8 +325,7 @@ class ECGGenerator:
     
     def _add_lbbb(self, ecg, sampling_rate):
         """Add left bundle branch block"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -225,8 +349,7 @@ class ECGGenerator:
     
     def _add_rbbb(self, ecg, sampling_rate):
         """Add right bundle branch block"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -250,8 +373,7 @@ class ECGGenerator:
     
     def _add_stemi(self, ecg, sampling_rate):
         """Add ST elevation myocardial infarction"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -270,8 +392,7 @@ class ECGGenerator:
     
     def _add_nstemi(self, ecg, sampling_rate):
         """Add non-ST elevation myocardial infarction"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -290,29 +411,28 @@ class ECGGenerator:
     
     def _add_atrial_fibrillation(self, ecg, sampling_rate):
         """Add atrial fibrillation (irregular rhythm)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
         # Remove some R peaks to create irregular rhythm
         for i, r_peak in enumerate(r_peaks):
-            if np.random.random() < 0.2:  # Randomly drop 20% of beats
+            if random_state().random_sample() < 0.2:  # Randomly drop 20% of beats
                 start = max(0, r_peak - 50)
                 end = min(len(ecg), r_peak + 50)
                 modified_ecg[start:end] = 0
+                annotate(start, end - start, "dropped_beat")
         
         # Add fibrillatory waves
         t = np.linspace(0, len(ecg)/sampling_rate, len(ecg))
-        fibrillatory = 0.1 * np.sin(2 * np.pi * 8 * t) * np.random.random(len(ecg))
+        fibrillatory = 0.1 * np.sin(2 * np.pi * 8 * t) * random_state().random_sample(len(ecg))
         modified_ecg += fibrillatory
         
         return modified_ecg
     
     def _add_ventricular_tachycardia(self, ecg, sampling_rate):
         """Add ventricular tachycardia"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -331,8 +451,7 @@ class ECGGenerator:
     
     def _add_hyperkalemia(self, ecg, sampling_rate):
         """Add hyperkalemia effects (peaked T waves, wide QRS)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -356,8 +475,7 @@ class ECGGenerator:
     
     def _add_hypokalemia(self, ecg, sampling_rate):
         """Add hypokalemia effects (flattened T waves, U waves)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -381,8 +499,7 @@ class ECGGenerator:
     
     def _add_pericarditis(self, ecg, sampling_rate):
         """Add pericarditis effects (diffuse ST elevation, PR depression)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -407,8 +524,7 @@ class ECGGenerator:
     
     def _add_pulmonary_embolism(self, ecg, sampling_rate):
         """Add pulmonary embolism effects (S1Q3T3 pattern, tachycardia)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
@@ -428,8 +544,7 @@ class ECGGenerator:
     
     def _add_digitalis_effect(self, ecg, sampling_rate):
         """Add digitalis effect (scooped ST, shortened QT)"""
-        # Find R peaks
-        r_peaks = nk.ecg_peaks(ecg, sampling_rate=sampling_rate)[1]['ECG_R_Peaks']
+        r_peaks = self._find_r_peaks(ecg, sampling_rate)
         
         modified_ecg = ecg.copy()
         
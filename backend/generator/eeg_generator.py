@@ -1,169 +1,573 @@
+from contextlib import nullcontext
 import numpy as np
-import pandas as pd
 from .utils import (
-    band_limited_noise, extract_band_power, create_eeg_plot, 
-    save_data_to_csv, save_features_to_csv
+    band_limited_noise, gaussian_noise, resolve_dtype, extract_band_power,
+    extract_epoch_band_power, save_data_to_npy, save_features_to_csv, save_epoch_features,
+    save_pyramid, save_annotations, save_signal_metadata, make_random_state, random_state, use_random_state,
+    current_quality, quality_tier, resolve_quality, use_quality
 )
+from .instrumentation import StageTimer, stage
+from .outputs import OutputStages, render_eeg_plot, write_csv
+from .annotations import EventLog, annotate, on_channels
+from .artifacts import EEG_ARTIFACTS, ArtifactPipeline, artifacts_key, resolve_artifacts
+from .montages import DEFAULT_MONTAGE, get_montage, source_projection
+from .streaming import (
+    CROSSFADE_SECONDS, STREAM_BLOCK_SAMPLES, BandPowerAccumulator, EpochPowerAccumulator, RecordWriter,
+    block_samples, crossfade
+)
+
+# Available types and subtypes, as served by the API
+EEG_TYPES = {
+    "normal": {
+        "Normal Awake": "normal_awake",
+        "Sleep Stage 1": "sleep_stage1",
+        "Sleep Stage 2": "sleep_stage2",
+        "Sleep Stage 3": "sleep_stage3",
+        "REM Sleep": "rem_sleep"
+    },
+    "abnormal": {
+        "Interictal Spikes": "interictal_spikes",
+        "3 Hz Spike-Wave": "spike_wave_3hz",
+        "Focal Spikes": "focal_spikes",
+        "Polyspike": "polyspike",
+        "Hypsarrhythmia": "hypsarrhythmia",
+        "Focal Slowing": "focal_slowing",
+        "Diffuse Slowing": "diffuse_slowing",
+        "Triphasic Waves": "triphasic_waves",
+        "Periodic Discharges": "periodic_discharges",
+        "Burst Suppression": "burst_suppression",
+        "Alpha Coma": "alpha_coma",
+        "Flat EEG": "flat_eeg"
+    }
+}
+
+NORMAL_EEG_TYPES = ['normal_awake', 'sleep_stage1', 'sleep_stage2', 'sleep_stage3', 'rem_sleep']
+
+
+def check_eeg_type(eeg_type):
+    """Validate an EEG type against the types served by the API"""
+    types = [value for group in EEG_TYPES.values() for value in group.values()]
+    if eeg_type not in types:
+        raise ValueError(f"Unknown EEG type: {eeg_type}. Available: {', '.join(types)}")
+    return eeg_type
+
+# Band (Hz) and amplitude of the rhythms in each latent source
+NORMAL_RHYTHMS = {
+    'normal_awake': [((8, 12), 60), ((13, 30), 30), ((30, 45), 15)],
+    'sleep_stage1': [((8, 12), 20), ((4, 8), 50), ((13, 30), 15)],
+    'sleep_stage2': [((4, 8), 60), ((1, 4), 30)],
+    'sleep_stage3': [((1, 4), 80), ((4, 8), 20)],
+    'rem_sleep': [((4, 8), 40), ((13, 30), 35), ((8, 12), 25)]
+}
+ABNORMAL_RHYTHMS = [((8, 12), 30), ((13, 30), 20), ((4, 8), 15)]
 
 class EEGGenerator:
-    def __init__(self):
-        self.eeg_channels = ['Fp1', 'Fp2', 'F3', 'F4', 'C3', 'C4', 'P3', 'P4',
-                            'O1', 'O2', 'F7', 'F8', 'T3', 'T4', 'Cz', 'Pz']
+    # Scalp locations of the focal abnormalities
+    FOCAL_SPIKE_FOCUS = 'AFz'
+    FOCAL_SLOWING_FOCI = ('T7', 'T8')
+    
+    def __init__(self, montage=DEFAULT_MONTAGE, n_sources=12, component_cache=None):
+        self.montage = get_montage(montage)
+        self.eeg_channels = self.montage.channels
+        self.n_sources = n_sources
+        self.component_cache = component_cache
+        
+    def generate(self, eeg_type, duration=30, sampling_rate=256, session_id=None,
+                 montage=None, dtype=None, gains=None, epoch_seconds=None, artifacts=None,
+                 seed=None, trace_memory=False, outputs=None, quality=None):
+        """Generate synthetic EEG data based on type, with per-epoch band power if epoch_seconds is set
         
-    def generate(self, eeg_type, duration=30, sampling_rate=256, session_id=None):
-        """Generate synthetic EEG data based on type"""
+        The same seed gives the same record at the same quality (unless the
+        noise bank is enabled). quality picks a tier of utils.QUALITY_TIERS.
+        Pass OutputStages(wait=False) as outputs to return once the record is
+        saved, before its CSV, features and plot are.
+        """
+        montage = self.montage if montage is None else get_montage(montage)
+        dtype = resolve_dtype(dtype)
+        artifacts = self.artifact_config(eeg_type, artifacts)
+        timer = StageTimer(trace_memory=trace_memory)
+        with use_random_state(make_random_state(seed)), use_quality(quality), timer.activate():
+            result = self._generate(eeg_type, duration, sampling_rate, session_id, montage, dtype, gains,
+                                    epoch_seconds=epoch_seconds, artifacts=artifacts, outputs=outputs)
+        result["seed"] = seed
+        result["timings"] = timer.to_dict()
+        return result
+    
+    def generate_chunked(self, eeg_type, duration=30, sampling_rate=256, session_id=None,
+                         montage=None, dtype=None, gains=None, epoch_seconds=None, artifacts=None,
+                         seed=None, block_size=STREAM_BLOCK_SAMPLES, trace_memory=False, quality=None):
+        """Generate a long EEG record block by block, writing each block out before the next
+        
+        Memory use depends on the block size instead of the duration. The
+        background of each block is synthesized on its own and crossfaded
+        into the previous one, artifact stages run continuously across
+        blocks, and abnormal events are placed block by block. Features are
+        accumulated as blocks are written and the plot shows the first block,
+        up to the quality tier's plot length.
+        Components are not cached, so the session cannot be modified later.
+        """
+        montage = self.montage if montage is None else get_montage(montage)
+        dtype = resolve_dtype(dtype)
+        artifacts = self.artifact_config(eeg_type, artifacts)
+        timer = StageTimer(trace_memory=trace_memory)
+        with use_random_state(make_random_state(seed)), use_quality(quality), timer.activate():
+            result = self._generate_chunked(eeg_type, duration, sampling_rate, session_id, montage, dtype,
+                                            gains, epoch_seconds, artifacts, block_samples(block_size))
+        result["seed"] = seed
+        result["timings"] = timer.to_dict()
+        return result
+    
+    def generate_batch(self, eeg_type, requests, duration=30, sampling_rate=256, montage=None, dtype=None,
+                       trace_memory=False, quality=None):
+        """Generate several records of one type and shape, synthesizing their backgrounds together
+        
+        Each request is a dict with a session_id and optional seed, gains,
+        epoch_seconds and artifacts. The background of all records is
+        filtered band by band in one pass, which is most of the synthesis
+        work; the rest runs per record. Returns one result per request, the
+        same as `generate` would return for it.
+        """
+        montage = self.montage if montage is None else get_montage(montage)
+        dtype = resolve_dtype(dtype)
         n_samples = duration * sampling_rate
-        t = np.linspace(0, duration, n_samples)
+        states = [make_random_state(request.get("seed")) for request in requests]
         
-        if eeg_type in ['normal_awake', 'sleep_stage1', 'sleep_stage2', 'sleep_stage3', 'rem_sleep']:
-            eeg_data = self._generate_normal_eeg(eeg_type, n_samples, sampling_rate)
-        else:
-            eeg_data = self._generate_abnormal_eeg(eeg_type, n_samples, sampling_rate)
+        logs = [EventLog() for _ in requests]
+        quality = resolve_quality(quality)
+        shared = StageTimer(trace_memory=trace_memory)
+        with use_quality(quality), shared.activate(), stage('synthesis'), stage('component.background'):
+            backgrounds = self._backgrounds(eeg_type, montage, n_samples, sampling_rate, dtype, states, logs)
         
-        # Create DataFrame
-        df = pd.DataFrame(eeg_data.T, columns=self.eeg_channels)
+        results = []
+        for request, state, background, log in zip(requests, states, backgrounds, logs):
+            artifacts = self.artifact_config(eeg_type, request.get("artifacts"))
+            key = self._component_keys(eeg_type, artifacts)["background"]
+            timer = StageTimer(trace_memory=trace_memory)
+            with use_random_state(state), use_quality(quality), timer.activate():
+                result = self._generate(eeg_type, duration, sampling_rate, request["session_id"], montage, dtype,
+                                        request.get("gains"), epoch_seconds=request.get("epoch_seconds"),
+                                        artifacts=artifacts, fresh={"background": (key, background)},
+                                        known_events={"background": log})
+            timer.merge(shared)
+            result["seed"] = request.get("seed")
+            result["batch_size"] = len(requests)
+            result["timings"] = timer.to_dict()
+            results.append(result)
+        return results
+    
+    def modify(self, parent_session_id, session_id=None, eeg_type=None, gains=None, artifacts=None,
+               trace_memory=False, outputs=None):
+        """Derive a new session from a cached one with another type or component gains
+        
+        Only the components whose inputs changed are synthesized again, the
+        rest are reused from the parent session, at the parent's quality.
+        Returns None when the parent session's components are not cached.
+        """
+        entry = self.component_cache.get(parent_session_id) if self.component_cache else None
+        if entry is None:
+            return None
+        params = entry["params"]
+        eeg_type = eeg_type or params["eeg_type"]
+        artifacts = self.artifact_config(eeg_type, artifacts, params)
+        # Gains carry over for the components the new type still has
+        keys = self._component_keys(eeg_type, artifacts)
+        gains = {**{k: v for k, v in entry["gains"].items() if k in keys}, **(gains or {})}
+        timer = StageTimer(trace_memory=trace_memory)
+        with use_quality(params.get("quality")), timer.activate():
+            result = self._generate(
+                eeg_type, params["duration"], params["sampling_rate"],
+                session_id, get_montage(params["montage"]), np.dtype(params["dtype"]),
+                gains, entry["components"], params.get("epoch_seconds"), artifacts,
+                known_events=entry.get("events"), outputs=outputs
+            )
+        result["parent_session_id"] = parent_session_id
+        result["timings"] = timer.to_dict()
+        return result
+    
+    def _generate(self, eeg_type, duration, sampling_rate, session_id, montage, dtype=np.float64,
+                  gains=None, cached=None, epoch_seconds=None, artifacts=None, fresh=None, known_events=None,
+                  outputs=None):
+        n_samples = duration * sampling_rate
+        channels = montage.channels
+        if artifacts is None:
+            artifacts = self.artifact_config(eeg_type)
+        keys = self._component_keys(eeg_type, artifacts)
+        gains = self.check_gains(eeg_type, gains, artifacts)
+        
+        with stage('synthesis'):
+            eeg_data, components, recomputed, events = self._synthesize_record(
+                eeg_type, montage, n_samples, sampling_rate, dtype, gains, artifacts, cached, fresh, known_events)
+        
+        if self.component_cache is not None and session_id:
+            params = {"eeg_type": eeg_type, "duration": duration, "sampling_rate": sampling_rate,
+                      "montage": montage.name, "dtype": np.dtype(dtype).name, "epoch_seconds": epoch_seconds,
+                      "artifacts": artifacts, "quality": current_quality()}
+            self.component_cache.put(session_id, params, components, gains, events)
+        annotations = self.record_events(events, gains).to_array(len(channels), n_samples)
+        outputs = outputs or OutputStages()
         
         # Save data
-        csv_path = save_data_to_csv(df, session_id, 'eeg')
+        npy_path = save_data_to_npy(eeg_data, session_id, sync=not outputs.wait)
+        pyramid_path, pyramid_levels = save_pyramid(eeg_data, session_id)
+        annotations_path = save_annotations(annotations, session_id)
+        meta_path = save_signal_metadata(session_id, channels, sampling_rate, 'eeg', pyramid_levels,
+                                         epoch_seconds, events=annotations)
         
-        # Extract features
-        features = extract_band_power(eeg_data, sampling_rate)
-        features_path = save_features_to_csv(features, session_id)
+        # CSV, features and plot only read the saved record
+        title = f"EEG - {eeg_type.replace('_', ' ').title()}"
+        tier = quality_tier()
+        outputs.render("csv", write_csv, eeg_data, npy_path, channels, session_id, 'eeg')
+        outputs.render("plot", render_eeg_plot, eeg_data, npy_path, channels, title, session_id, sampling_rate,
+                       tier["plot_dpi"], tier["plot_seconds"])
+        outputs.thread("features", lambda: save_features_to_csv(extract_band_power(eeg_data, sampling_rate),
+                                                                session_id))
+        if epoch_seconds:
+            outputs.thread("epochs", lambda: save_epoch_features(
+                extract_epoch_band_power(eeg_data, sampling_rate, epoch_seconds), session_id))
+        paths, pending = outputs.finish()
         
-        # Create plot
+        result = {
+            "csv_path": paths.get("csv"),
+            "npy_path": npy_path,
+            "meta_path": meta_path,
+            "pyramid_path": pyramid_path,
+            "features_path": paths.get("features"),
+            "epochs_path": paths.get("epochs"),
+            "plot_path": paths.get("plot"),
+            "annotations_path": annotations_path,
+            "annotations": len(annotations),
+            "channels": channels,
+            "montage": montage.name,
+            "dtype": eeg_data.dtype.name,
+            "eeg_type": eeg_type,
+            "components": list(keys),
+            "recomputed": recomputed,
+            "gains": gains,
+            "epoch_seconds": epoch_seconds,
+            "artifacts": artifacts,
+            "quality": current_quality(),
+            "duration": duration,
+            "sampling_rate": sampling_rate
+        }
+        if pending:
+            result["pending"] = pending
+        return result
+    
+    def _generate_chunked(self, eeg_type, duration, sampling_rate, session_id, montage, dtype, gains,
+                          epoch_seconds, artifacts, block_size):
+        n_samples = duration * sampling_rate
+        channels = montage.channels
+        keys = self._component_keys(eeg_type, artifacts)
+        gains = self.check_gains(eeg_type, gains, artifacts)
+        streams = self._component_streams(keys, eeg_type, montage, sampling_rate, dtype, artifacts)
+        events = {name: EventLog() for name in keys}
+        
+        writer = RecordWriter(session_id, channels, n_samples, dtype, block_size)
+        band_power = BandPowerAccumulator(sampling_rate)
+        epoch_power = EpochPowerAccumulator(sampling_rate, epoch_seconds) if epoch_seconds else None
         title = f"EEG - {eeg_type.replace('_', ' ').title()}"
-        plot_path = create_eeg_plot(df, self.eeg_channels, title, session_id, sampling_rate)
+        plot_path = None
+        try:
+            for start in range(0, n_samples, block_size):
+                n = min(block_size, n_samples - start)
+                with stage('synthesis'):
+                    components = {}
+                    for name, key in keys.items():
+                        with events[name].activate(), events[name].window(start, n):
+                            components[name] = (key, streams[name](n))
+                    block = self._mix(components, gains, (len(channels), n), dtype)
+                writer.write(block)
+                band_power.add(block)
+                if epoch_power is not None:
+                    epoch_power.add(block)
+                if plot_path is None:
+                    # The plot only shows the first seconds of a record, at most the tier's
+                    tier = quality_tier()
+                    plot_path = render_eeg_plot(block, channels, title, session_id, sampling_rate,
+                                                tier["plot_dpi"], tier["plot_seconds"])
+        except BaseException:
+            writer.abort()
+            raise
+        csv_path, npy_path, pyramid_path, pyramid_levels = writer.close()
+        annotations = self.record_events(events, gains).to_array(len(channels), n_samples)
+        annotations_path = save_annotations(annotations, session_id)
+        meta_path = save_signal_metadata(session_id, channels, sampling_rate, 'eeg', pyramid_levels,
+                                         epoch_seconds, events=annotations)
+        features_path = save_features_to_csv(band_power.result(), session_id)
+        epochs_path = None
+        if epoch_power is not None and epoch_power.result() is not None:
+            epochs_path = save_epoch_features(epoch_power.result(), session_id)
         
         return {
             "csv_path": csv_path,
+            "npy_path": npy_path,
+            "meta_path": meta_path,
+            "pyramid_path": pyramid_path,
             "features_path": features_path,
+            "epochs_path": epochs_path,
             "plot_path": plot_path,
-            "channels": self.eeg_channels,
+            "annotations_path": annotations_path,
+            "annotations": len(annotations),
+            "channels": channels,
+            "montage": montage.name,
+            "dtype": np.dtype(dtype).name,
+            "eeg_type": eeg_type,
+            "components": list(keys),
+            "recomputed": list(keys),
+            "gains": gains,
+            "epoch_seconds": epoch_seconds,
+            "artifacts": artifacts,
+            "quality": current_quality(),
             "duration": duration,
-            "sampling_rate": sampling_rate
+            "sampling_rate": sampling_rate,
+            "chunked": True,
+            "block_samples": block_size
         }
     
-    def _generate_normal_eeg(self, eeg_type, n_samples, sampling_rate):
-        """Generate normal EEG patterns"""
-        t = np.linspace(0, n_samples / sampling_rate, n_samples)
-        signal = []
+    def _component_streams(self, keys, eeg_type, montage, sampling_rate, dtype, artifacts):
+        """Functions returning the next n samples of each component, continuing across calls"""
+        streams = {}
+        for name in keys:
+            if name == "background":
+                streams[name] = self._background_stream(eeg_type, montage, sampling_rate, dtype)
+            elif name == "events":
+                # The event generators need some room, so a short last block takes the start of a longer one
+                min_samples = 10 * sampling_rate
+                streams[name] = lambda n: self._abnormal_events(
+                    eeg_type, montage, max(n, min_samples), sampling_rate, dtype)[:, :n]
+            elif name in ("drift", "artifacts"):
+                pipeline = self._artifact_pipeline(name, artifacts, montage, sampling_rate)
+                streams[name] = lambda n, pipeline=pipeline: pipeline.render(n, dtype)
+            else:
+                streams[name] = lambda n, name=name: self._synthesize(
+                    name, eeg_type, montage, n, sampling_rate, dtype, artifacts)
+        return streams
+    
+    def _background_stream(self, eeg_type, montage, sampling_rate, dtype):
+        """Background blocks joined by crossfading each one into the overlap of the previous one"""
+        overlap = int(CROSSFADE_SECONDS * sampling_rate)
+        tail = None
         
-        for _ in self.eeg_channels:
-            if eeg_type == 'normal_awake':
-                alpha = band_limited_noise(8, 12, n_samples, sampling_rate) * 60
-                beta = band_limited_noise(13, 30, n_samples, sampling_rate) * 30
-                gamma = band_limited_noise(30, 45, n_samples, sampling_rate) * 15
-                
-            elif eeg_type == 'sleep_stage1':
-                alpha = band_limited_noise(8, 12, n_samples, sampling_rate) * 20
-                theta = band_limited_noise(4, 8, n_samples, sampling_rate) * 50
-                beta = band_limited_noise(13, 30, n_samples, sampling_rate) * 15
-                
-            elif eeg_type == 'sleep_stage2':
-                theta = band_limited_noise(4, 8, n_samples, sampling_rate) * 60
-                delta = band_limited_noise(1, 4, n_samples, sampling_rate) * 30
-                # Add sleep spindles
-                spindles = self._generate_sleep_spindles(n_samples, sampling_rate)
-                
-            elif eeg_type == 'sleep_stage3':
-                delta = band_limited_noise(1, 4, n_samples, sampling_rate) * 80
-                theta = band_limited_noise(4, 8, n_samples, sampling_rate) * 20
-                
-            elif eeg_type == 'rem_sleep':
-                theta = band_limited_noise(4, 8, n_samples, sampling_rate) * 40
-                beta = band_limited_noise(13, 30, n_samples, sampling_rate) * 35
-                alpha = band_limited_noise(8, 12, n_samples, sampling_rate) * 25
-            
-            # Common components
-            drift = np.sin(2 * np.pi * 0.1 * t) * 10
-            noise = np.random.normal(0, 3, n_samples)
-            
-            # Eye blinks
-            blink = np.zeros_like(t)
-            if np.random.rand() < 0.2:
-                blink_pos = np.random.randint(n_samples - 20)
-                blink[blink_pos:blink_pos + 20] = 100 * np.exp(-np.arange(20) / 5)
-            
-            # Combine components
-            if eeg_type == 'sleep_stage2':
-                ch_signal = theta + delta + spindles + drift + noise + blink
+        def next_block(n):
+            nonlocal tail
+            with stage('component.background'):
+                block = self._backgrounds(eeg_type, montage, n + overlap, sampling_rate, dtype,
+                                          [random_state()])[0]
+                if tail is not None:
+                    block[:, :overlap] = crossfade(tail, block[:, :overlap])
+                tail = block[:, n:].copy()
+                return block[:, :n]
+        return next_block
+    
+    def artifact_config(self, eeg_type, artifacts=None, parent=None):
+        """Artifact stages of a request: type defaults, or a parent session's stages, updated by `artifacts`"""
+        group = "normal" if eeg_type in NORMAL_EEG_TYPES else "abnormal"
+        base = EEG_ARTIFACTS[group]
+        if parent and parent.get("artifacts") is not None and \
+                (parent["eeg_type"] in NORMAL_EEG_TYPES) == (group == "normal"):
+            base = parent["artifacts"]
+        return resolve_artifacts(base, artifacts)
+    
+    def _component_keys(self, eeg_type, artifacts=None):
+        """Signal components of a type, keyed by the inputs each one depends on"""
+        if artifacts is None:
+            artifacts = self.artifact_config(eeg_type)
+        if eeg_type in NORMAL_EEG_TYPES:
+            keys = {"background": eeg_type}
+        else:
+            # Abnormal types share one background and differ only in their events
+            keys = {"background": "abnormal", "events": eeg_type}
+        # Baseline wander is its own component so it can be scaled separately
+        if "wander" in artifacts:
+            keys["drift"] = artifacts_key({"wander": artifacts["wander"]})
+        keys["noise"] = "normal" if eeg_type in NORMAL_EEG_TYPES else "abnormal"
+        other = {stage: params for stage, params in artifacts.items() if stage != "wander"}
+        if other:
+            keys["artifacts"] = artifacts_key(other)
+        return keys
+    
+    def check_gains(self, eeg_type, gains, artifacts=None):
+        """Validate per-component gains, defaulting every component to 1"""
+        keys = self._component_keys(eeg_type, artifacts)
+        if gains is not None and not isinstance(gains, dict):
+            raise ValueError("Gains must map component names to numbers")
+        gains = dict(gains or {})
+        unknown = set(gains) - set(keys)
+        if unknown:
+            raise ValueError(f"Unknown components: {', '.join(sorted(unknown))}. Available: {', '.join(keys)}")
+        for name, gain in gains.items():
+            if isinstance(gain, bool) or not isinstance(gain, (int, float)):
+                raise ValueError(f"Gain for {name} must be a number")
+        return {name: float(gains.get(name, 1.0)) for name in keys}
+    
+    def _synthesize_record(self, eeg_type, montage, n_samples, sampling_rate, dtype, gains, artifacts,
+                           cached=None, fresh=None, known_events=None):
+        """Synthesize the components of a record and mix them
+        
+        Returns (data, components, recomputed, events) with the EventLog of
+        each component in events. known_events holds the logs of the cached
+        and fresh components.
+        """
+        components = {}
+        events = {}
+        recomputed = []
+        for name, key in self._component_keys(eeg_type, artifacts).items():
+            if cached and name in cached and cached[name][0] == key:
+                components[name] = cached[name]
+                events[name] = (known_events or {}).get(name, EventLog())
+            elif fresh and name in fresh:
+                # Synthesized for this record as part of a batch
+                components[name] = fresh[name]
+                events[name] = (known_events or {}).get(name, EventLog())
+                recomputed.append(name)
             else:
-                ch_signal = locals().get('alpha', 0) + locals().get('beta', 0) + \
-                           locals().get('gamma', 0) + locals().get('theta', 0) + \
-                           locals().get('delta', 0) + drift + noise + blink
-            
-            signal.append(ch_signal)
+                events[name] = EventLog()
+                with stage(f'component.{name}'), events[name].activate():
+                    array = self._synthesize(name, eeg_type, montage, n_samples, sampling_rate, dtype,
+                                             artifacts)
+                components[name] = (key, array)
+                recomputed.append(name)
+        eeg_data = self._mix(components, gains, (len(montage), n_samples), dtype)
+        return eeg_data, components, recomputed, events
+    
+    @staticmethod
+    def record_events(events, gains):
+        """Events of the components that are mixed into the record"""
+        return EventLog.merge(log for name, log in events.items() if gains[name] != 0.0)
+    
+    def _mix(self, components, gains, shape, dtype):
+        """Weighted sum of the components without modifying the cached arrays"""
+        signal = np.zeros(shape, dtype=dtype)
+        for name, (_, array) in components.items():
+            gain = gains[name]
+            if gain == 1.0:
+                signal += array
+            elif gain != 0.0:
+                signal += array * np.asarray(gain, dtype=dtype)
+        return signal
+    
+    def _synthesize(self, name, eeg_type, montage, n_samples, sampling_rate, dtype, artifacts):
+        """Synthesize one signal component"""
+        n_channels = len(montage)
+        if name == "background":
+            return self._backgrounds(eeg_type, montage, n_samples, sampling_rate, dtype, [random_state()])[0]
+        if name == "events":
+            return self._abnormal_events(eeg_type, montage, n_samples, sampling_rate, dtype)
+        if name in ("drift", "artifacts"):
+            return self._artifact_pipeline(name, artifacts, montage, sampling_rate).render(n_samples, dtype)
+        if name == "noise":
+            scale = 3 if eeg_type in NORMAL_EEG_TYPES else 5
+            return gaussian_noise(scale, (n_channels, n_samples), dtype)
+        raise ValueError(f"Unknown component: {name}")
+    
+    def _artifact_pipeline(self, name, artifacts, montage, sampling_rate):
+        """Pipeline rendering the drift (baseline wander) or the other artifact stages"""
+        if name == "drift":
+            # Shared by all channels, broadcast when mixing
+            return ArtifactPipeline({"wander": artifacts["wander"]}, 1, sampling_rate)
+        stages = {stage: params for stage, params in artifacts.items() if stage != "wander"}
+        return ArtifactPipeline(stages, len(montage), sampling_rate, montage,
+                                seed=random_state().randint(2 ** 31))
+    
+    def _project(self, montage, sources, dtype=np.float64):
+        """Mix latent source activity onto the montage electrodes"""
+        projection = source_projection(montage.name, self.n_sources)
+        return projection.astype(dtype) @ np.asarray(sources, dtype=dtype)
+    
+    def _source_channels(self, montage):
+        """Channels each latent source reaches with at least a tenth of its largest gain"""
+        projection = source_projection(montage.name, self.n_sources)
+        return [np.flatnonzero(gain >= 0.1 * gain.max()) for gain in projection.T]
+    
+    def _backgrounds(self, eeg_type, montage, n_samples, sampling_rate, dtype=np.float64, states=(None,),
+                     logs=None):
+        """Background rhythms for one or more random states, filtered band by band in one pass
+        
+        With logs (one EventLog per state), the events of each background are recorded in its own log.
+        """
+        if eeg_type in NORMAL_EEG_TYPES:
+            rhythms = NORMAL_RHYTHMS[eeg_type]
+        else:
+            # Abnormal patterns share one background
+            rhythms = ABNORMAL_RHYTHMS
+        
+        # Rhythms come from a few latent sources shared by nearby electrodes
+        sources = [np.zeros((self.n_sources, n_samples)) for _ in states]
+        for (low, high), amplitude in rhythms:
+            bands = band_limited_noise(low, high, n_samples, sampling_rate, rows=self.n_sources, states=states)
+            for source, band in zip(sources, bands):
+                source += band * amplitude
         
-        return np.array(signal)
+        if eeg_type == 'sleep_stage2':
+            # Add sleep spindles
+            for index, (source, state) in enumerate(zip(sources, states)):
+                events = logs[index].activate() if logs else nullcontext()
+                with use_random_state(state), events:
+                    for row, channels in zip(source, self._source_channels(montage)):
+                        with on_channels(channels):
+                            row += self._generate_sleep_spindles(n_samples, sampling_rate)
+        
+        return [self._project(montage, source, dtype) for source in sources]
     
-    def _generate_abnormal_eeg(self, eeg_type, n_samples, sampling_rate):
-        """Generate abnormal EEG patterns"""
-        t = np.linspace(0, n_samples / sampling_rate, n_samples)
-        signal = []
+    def _abnormal_events(self, eeg_type, montage, n_samples, sampling_rate, dtype=np.float64):
+        """Generate the abnormal activity of a pattern"""
+        # Focal abnormalities are placed by electrode geometry
+        if eeg_type == 'focal_spikes':
+            return self._generate_focal_spikes(n_samples, sampling_rate, montage, dtype)
+        if eeg_type == 'focal_slowing':
+            return self._generate_focal_slowing(n_samples, sampling_rate, montage, dtype)
         
-        for ch_idx, _ in enumerate(self.eeg_channels):
-            # Base signal
-            alpha = band_limited_noise(8, 12, n_samples, sampling_rate) * 30
-            beta = band_limited_noise(13, 30, n_samples, sampling_rate) * 20
-            theta = band_limited_noise(4, 8, n_samples, sampling_rate) * 15
-            noise = np.random.normal(0, 5, n_samples)
-            
-            # Add specific abnormalities
-            if eeg_type == 'interictal_spikes':
-                spikes = self._generate_interictal_spikes(n_samples, sampling_rate)
-                abnormal = spikes
+        # Events of each source are annotated on the channels it reaches
+        sources = []
+        for channels in self._source_channels(montage):
+            with on_channels(channels):
+                # Add generalized abnormalities
+                if eeg_type == 'interictal_spikes':
+                    spikes = self._generate_interictal_spikes(n_samples, sampling_rate)
+                    abnormal = spikes
                 
-            elif eeg_type == 'spike_wave_3hz':
-                spike_wave = self._generate_spike_wave_3hz(n_samples, sampling_rate)
-                abnormal = spike_wave
+                elif eeg_type == 'spike_wave_3hz':
+                    spike_wave = self._generate_spike_wave_3hz(n_samples, sampling_rate)
+                    abnormal = spike_wave
                 
-            elif eeg_type == 'focal_spikes':
-                focal_spikes = self._generate_focal_spikes(n_samples, sampling_rate, ch_idx)
-                abnormal = focal_spikes
+                elif eeg_type == 'polyspike':
+                    polyspikes = self._generate_polyspikes(n_samples, sampling_rate)
+                    abnormal = polyspikes
                 
-            elif eeg_type == 'polyspike':
-                polyspikes = self._generate_polyspikes(n_samples, sampling_rate)
-                abnormal = polyspikes
+                elif eeg_type == 'hypsarrhythmia':
+                    hypsarrhythmia = self._generate_hypsarrhythmia(n_samples, sampling_rate)
+                    abnormal = hypsarrhythmia
                 
-            elif eeg_type == 'hypsarrhythmia':
-                hypsarrhythmia = self._generate_hypsarrhythmia(n_samples, sampling_rate)
-                abnormal = hypsarrhythmia
+                elif eeg_type == 'diffuse_slowing':
+                    diffuse_slow = self._generate_diffuse_slowing(n_samples, sampling_rate)
+                    abnormal = diffuse_slow
                 
-            elif eeg_type == 'focal_slowing':
-                focal_slow = self._generate_focal_slowing(n_samples, sampling_rate, ch_idx)
-                abnormal = focal_slow
+                elif eeg_type == 'triphasic_waves':
+                    triphasic = self._generate_triphasic_waves(n_samples, sampling_rate)
+                    abnormal = triphasic
                 
-            elif eeg_type == 'diffuse_slowing':
-                diffuse_slow = self._generate_diffuse_slowing(n_samples, sampling_rate)
-                abnormal = diffuse_slow
+                elif eeg_type == 'periodic_discharges':
+                    periodic = self._generate_periodic_discharges(n_samples, sampling_rate)
+                    abnormal = periodic
                 
-            elif eeg_type == 'triphasic_waves':
-                triphasic = self._generate_triphasic_waves(n_samples, sampling_rate)
-                abnormal = triphasic
+                elif eeg_type == 'burst_suppression':
+                    burst_supp = self._generate_burst_suppression(n_samples, sampling_rate)
+                    abnormal = burst_supp
                 
-            elif eeg_type == 'periodic_discharges':
-                periodic = self._generate_periodic_discharges(n_samples, sampling_rate)
-                abnormal = periodic
+                elif eeg_type == 'alpha_coma':
+                    alpha_coma = self._generate_alpha_coma(n_samples, sampling_rate)
+                    abnormal = alpha_coma
                 
-            elif eeg_type == 'burst_suppression':
-                burst_supp = self._generate_burst_suppression(n_samples, sampling_rate)
-                abnormal = burst_supp
+                elif eeg_type == 'flat_eeg':
+                    flat = self._generate_flat_eeg(n_samples, sampling_rate)
+                    abnormal = flat
                 
-            elif eeg_type == 'alpha_coma':
-                alpha_coma = self._generate_alpha_coma(n_samples, sampling_rate)
-                abnormal = alpha_coma
-                
-            elif eeg_type == 'flat_eeg':
-                flat = self._generate_flat_eeg(n_samples, sampling_rate)
-                abnormal = flat
-                
-            else:
-                abnormal = np.zeros(n_samples)
+                else:
+                    abnormal = np.zeros(n_samples)
             
-            ch_signal = alpha + beta + theta + noise + abnormal
-            signal.append(ch_signal)
+                sources.append(abnormal)
         
-        return np.array(signal)
+        return self._project(montage, sources, dtype)
     
     def _generate_sleep_spindles(self, n_samples, sampling_rate):
         """Generate sleep spindles"""
@@ -171,9 +575,9 @@ class EEGGenerator:
         spindle_freq = 12  # Hz
         
         # Add random spindles
-        for _ in range(np.random.randint(3, 8)):
-            start = np.random.randint(0, n_samples - 100)
-            duration = np.random.randint(50, 100)
+        for _ in range(random_state().randint(3, 8)):
+            start = random_state().randint(0, n_samples - 100)
+            duration = random_state().randint(50, 100)
             t_spindle = np.linspace(0, duration / sampling_rate, duration)
             
             # Spindle envelope
@@ -181,6 +585,7 @@ class EEGGenerator:
             spindle_signal = envelope * np.sin(2 * np.pi * spindle_freq * t_spindle) * 50
             
             spindles[start:start + duration] += spindle_signal
+            annotate(start, duration, "spindle")
             
         return spindles
     
@@ -188,11 +593,12 @@ class EEGGenerator:
         """Generate interictal spikes"""
         spikes = np.zeros(n_samples)
         
-        for _ in range(np.random.randint(5, 15)):
-            pos = np.random.randint(0, n_samples - 50)
+        for _ in range(random_state().randint(5, 15)):
+            pos = random_state().randint(0, n_samples - 50)
             # Sharp spike followed by slow wave
             spike = np.exp(-np.arange(50) / 5) * np.sin(2 * np.pi * 20 * np.arange(50) / sampling_rate) * 100
             spikes[pos:pos + 50] += spike
+            annotate(pos, 50, "spike")
             
         return spikes
     
@@ -202,8 +608,8 @@ class EEGGenerator:
         freq = 3  # Hz
         
         # Generate multiple spike-wave complexes
-        for _ in range(np.random.randint(3, 8)):
-            start = np.random.randint(0, n_samples - 200)
+        for _ in range(random_state().randint(3, 8)):
+            start = random_state().randint(0, n_samples - 200)
             duration = 200
             
             t_complex = np.linspace(0, duration / sampling_rate, duration)
@@ -213,38 +619,40 @@ class EEGGenerator:
             
             complex_signal = spike + wave
             spike_wave[start:start + duration] += complex_signal
+            annotate(start, duration, "spike_wave")
             
         return spike_wave
     
-    def _generate_focal_spikes(self, n_samples, sampling_rate, ch_idx):
-        """Generate focal spikes (more prominent in certain channels)"""
+    def _generate_focal_spikes(self, n_samples, sampling_rate, montage, dtype=np.float64):
+        """Generate focal spikes (more prominent near the frontal focus)"""
         spikes = np.zeros(n_samples)
         
-        # Focal spikes more prominent in frontal channels
-        if ch_idx in [0, 1, 2, 3]:  # Fp1, Fp2, F3, F4
-            amplitude = 120
-        else:
-            amplitude = 30
+        # Amplitude falls from 120 at the focus to 30 far away from it
+        gain = montage.focal_gain(self.FOCAL_SPIKE_FOCUS, width_deg=25, floor=0.25)
+        amplitude = gain * 120
+        focal_channels = np.flatnonzero(gain >= 0.5)
             
-        for _ in range(np.random.randint(3, 10)):
-            pos = np.random.randint(0, n_samples - 30)
-            spike = np.exp(-np.arange(30) / 3) * amplitude
+        for _ in range(random_state().randint(3, 10)):
+            pos = random_state().randint(0, n_samples - 30)
+            spike = np.exp(-np.arange(30) / 3)
             spikes[pos:pos + 30] += spike
+            annotate(pos, 30, "spike", focal_channels)
             
-        return spikes
+        return np.outer(amplitude.astype(dtype), spikes.astype(dtype))
     
     def _generate_polyspikes(self, n_samples, sampling_rate):
         """Generate polyspike complexes"""
         polyspikes = np.zeros(n_samples)
         
-        for _ in range(np.random.randint(2, 6)):
-            start = np.random.randint(0, n_samples - 100)
+        for _ in range(random_state().randint(2, 6)):
+            start = random_state().randint(0, n_samples - 100)
             
             # Multiple spikes in sequence
             for i in range(3):
                 spike_pos = start + i * 20
                 spike = np.exp(-np.arange(20) / 2) * 80
                 polyspikes[spike_pos:spike_pos + 20] += spike
+            annotate(start, 60, "polyspike")
                 
         return polyspikes
     
@@ -253,32 +661,29 @@ class EEGGenerator:
         hypsarrhythmia = np.zeros(n_samples)
         
         # Chaotic high-amplitude slow waves with spikes
-        for _ in range(np.random.randint(10, 20)):
-            start = np.random.randint(0, n_samples - 100)
-            duration = np.random.randint(50, 100)
+        for _ in range(random_state().randint(10, 20)):
+            start = random_state().randint(0, n_samples - 100)
+            duration = random_state().randint(50, 100)
             
             # Slow wave
             slow_wave = np.sin(2 * np.pi * 2 * np.arange(duration) / sampling_rate) * 100
             # Add spikes
-            spikes = np.random.choice([0, 1], duration, p=[0.8, 0.2]) * 50
+            spikes = random_state().choice([0, 1], duration, p=[0.8, 0.2]) * 50
             
             hypsarrhythmia[start:start + duration] += slow_wave + spikes
+            annotate(start, duration, "hypsarrhythmia")
             
         return hypsarrhythmia
     
-    def _generate_focal_slowing(self, n_samples, sampling_rate, ch_idx):
+    def _generate_focal_slowing(self, n_samples, sampling_rate, montage, dtype=np.float64):
         """Generate focal slowing"""
-        focal_slow = np.zeros(n_samples)
+        focal_slow = np.zeros((len(montage), n_samples), dtype=dtype)
         
-        # Focal slowing in temporal channels
-        if ch_idx in [12, 13]:  # T3, T4
-            amplitude = 60
-        else:
-            amplitude = 10
-            
-        # Slow waves
-        slow_waves = band_limited_noise(1, 4, n_samples, sampling_rate) * amplitude
-        focal_slow += slow_waves
+        # Focal slowing over the temporal regions, 60 at the focus and 10 far away
+        for focus in self.FOCAL_SLOWING_FOCI:
+            amplitude = montage.focal_gain(focus, width_deg=25, floor=1 / 6) * 60
+            slow_waves = band_limited_noise(1, 4, n_samples, sampling_rate, dtype)
+            focal_slow += np.outer(amplitude.astype(dtype), slow_waves)
         
         return focal_slow
     
@@ -294,8 +699,8 @@ class EEGGenerator:
         """Generate triphasic waves"""
         triphasic = np.zeros(n_samples)
         
-        for _ in range(np.random.randint(3, 8)):
-            start = np.random.randint(0, n_samples - 150)
+        for _ in range(random_state().randint(3, 8)):
+            start = random_state().randint(0, n_samples - 150)
             duration = 150
             
             t_wave = np.linspace(0, duration / sampling_rate, duration)
@@ -305,6 +710,7 @@ class EEGGenerator:
             wave3 = np.exp(-((t_wave - 0.15) / 0.02)**2) * 60
             
             triphasic[start:start + duration] += wave1 + wave2 + wave3
+            annotate(start, duration, "triphasic_wave")
             
         return triphasic
     
@@ -313,11 +719,14 @@ class EEGGenerator:
         periodic = np.zeros(n_samples)
         period = sampling_rate  # 1 second period
         
+        onsets = []
         for i in range(0, n_samples, period):
             if i + 50 < n_samples:
                 # Sharp discharge
                 discharge = np.exp(-np.arange(50) / 5) * 100
                 periodic[i:i + 50] += discharge
+                onsets.append(i)
+        annotate(onsets, 50, "periodic_discharge")
                 
         return periodic
     
@@ -335,10 +744,12 @@ class EEGGenerator:
             if i + burst_duration < n_samples:
                 burst = band_limited_noise(1, 30, burst_duration, sampling_rate) * 80
                 burst_supp[i:i + burst_duration] += burst
+                annotate(i, burst_duration, "burst")
                 i += burst_duration
             
             # Suppression
             if i + supp_duration < n_samples:
+                annotate(i, supp_duration, "suppression")
                 i += supp_duration
             else:
                 break
@@ -357,6 +768,6 @@ class EEGGenerator:
     def _generate_flat_eeg(self, n_samples, sampling_rate):
         """Generate flat EEG (cerebral silence)"""
         # Very low amplitude activity
-        flat = np.random.normal(0, 2, n_samples)
+        flat = random_state().normal(0, 2, n_samples)
         
         return flat 
\ No newline at end of file
@@ -0,0 +1,130 @@
+import functools
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Timer collecting stages for the generate call running in this context
+_active_timer = ContextVar('active_timer', default=None)
+
+
+class StageTimer:
+    """Collect wall time, CPU time and optional memory peak per pipeline stage
+
+    Stages may nest (e.g. band_limited_noise inside synthesis), so stage
+    times are inclusive and do not add up to the total. Repeated stages are
+    accumulated and counted. Stages may also run on other threads (see
+    outputs.OutputStages). Memory peaks come from tracemalloc, which is
+    process-wide and therefore approximate when requests run concurrently;
+    they are only traced on the thread that activated the timer.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._memory_stack = []
+        self._owner = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Make this timer collect stages for the current context"""
+        token = _active_timer.set(self)
+        self._owner = threading.get_ident()
+        started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        try:
+            with self.stage('total'):
+                yield self
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            _active_timer.reset(token)
+
+    @contextmanager
+    def stage(self, name):
+        """Time one pipeline stage"""
+        trace = self.trace_memory and tracemalloc.is_tracing() and threading.get_ident() == self._owner
+        if trace:
+            self._enter_memory()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            peak = self._exit_memory() if trace else None
+            with self._lock:
+                entry = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                entry["wall"] += wall
+                entry["cpu"] += cpu
+                entry["calls"] += 1
+                if peak is not None:
+                    entry["peak_bytes"] = max(entry.get("peak_bytes", 0), peak)
+
+    def merge(self, other):
+        """Add the stages of another timer, e.g. work shared by a batch of requests"""
+        self.merge_stages(other.to_dict())
+
+    def merge_stages(self, stages):
+        """Add stages timed elsewhere, e.g. in a worker process"""
+        with self._lock:
+            for name, entry in stages.items():
+                mine = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                mine["wall"] += entry["wall"]
+                mine["cpu"] += entry["cpu"]
+                mine["calls"] += entry["calls"]
+                if "peak_bytes" in entry:
+                    mine["peak_bytes"] = max(mine.get("peak_bytes", 0), entry["peak_bytes"])
+
+    def to_dict(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self.stages.items()}
+
+    def _enter_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        # Fold the peak reached so far into enclosing stages before resetting it
+        for frame in self._memory_stack:
+            frame[1] = max(frame[1], peak)
+        self._memory_stack.append([current, current])
+        tracemalloc.reset_peak()
+
+    def _exit_memory(self):
+        _, peak = tracemalloc.get_traced_memory()
+        start, running_peak = self._memory_stack.pop()
+        peak = max(peak, running_peak)
+        for frame in self._memory_stack:
+            frame[1] = max(frame[1], peak)
+        return max(0, peak - start)
+
+
+def current_timer():
+    """Return the timer active in this context, if any"""
+    return _active_timer.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a stage on the active timer; a no-op when none is active"""
+    timer = _active_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def instrumented(func):
+    """Record each call of a pipeline function as a stage named after it"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timer = _active_timer.get()
+        if timer is None:
+            return func(*args, **kwargs)
+        with timer.stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,139 @@
+import numpy as np
+
+# Vectorcardiogram axes follow the Frank lead system: x points to the
+# patient's left, y to the feet and z to the back. A single cardiac dipole
+# trajectory in these coordinates is projected onto any lead with one
+# (leads x 3) matrix multiply.
+
+# Dower transform from Frank X/Y/Z to the independent leads of the 12-lead ECG
+DOWER_MATRIX = {
+    "I": (0.632, -0.235, 0.059),
+    "II": (0.235, 1.066, -0.132),
+    "V1": (-0.515, 0.157, -0.917),
+    "V2": (0.044, 0.164, -1.387),
+    "V3": (0.882, 0.098, -1.277),
+    "V4": (1.213, 0.127, -0.601),
+    "V5": (1.125, 0.127, -0.086),
+    "V6": (0.831, 0.076, 0.230)
+}
+
+
+def _lead_vectors():
+    """Lead vectors of the 12 standard leads plus the orthogonal Frank leads"""
+    vectors = {name: np.array(v) for name, v in DOWER_MATRIX.items()}
+    lead_i, lead_ii = vectors["I"], vectors["II"]
+    # Limb leads are linear combinations of I and II (Einthoven and Goldberger)
+    vectors["III"] = lead_ii - lead_i
+    vectors["aVR"] = -(lead_i + lead_ii) / 2
+    vectors["aVL"] = lead_i - lead_ii / 2
+    vectors["aVF"] = lead_ii - lead_i / 2
+    vectors.update({"X": np.array([1.0, 0.0, 0.0]),
+                    "Y": np.array([0.0, 1.0, 0.0]),
+                    "Z": np.array([0.0, 0.0, 1.0])})
+    return vectors
+
+
+LEAD_VECTORS = _lead_vectors()
+
+LEAD_SETS = {
+    "12": ["I", "II", "III", "aVR", "aVL", "aVF", "V1", "V2", "V3", "V4", "V5", "V6"],
+    "frank": ["X", "Y", "Z"],
+    "limb": ["I", "II", "III", "aVR", "aVL", "aVF"],
+    "precordial": ["V1", "V2", "V3", "V4", "V5", "V6"]
+}
+
+
+def resolve_leads(leads):
+    """Turn a lead set name, a list of lead names or {name: [x, y, z]} into (names, matrix)"""
+    if isinstance(leads, (str, int)):
+        key = str(leads).lower()
+        if key not in LEAD_SETS:
+            raise ValueError(f"Unknown lead set: {leads}. Available: {', '.join(LEAD_SETS)}")
+        leads = LEAD_SETS[key]
+
+    if isinstance(leads, dict):
+        names = list(leads)
+        vectors = [leads[name] for name in names]
+    else:
+        names = list(leads)
+        unknown = [name for name in names if name not in LEAD_VECTORS]
+        if unknown:
+            raise ValueError(f"Unknown leads: {', '.join(map(str, unknown))}")
+        vectors = [LEAD_VECTORS[name] for name in names]
+
+    matrix = np.asarray(vectors, dtype=float)
+    if not names or matrix.shape != (len(names), 3):
+        raise ValueError("Custom leads must map names to [x, y, z] vectors")
+    return names, matrix
+
+
+def axis(frontal_deg, z=0.0):
+    """Unit dipole direction from a frontal plane angle (0 = left, 90 = down) and a z tilt"""
+    theta = np.deg2rad(frontal_deg)
+    vector = np.array([np.cos(theta), np.sin(theta), z])
+    return vector / np.linalg.norm(vector)
+
+
+# Phases of the cardiac cycle that get their own dipole direction
+PHASES = ("P", "QRS", "QRS_late", "T")
+
+# Normal axes: P and QRS point down and left, QRS slightly posterior, T anterior
+DEFAULT_AXES = {
+    "P": axis(55, -0.2),
+    "QRS": axis(60, 0.3),
+    "T": axis(45, -0.3)
+}
+
+# Phase boundaries in seconds relative to the neighbouring R peaks
+P_ONSET = 0.25
+QRS_ONSET = 0.06
+QRS_LATE_ONSET = 0.05
+T_ONSET = 0.10
+
+
+def cardiac_phases(n_samples, r_peaks, sampling_rate):
+    """Index into PHASES for every sample, from its distance to the surrounding R peaks"""
+    r_peaks = np.asarray(r_peaks, dtype=float)
+    samples = np.arange(n_samples)
+    idx = np.searchsorted(r_peaks, samples)
+    padded = np.concatenate(([-np.inf], r_peaks, [np.inf]))
+    since_r = (samples - padded[idx]) / sampling_rate
+    until_r = (padded[idx + 1] - samples) / sampling_rate
+
+    phase = np.full(n_samples, PHASES.index("T"))
+    phase[since_r < T_ONSET] = PHASES.index("QRS_late")
+    phase[since_r < QRS_LATE_ONSET] = PHASES.index("QRS")
+    phase[until_r < P_ONSET] = PHASES.index("P")
+    phase[until_r < QRS_ONSET] = PHASES.index("QRS")
+    return phase
+
+
+def _moving_average(values, width):
+    """Centred moving average along the first axis"""
+    if width <= 1:
+        return values
+    cumulative = np.cumsum(np.pad(values, ((width // 2 + 1, width - width // 2 - 1), (0, 0)), mode='edge'), axis=0)
+    return (cumulative[width:] - cumulative[:-width]) / width
+
+
+def dipole_trajectory(ecg, r_peaks, sampling_rate, axes=None):
+    """Frank X/Y/Z dipole (3 x samples) that carries a scalar ECG waveform
+
+    Each phase of the cardiac cycle has its own dipole direction and the
+    direction is smoothed over 20 ms so phase changes do not add steps.
+    Phases missing from `axes` fall back to DEFAULT_AXES, and the late QRS
+    falls back to the QRS axis.
+    """
+    axes = {**DEFAULT_AXES, **(axes or {})}
+    axes.setdefault("QRS_late", axes["QRS"])
+    table = np.array([axes[name] for name in PHASES])
+
+    directions = table[cardiac_phases(len(ecg), r_peaks, sampling_rate)]
+    directions = _moving_average(directions, int(0.02 * sampling_rate))
+    return directions.T.astype(ecg.dtype) * ecg
+
+
+def project_leads(vcg, leads="12"):
+    """Project a dipole trajectory onto a lead set, returning (names, leads x samples)"""
+    names, matrix = resolve_leads(leads)
+    return names, matrix.astype(vcg.dtype) @ vcg
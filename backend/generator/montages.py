@@ -0,0 +1,223 @@
+from functools import lru_cache
+import numpy as np
+
+# Electrode positions use the idealized spherical head of the 10-20 family:
+# x points right, y anterior, z up. Coronal-style rows run from the midline
+# to the 10% ring (Fpz-T7-Oz), where electrodes 7/8 sit. Numbered positions
+# divide that arc in equal steps. The positions are accurate to a few
+# degrees, which is plenty for synthetic spatial mixing.
+
+# Row prefix, sagittal angle from Cz (degrees, anterior positive), 10-10 row?
+ROWS = [
+    ("Fp", 72, True), ("AFp", 63, False), ("AF", 54, True), ("AFF", 45, False),
+    ("F", 36, True), ("FFC", 27, False), ("FC", 18, True), ("FCC", 9, False),
+    ("C", 0, True), ("CCP", -9, False), ("CP", -18, True), ("CPP", -27, False),
+    ("P", -36, True), ("PPO", -45, False), ("PO", -54, True), ("POO", -63, False),
+    ("O", -72, True)
+]
+
+# Temporal naming for lateral positions 7-10 of the rows around the T line
+TEMPORAL_PREFIXES = {
+    "FFC": "FFT", "FC": "FT", "FCC": "FTT", "C": "T", "CCP": "TTP", "CP": "TP", "CPP": "TPP"
+}
+
+# Old 10-20 names still used by the default montage
+LEGACY_ALIASES = {"T3": "T7", "T4": "T8", "T5": "P7", "T6": "P8"}
+
+RING_POLAR = np.deg2rad(72)
+
+LEGACY_16 = ['Fp1', 'Fp2', 'F3', 'F4', 'C3', 'C4', 'P3', 'P4',
+             'O1', 'O2', 'F7', 'F8', 'T3', 'T4', 'Cz', 'Pz']
+
+STANDARD_32 = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'FC5', 'FC1', 'FC2', 'FC6',
+               'T7', 'C3', 'Cz', 'C4', 'T8', 'TP9', 'CP5', 'CP1', 'CP2', 'CP6', 'TP10',
+               'P7', 'P3', 'Pz', 'P4', 'P8', 'PO9', 'O1', 'Oz', 'O2', 'PO10']
+
+STANDARD_64 = ['Fp1', 'AF7', 'AF3', 'F1', 'F3', 'F5', 'F7', 'FT7', 'FC5', 'FC3', 'FC1',
+               'C1', 'C3', 'C5', 'T7', 'TP7', 'CP5', 'CP3', 'CP1', 'P1', 'P3', 'P5', 'P7',
+               'P9', 'PO7', 'PO3', 'O1', 'Iz', 'Oz', 'POz', 'Pz', 'CPz', 'Fpz', 'Fp2',
+               'AF8', 'AF4', 'AFz', 'Fz', 'F2', 'F4', 'F6', 'F8', 'FT8', 'FC6', 'FC4',
+               'FC2', 'FCz', 'Cz', 'C2', 'C4', 'C6', 'T8', 'TP8', 'CP6', 'CP4', 'CP2',
+               'P2', 'P4', 'P6', 'P8', 'P10', 'PO8', 'PO4', 'O2']
+
+
+def _slerp(a, b, t):
+    """Point at fraction t along the great circle from a to b (t > 1 extrapolates)"""
+    omega = np.arccos(np.clip(np.dot(a, b), -1.0, 1.0))
+    if omega < 1e-9:
+        return a
+    return (np.sin((1 - t) * omega) * a + np.sin(t * omega) * b) / np.sin(omega)
+
+
+def _row_position(row_angle, step):
+    """Position `step` eighths of the way from the midline to the 10% ring
+
+    Negative steps are on the left hemisphere.
+    """
+    beta = np.deg2rad(row_angle)
+    midline = np.array([0.0, np.sin(beta), np.cos(beta)])
+    azimuth = np.deg2rad(90 - row_angle)
+    ring = np.array([np.sin(RING_POLAR) * np.sin(azimuth),
+                     np.sin(RING_POLAR) * np.cos(azimuth),
+                     np.cos(RING_POLAR)])
+    if step < 0:
+        ring[0] = -ring[0]
+    position = _slerp(midline, ring, abs(step) / 8)
+    return position / np.linalg.norm(position)
+
+
+def _label(prefix, number, half=False):
+    if number >= 7 and prefix in TEMPORAL_PREFIXES:
+        prefix = TEMPORAL_PREFIXES[prefix]
+    return f"{prefix}{number}{'h' if half else ''}"
+
+
+@lru_cache(maxsize=1)
+def electrode_positions():
+    """All 10-10 and 10-5 positions as {label: (xyz unit vector, is_10_10)}"""
+    positions = {}
+    for prefix, angle, full_row in ROWS:
+        positions[f"{prefix}z"] = (_row_position(angle, 0), full_row)
+
+        if prefix in ("Fp", "O"):
+            # Fp1/Fp2 and O1/O2 sit on the 10% ring itself
+            positions[f"{prefix}1"] = (_row_position(angle, -8), True)
+            positions[f"{prefix}2"] = (_row_position(angle, 8), True)
+            continue
+
+        for number in range(1, 11):
+            step = 2 * ((number + 1) // 2)
+            sign = -1 if number % 2 else 1
+            positions[_label(prefix, number)] = (_row_position(angle, sign * step), full_row)
+            positions[_label(prefix, number, half=True)] = (_row_position(angle, sign * (step - 1)), False)
+
+    positions["Iz"] = (np.array([0.0, -1.0, 0.0]), True)
+    return positions
+
+
+def position_of(label):
+    """Unit vector of an electrode label (legacy 10-20 names accepted)"""
+    positions = electrode_positions()
+    label = LEGACY_ALIASES.get(label, label)
+    if label not in positions:
+        raise ValueError(f"Unknown electrode: {label}")
+    return positions[label][0]
+
+
+def angular_distance(positions, point):
+    """Great-circle distance (radians) from each position to a point"""
+    return np.arccos(np.clip(positions @ point, -1.0, 1.0))
+
+
+def _dense_channels(n_channels):
+    """All usable 10-10 positions, topped up evenly with 10-5 positions"""
+    positions = electrode_positions()
+    # Positions far below the T9-T10 line are not used on caps
+    usable = {k: v for k, v in positions.items() if v[0][2] >= -0.2}
+    chosen = [k for k, (_, full) in usable.items() if full]
+    candidates = [k for k, (_, full) in usable.items() if not full]
+    if n_channels > len(chosen) + len(candidates):
+        raise ValueError(f"Cannot build a {n_channels}-channel montage")
+
+    # Farthest-point sampling spreads the extra electrodes evenly over the scalp
+    chosen_xyz = np.array([usable[k][0] for k in chosen])
+    candidate_xyz = np.array([usable[k][0] for k in candidates])
+    nearest = np.min(np.arccos(np.clip(candidate_xyz @ chosen_xyz.T, -1, 1)), axis=1)
+    while len(chosen) < n_channels:
+        best = int(np.argmax(nearest))
+        chosen.append(candidates[best])
+        nearest = np.minimum(nearest, angular_distance(candidate_xyz, candidate_xyz[best]))
+        nearest[best] = -1.0
+    return chosen[:n_channels]
+
+
+class Montage:
+    """Named set of electrodes with positions on a unit sphere"""
+
+    def __init__(self, name, channels, description=""):
+        self.name = name
+        self.channels = list(channels)
+        self.description = description
+        self.positions = np.array([position_of(ch) for ch in self.channels])
+
+    def __len__(self):
+        return len(self.channels)
+
+    def focal_gain(self, focus, width_deg=30, floor=0.0):
+        """Per-channel gain in [floor, 1] that decays with distance from a focus"""
+        if isinstance(focus, str):
+            focus = position_of(focus)
+        distance = angular_distance(self.positions, focus)
+        width = np.deg2rad(width_deg)
+        return floor + (1 - floor) * np.exp(-0.5 * (distance / width) ** 2)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "description": self.description,
+            "channels": self.channels,
+            "positions": np.round(self.positions, 4).tolist()
+        }
+
+
+MONTAGE_DEFINITIONS = {
+    "10-20-16": (LEGACY_16, "Classic 16-channel 10-20 montage"),
+    "10-10-32": (STANDARD_32, "32-channel 10-10 cap"),
+    "10-10-64": (STANDARD_64, "64-channel 10-10 cap"),
+    "10-5-128": (128, "128-channel 10-5 cap"),
+    "10-5-256": (256, "256-channel 10-5 cap")
+}
+
+DEFAULT_MONTAGE = "10-20-16"
+
+
+def resolve_montage_name(name=None):
+    """Map a montage name or channel count to a montage name"""
+    name = DEFAULT_MONTAGE if name is None else str(name)
+    if name in MONTAGE_DEFINITIONS:
+        return name
+    by_count = {key.rsplit("-", 1)[1]: key for key in MONTAGE_DEFINITIONS}
+    if name not in by_count:
+        raise ValueError(f"Unknown montage: {name}. Available: {', '.join(MONTAGE_DEFINITIONS)}")
+    return by_count[name]
+
+
+def get_montage(name=None):
+    """Look up a montage by name or channel count"""
+    return _load_montage(resolve_montage_name(name))
+
+
+@lru_cache(maxsize=None)
+def _load_montage(name):
+    channels, description = MONTAGE_DEFINITIONS[name]
+    if isinstance(channels, int):
+        channels = _dense_channels(channels)
+    return Montage(name, channels, description)
+
+
+def fibonacci_cap(n_points, min_z=-0.2):
+    """Roughly uniform points on the part of the unit sphere above min_z"""
+    i = np.arange(n_points) + 0.5
+    z = 1 - i / n_points * (1 - min_z)
+    radius = np.sqrt(1 - z ** 2)
+    theta = np.pi * (3 - np.sqrt(5)) * i
+    return np.column_stack([radius * np.cos(theta), radius * np.sin(theta), z])
+
+
+@lru_cache(maxsize=32)
+def source_projection(montage_name, n_sources):
+    """Lead-field-style (channels x sources) mixing matrix for latent sources
+
+    Each source is a point on the scalp sphere with a Gaussian spatial
+    spread set by the source spacing. Rows have unit norm, so independent
+    unit-variance sources give unit-variance channels.
+    """
+    montage = get_montage(montage_name)
+    sources = fibonacci_cap(n_sources)
+    cap_area = 2 * np.pi * (1 + 0.2)
+    width = 0.6 * np.sqrt(cap_area / n_sources)
+    distance = np.arccos(np.clip(montage.positions @ sources.T, -1.0, 1.0))
+    projection = np.exp(-0.5 * (distance / width) ** 2)
+    projection /= np.linalg.norm(projection, axis=1, keepdims=True)
+    projection.setflags(write=False)
+    return projection
@@ -0,0 +1,158 @@
+import numpy as np
+from .utils import (
+    pd, resolve_dtype, extract_band_power, extract_hrv_features, make_random_state, use_random_state,
+    save_annotations, save_data_to_npy, save_features_to_csv, save_pyramid, save_signal_metadata, SIGNAL_UNITS,
+    current_quality, quality_tier, use_quality
+)
+from .instrumentation import StageTimer, stage
+from .outputs import OutputStages, render_multimodal_plot, write_csv
+from .annotations import EventLog
+from .montages import get_montage
+
+# Direction from the centre of the head towards the heart: down, to the left and slightly forward
+HEART_DIRECTION = np.array([-0.35, 0.15, -1.0]) / np.linalg.norm([-0.35, 0.15, -1.0])
+
+# Largest accepted cardiac field artifact, in μV of EEG per mV of ECG
+MAX_ECG_BLEED = 100.0
+
+
+def check_ecg_bleed(ecg_bleed):
+    """Validate the strength of the ECG artifact in the EEG channels (0 disables it)"""
+    if ecg_bleed is None:
+        return 0.0
+    if isinstance(ecg_bleed, bool) or not isinstance(ecg_bleed, (int, float)) or \
+            not 0 <= ecg_bleed <= MAX_ECG_BLEED:
+        raise ValueError(f"ecg_bleed must be a number between 0 and {MAX_ECG_BLEED:g}")
+    return float(ecg_bleed)
+
+
+def cardiac_field_gain(montage):
+    """Per-channel gain of the heart's field on the scalp, average referenced, largest magnitude 1
+
+    The heart is far from the head compared to the electrode spacing, so
+    its field changes about linearly across the scalp: electrodes low and
+    on the left pick up the most.
+    """
+    gain = montage.positions @ HEART_DIRECTION
+    gain -= gain.mean()
+    return gain / np.abs(gain).max()
+
+
+class MultimodalGenerator:
+    """EEG and ECG of one subject on a shared timeline, saved as one record
+
+    Both signals are synthesized at one sampling rate from one random
+    stream, so a seed fixes the whole record at a given quality tier
+    (utils.QUALITY_TIERS). With ecg_bleed the clean heart signal also
+    leaks into the EEG channels as a cardiac field artifact. EEG channels
+    are in μV and ECG leads in mV; the units are recorded per channel in
+    the metadata.
+    """
+
+    def __init__(self, eeg_generator, ecg_generator):
+        self.eeg_generator = eeg_generator
+        self.ecg_generator = ecg_generator
+
+    def generate(self, eeg_type, ecg_type, duration=30, sampling_rate=256, session_id=None,
+                 montage=None, leads=None, dtype=None, gains=None, eeg_artifacts=None, ecg_artifacts=None,
+                 ecg_bleed=0.0, seed=None, trace_memory=False, outputs=None, quality=None):
+        montage = self.eeg_generator.montage if montage is None else get_montage(montage)
+        dtype = resolve_dtype(dtype)
+        eeg_artifacts = self.eeg_generator.artifact_config(eeg_type, eeg_artifacts)
+        ecg_artifacts = self.ecg_generator.artifact_config(ecg_artifacts)
+        timer = StageTimer(trace_memory=trace_memory)
+        with use_random_state(make_random_state(seed)), use_quality(quality), timer.activate():
+            result = self._generate(eeg_type, ecg_type, duration, sampling_rate, session_id, montage, leads,
+                                    dtype, gains, eeg_artifacts, ecg_artifacts, check_ecg_bleed(ecg_bleed),
+                                    outputs)
+        result["seed"] = seed
+        result["timings"] = timer.to_dict()
+        return result
+
+    def _generate(self, eeg_type, ecg_type, duration, sampling_rate, session_id, montage, leads, dtype, gains,
+                  eeg_artifacts, ecg_artifacts, ecg_bleed, outputs=None):
+        n_samples = duration * sampling_rate
+        gains = self.eeg_generator.check_gains(eeg_type, gains, eeg_artifacts)
+
+        with stage('synthesis'):
+            eeg_data, components, _, eeg_events = self.eeg_generator._synthesize_record(
+                eeg_type, montage, n_samples, sampling_rate, dtype, gains, eeg_artifacts)
+        ecg_events = EventLog()
+        with ecg_events.activate():
+            lead_names, lead_data, clean = self.ecg_generator.synthesize(
+                ecg_type, n_samples, sampling_rate, leads, dtype, ecg_artifacts)
+        lead_data = np.atleast_2d(lead_data)
+
+        if ecg_bleed:
+            with stage('ecg_bleed'):
+                eeg_data += np.multiply.outer((cardiac_field_gain(montage) * ecg_bleed).astype(dtype), clean)
+
+        # One (channels x samples) record: EEG channels first, then the ECG leads
+        channels = montage.channels + (["ECG"] if leads is None else [f"ECG {name}" for name in lead_names])
+        channel_types = ["eeg"] * len(montage) + ["ecg"] * len(lead_names)
+        units = [SIGNAL_UNITS[channel_type] for channel_type in channel_types]
+        record = np.concatenate((eeg_data, lead_data))
+        events = EventLog.merge((self.eeg_generator.record_events(eeg_events, gains).shifted(0, len(montage)),
+                                 ecg_events.shifted(len(montage), len(lead_names))))
+        annotations = events.to_array(len(channels), n_samples)
+
+        outputs = outputs or OutputStages()
+
+        # Save data
+        npy_path = save_data_to_npy(record, session_id, sync=not outputs.wait)
+        pyramid_path, pyramid_levels = save_pyramid(record, session_id)
+        annotations_path = save_annotations(annotations, session_id)
+        meta_path = save_signal_metadata(session_id, channels, sampling_rate, 'multimodal', pyramid_levels,
+                                         units=units, channel_types=channel_types, events=annotations)
+
+        # CSV, features and plot only read the saved record
+        title = f"EEG - {eeg_type.replace('_', ' ').title()} / ECG - {ecg_type.replace('_', ' ').title()}"
+        outputs.render("csv", write_csv, record, npy_path, channels, session_id, 'multimodal')
+        tier = quality_tier()
+        outputs.render("plot", render_multimodal_plot, record, npy_path, montage.channels, channels[len(montage):],
+                       title, session_id, sampling_rate, tier["plot_dpi"], tier["plot_seconds"])
+        rhythm_index = len(montage) + (lead_names.index("II") if "II" in lead_names else 0)
+        outputs.thread("features", self._save_features, record, eeg_data, montage, channels, rhythm_index,
+                       sampling_rate, session_id)
+        paths, pending = outputs.finish()
+
+        result = {
+            "csv_path": paths.get("csv"),
+            "npy_path": npy_path,
+            "meta_path": meta_path,
+            "pyramid_path": pyramid_path,
+            "features_path": paths.get("features"),
+            "plot_path": paths.get("plot"),
+            "annotations_path": annotations_path,
+            "annotations": len(annotations),
+            "channels": channels,
+            "channel_types": channel_types,
+            "units": units,
+            "montage": montage.name,
+            "leads": lead_names,
+            "dtype": record.dtype.name,
+            "multimodal_type": f"{eeg_type}+{ecg_type}",
+            "eeg_type": eeg_type,
+            "ecg_type": ecg_type,
+            "components": list(components),
+            "gains": gains,
+            "ecg_bleed": ecg_bleed,
+            "eeg_artifacts": eeg_artifacts,
+            "ecg_artifacts": ecg_artifacts,
+            "quality": current_quality(),
+            "duration": duration,
+            "sampling_rate": sampling_rate
+        }
+        if pending:
+            result["pending"] = pending
+        return result
+
+    @staticmethod
+    def _save_features(record, eeg_data, montage, channels, rhythm_index, sampling_rate, session_id):
+        """Band power of each EEG channel, then the HRV of the rhythm lead, one row per channel"""
+        band_power = extract_band_power(eeg_data, sampling_rate)
+        band_power.insert(0, "channel", montage.channels)
+        hrv = extract_hrv_features(record[rhythm_index], sampling_rate)
+        if not hrv.empty:
+            hrv.insert(0, "channel", channels[rhythm_index])
+        return save_features_to_csv(pd.concat((band_power, hrv), ignore_index=True), session_id)
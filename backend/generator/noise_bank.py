@@ -0,0 +1,180 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from .utils import bandpass_coefficients, random_state, scipy_signal
+
+
+class _BankEntry:
+    """Pre-filtered segments of one (low, high, sampling rate) band"""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.uses = [0] * len(segments)
+
+    @property
+    def length(self):
+        return self.segments[0].size
+
+    @property
+    def nbytes(self):
+        return sum(segment.nbytes for segment in self.segments)
+
+
+class NoiseBank:
+    """Pool of long band-limited noise segments served by random circular shifts
+
+    Segments are filtered in the frequency domain with the squared magnitude
+    of the band-pass filter, which matches the response of filtfilt. They are
+    periodic, so a draw can start at any offset and wrap around the end
+    without a seam. Each draw copies a random window of a random segment and
+    flips its sign at random, so the hot path does no filtering. Segments
+    served `max_reuse` times are rebuilt by a background thread. Whole bands
+    are evicted least recently used first when the memory budget is exceeded.
+    """
+
+    def __init__(self, max_bytes, segment_seconds=120, segments_per_band=4,
+                 max_reuse=50, refresh_interval=5):
+        self.max_bytes = max_bytes
+        self.segment_seconds = segment_seconds
+        self.segments_per_band = segments_per_band
+        self.max_reuse = max_reuse
+        self.refresh_interval = refresh_interval
+        self._entries = OrderedDict()  # least recently used first
+        self._pending = set()
+        self._stale = set()
+        self._bytes = 0
+        self._counts = {"hits": 0, "misses": 0, "fallbacks": 0,
+                        "builds": 0, "refreshes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _segment(self, low, high, sr):
+        """One periodic band-limited segment with the spectrum of filtfilt output"""
+        n_samples = int(self.segment_seconds * sr)
+        # A private generator keeps background builds off the global random state
+        spectrum = np.fft.rfft(np.random.default_rng().standard_normal(n_samples))
+        _, response = scipy_signal.sosfreqz(bandpass_coefficients(low, high, sr),
+                                            worN=np.fft.rfftfreq(n_samples, 1 / sr), fs=sr)
+        spectrum *= np.abs(response) ** 2
+        segment = np.fft.irfft(spectrum, n_samples)
+        segment.setflags(write=False)
+        return segment
+
+    def build(self, low, high, sr):
+        """Fill the bank for one band now, evicting older bands if needed"""
+        key = (low, high, sr)
+        needed = self.segments_per_band * int(self.segment_seconds * sr) * 8
+        if needed > self.max_bytes:
+            with self._lock:
+                self._pending.discard(key)
+            return False
+
+        entry = _BankEntry([self._segment(low, high, sr) for _ in range(self.segments_per_band)])
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            while self._entries and self._bytes + entry.nbytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stale = {s for s in self._stale if s[0] != evicted_key}
+                self._counts["evictions"] += 1
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            self._pending.discard(key)
+            self._counts["builds"] += 1
+        return True
+
+    def draw(self, low, high, samples, sr, dtype=np.float64):
+        """Band-limited noise from the bank, or None if the band is not available
+
+        Missing bands are queued for the background thread, so the caller
+        falls back to exact filtering only until the band has been built.
+        """
+        key = (low, high, sr)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counts["misses"] += 1
+                self._pending.add(key)
+                self._wake.set()
+                return None
+            if samples > entry.length:
+                self._counts["fallbacks"] += 1
+                return None
+            self._entries.move_to_end(key)
+            index = random_state().randint(len(entry.segments))
+            segment = entry.segments[index]
+            entry.uses[index] += 1
+            if entry.uses[index] >= self.max_reuse:
+                self._stale.add((key, index))
+                self._wake.set()
+            self._counts["hits"] += 1
+
+        offset = random_state().randint(segment.size)
+        head = min(samples, segment.size - offset)
+        noise = np.empty(samples, dtype=dtype)
+        noise[:head] = segment[offset:offset + head]
+        noise[head:] = segment[:samples - head]
+        if random_state().rand() < 0.5:
+            np.negative(noise, out=noise)
+        return noise
+
+    def refresh(self):
+        """Build queued bands and replace segments that reached the reuse limit"""
+        with self._lock:
+            pending = list(self._pending)
+            stale = list(self._stale)
+
+        for key in pending:
+            self.build(*key)
+
+        for key, index in stale:
+            segment = self._segment(*key)
+            with self._lock:
+                self._stale.discard((key, index))
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                entry.segments[index] = segment
+                entry.uses[index] = 0
+                self._counts["refreshes"] += 1
+
+    def stats(self):
+        """Memory use, bands held and draw counters"""
+        with self._lock:
+            return {
+                "bands": len(self._entries),
+                "segments": sum(len(e.segments) for e in self._entries.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "reuses": sum(sum(e.uses) for e in self._entries.values()),
+                "stale_segments": len(self._stale),
+                **self._counts
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Noise bank refresh failed: {e}")
+
+    def start(self):
+        """Start the background refresh thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="noise-bank", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
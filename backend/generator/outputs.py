@@ -0,0 +1,221 @@
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import copy_context
+import numpy as np
+from .instrumentation import StageTimer, current_timer
+from .utils import pd, create_ecg_plot, create_eeg_plot, create_multimodal_plot, save_data_to_csv
+
+# Channels drawn by create_eeg_plot and create_multimodal_plot
+PLOT_CHANNELS = 10
+
+_lock = threading.Lock()
+_settings = {"threads": 8, "render_processes": 0}
+_pools = {"threads": None, "renderers": None, "pid": None}
+
+
+def configure(threads=None, render_processes=None):
+    """Set the number of output threads and render processes (0 runs the stages inline / on threads)"""
+    if threads is not None:
+        _settings["threads"] = threads
+    if render_processes is not None:
+        _settings["render_processes"] = render_processes
+
+
+def _init_render_process():
+    # Ctrl+C reaches the whole process group; the parent shuts the renderers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # A serve.py worker's SIGTERM handler would otherwise keep a renderer alive
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _current_pools():
+    """Pools of this process; ones inherited through a fork have no threads behind them"""
+    if _pools["pid"] != os.getpid():
+        _pools.update(threads=None, renderers=None, pid=os.getpid())
+    return _pools
+
+
+def start_render_workers():
+    """Fork the render processes now, while this process runs no other threads
+
+    Forking copies the warm imports and caches for free, but is only safe
+    before the process starts threads, so call this first thing at startup.
+    Without it the render stages run on the output threads instead.
+    """
+    with _lock:
+        pools = _current_pools()
+        if pools["renderers"] is not None or _settings["render_processes"] <= 0:
+            return
+        pools["renderers"] = ProcessPoolExecutor(
+            _settings["render_processes"], mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_render_process)
+        # The pool forks all its processes on the first task
+        pools["renderers"].submit(os.getpid).result()
+
+
+def stop_render_workers():
+    """Shut the render processes down, waiting for the stages they are running
+
+    Call this before leaving through os._exit, which skips the exit hooks
+    that would otherwise stop them.
+    """
+    with _lock:
+        pools = _current_pools()
+        pool, pools["renderers"] = pools["renderers"], None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _thread_pool():
+    with _lock:
+        pools = _current_pools()
+        if pools["threads"] is None and _settings["threads"] > 0:
+            pools["threads"] = ThreadPoolExecutor(_settings["threads"], thread_name_prefix="output")
+        return pools["threads"]
+
+
+def _render_pool():
+    with _lock:
+        return _current_pools()["renderers"]
+
+
+def _drop_render_pool(pool):
+    with _lock:
+        if _pools["renderers"] is pool:
+            _pools["renderers"] = None
+    pool.shutdown(wait=False)
+
+
+def _timed(func, *args):
+    """Run a stage in a render process, returning its result and stage timings"""
+    timer = StageTimer()
+    with timer.activate():
+        result = func(*args)
+    stages = timer.to_dict()
+    stages.pop('total')
+    return result, stages
+
+
+def _frame(record, columns, rows=slice(None), samples=None):
+    """DataFrame of some rows (and the first samples) of a (channels x samples) record or its .npy file"""
+    if isinstance(record, str):
+        record = np.load(record, mmap_mode='r')
+    return pd.DataFrame(np.asarray(record[rows, :samples]).T, columns=columns)
+
+
+def _plot_samples(seconds, sampling_rate):
+    return None if seconds is None else seconds * sampling_rate + 1
+
+
+def write_csv(record, columns, session_id, data_type):
+    return save_data_to_csv(_frame(record, columns), session_id, data_type)
+
+
+# Plots take the dpi and the seconds to draw (None for the whole record) of the quality tier
+
+def render_eeg_plot(record, channels, title, session_id, sampling_rate, dpi=300, seconds=None):
+    shown = channels[:PLOT_CHANNELS]
+    samples = _plot_samples(seconds, sampling_rate)
+    return create_eeg_plot(_frame(record, shown, slice(len(shown)), samples), channels, title, session_id,
+                           sampling_rate, dpi)
+
+
+def render_ecg_plot(record, leads, title, session_id, sampling_rate, dpi=300, seconds=None):
+    samples = _plot_samples(seconds, sampling_rate)
+    return create_ecg_plot(_frame(record, leads, samples=samples), title, session_id, sampling_rate, dpi)
+
+
+def render_multimodal_plot(record, eeg_channels, ecg_channels, title, session_id, sampling_rate, dpi=300,
+                           seconds=None):
+    shown = eeg_channels[:PLOT_CHANNELS]
+    n_eeg = len(eeg_channels)
+    samples = _plot_samples(seconds, sampling_rate)
+    return create_multimodal_plot(_frame(record, shown, slice(len(shown)), samples),
+                                  _frame(record, ecg_channels, slice(n_eeg, None), samples),
+                                  title, session_id, sampling_rate, dpi)
+
+
+class OutputStages:
+    """Output stages of one finished record, run alongside each other
+
+    Once a record is synthesized and saved, its CSV, features and plot only
+    read it, so they need not run one after the other. Feature extraction
+    is numpy work that releases the GIL and runs on a thread; CSV
+    formatting and plotting are pure Python, so they run in forked render
+    processes that read the record back from its .npy file. Stage timings
+    land in the caller's timer either way.
+
+    With wait=False, finish() returns as soon as the stages are submitted
+    and reports the ones still running as pending; when_done() hands each
+    artifact over as it completes.
+    """
+
+    def __init__(self, wait=True):
+        self.wait = wait
+        self.timer = current_timer()
+        self._futures = {}
+
+    def thread(self, name, func, *args):
+        """Run a stage on an output thread (inline when there are none)"""
+        pool = _thread_pool()
+        if pool is None:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = pool.submit(copy_context().run, func, *args)
+        self._futures[name] = future
+        return future
+
+    def render(self, name, func, record, npy_path, *args):
+        """Run a stage in a render process on the saved record (on a thread when there are none)"""
+        def run():
+            pool = _render_pool()
+            if pool is not None:
+                try:
+                    result, stages = pool.submit(_timed, func, npy_path, *args).result()
+                except BrokenProcessPool:
+                    print("A render process died, rendering on threads from now on")
+                    _drop_render_pool(pool)
+                else:
+                    if self.timer is not None:
+                        self.timer.merge_stages(stages)
+                    return result
+            return func(record, *args)
+        return self.thread(name, run)
+
+    def finish(self):
+        """({name: path} of the finished stages, names still running), waiting for all unless wait=False
+
+        An exception raised by a stage is raised here when waiting.
+        """
+        if self.wait:
+            return {name: future.result() for name, future in self._futures.items()}, []
+        paths, pending = {}, []
+        for name, future in self._futures.items():
+            if not future.done():
+                pending.append(name)
+            elif future.exception() is None:
+                paths[name] = future.result()
+        return paths, pending
+
+    def when_done(self, callback, names=None):
+        """Call callback(name, path) as each stage (or each of names) completes; failures are printed"""
+        for name, future in self._futures.items():
+            if names is None or name in names:
+                future.add_done_callback(lambda future, name=name: self._report(callback, name, future))
+
+    @staticmethod
+    def _report(callback, name, future):
+        try:
+            path = future.result()
+            if path is not None:
+                callback(name, path)
+        except Exception as e:
+            print(f"Output stage {name} failed: {e}")
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Samples per bin grow by this factor from one level to the next
+PYRAMID_FACTOR = 8
+
+# Levels are added until the coarsest has at most this many bins
+PYRAMID_MIN_BINS = 256
+
+
+def _decimate(low, high, factor):
+    """Min and max over consecutive groups of `factor` bins; the last group may be short"""
+    starts = np.arange(0, low.shape[1], factor)
+    return np.minimum.reduceat(low, starts, axis=1), np.maximum.reduceat(high, starts, axis=1)
+
+
+def build_pyramid(data, factor=PYRAMID_FACTOR, min_bins=PYRAMID_MIN_BINS):
+    """Min/max decimation levels of a (channels x samples) array
+
+    Returns a (channels x bins x 2) array with the levels stored one after
+    the other, finest first, and a list describing each level as
+    {"bin": samples per bin, "offset": first bin, "length": bins}.
+    """
+    data = np.atleast_2d(data)
+    low, high = data, data
+    levels, blocks = [], []
+    bin_size, offset = 1, 0
+    while low.shape[1] > min_bins:
+        low, high = _decimate(low, high, factor)
+        bin_size *= factor
+        levels.append({"bin": bin_size, "offset": offset, "length": low.shape[1]})
+        blocks.append(np.stack((low, high), axis=-1))
+        offset += low.shape[1]
+    if not blocks:
+        return np.empty((data.shape[0], 0, 2), dtype=data.dtype), levels
+    return np.concatenate(blocks, axis=1), levels
+
+
+def choose_level(levels, n_samples, max_bins):
+    """Finest level that covers n_samples in at most max_bins bins, or None for raw samples"""
+    if n_samples <= 2 * max_bins:
+        return None
+    for level in levels:
+        if -(-n_samples // level["bin"]) <= max_bins:
+            return level
+    return levels[-1] if levels else None
+
+
+def read_window(data, pyramid, levels, indices, start, end, max_points):
+    """Samples of one window, decimated to min/max pairs when it exceeds max_points
+
+    `data` and `pyramid` are usually memory-mapped, so only the rows and
+    bins of the window are read. Returns (samples per bin, first sample,
+    values) where values is (channels x samples) for raw windows and
+    (channels x bins x 2) otherwise.
+    """
+    level = choose_level(levels, end - start, max(1, max_points // 2))
+    if level is None and end - start > max_points:
+        # No stored pyramid (older sessions): decimate the window directly
+        bin_size = -(-(end - start) // max(1, max_points // 2))
+        window = np.asarray(data[indices, start:end])
+        low, high = _decimate(window, window, bin_size)
+        return bin_size, start, np.stack((low, high), axis=-1)
+    if level is None:
+        return 1, start, np.asarray(data[indices, start:end])
+
+    bin_size = level["bin"]
+    first = start // bin_size
+    last = min(-(-end // bin_size), level["length"])
+    offset = level["offset"]
+    return bin_size, first * bin_size, np.asarray(pyramid[indices, offset + first:offset + last])
+
+
+def pyramid_layout(n_samples, factor=PYRAMID_FACTOR, min_bins=PYRAMID_MIN_BINS):
+    """Levels that build_pyramid produces for a record of n_samples, and their total bins"""
+    levels, length, bin_size, offset = [], n_samples, 1, 0
+    while length > min_bins:
+        length = -(-length // factor)
+        bin_size *= factor
+        levels.append({"bin": bin_size, "offset": offset, "length": length})
+        offset += length
+    return levels, offset
+
+
+class PyramidWriter:
+    """Fills an array laid out like build_pyramid's output from consecutive blocks of a record
+
+    Levels whose bin divides the block length are decimated block by block.
+    The coarser ones are built from the last of those once every block has
+    been written. All blocks but the last must have block_samples samples.
+    """
+
+    def __init__(self, out, levels, block_samples, factor=PYRAMID_FACTOR):
+        self.out = out
+        self.levels = levels
+        self.factor = factor
+        self.n_streamed = sum(1 for level in levels if block_samples % level["bin"] == 0)
+        if levels and not self.n_streamed:
+            raise ValueError(f"Blocks must be a multiple of {factor} samples")
+
+    def write(self, block, start):
+        """Add the bins of a block whose first sample is `start` samples into the record"""
+        low, high = block, block
+        for level in self.levels[:self.n_streamed]:
+            low, high = _decimate(low, high, self.factor)
+            first = level["offset"] + start // level["bin"]
+            self.out[:, first:first + low.shape[1]] = np.stack((low, high), axis=-1)
+
+    def finish(self):
+        """Build the levels too coarse to fill block by block"""
+        for previous, level in zip(self.levels[self.n_streamed - 1:], self.levels[self.n_streamed:]):
+            bins = np.asarray(self.out[:, previous["offset"]:previous["offset"] + previous["length"]])
+            low, high = _decimate(bins[..., 0], bins[..., 1], self.factor)
+            self.out[:, level["offset"]:level["offset"] + level["length"]] = np.stack((low, high), axis=-1)
@@ -0,0 +1,133 @@
+import os
+import numpy as np
+from .instrumentation import stage
+from .pyramid import PYRAMID_FACTOR, PyramidWriter, pyramid_layout
+from .utils import pd, scipy_signal, band_power_table, extract_epoch_band_power
+
+# Records too large to hold in memory are generated and written in blocks of
+# this many samples per channel. Memory then depends on the block size only.
+STREAM_BLOCK_SAMPLES = 2 ** 17
+
+# Independent background blocks are joined by crossfading this many seconds
+CROSSFADE_SECONDS = 2
+
+
+def block_samples(requested=STREAM_BLOCK_SAMPLES):
+    """Block length rounded down to a multiple of the pyramid factor, so levels fill block by block"""
+    return max(PYRAMID_FACTOR, requested - requested % PYRAMID_FACTOR)
+
+
+def crossfade(tail, head):
+    """Join the overlapping ends of two independent segments, keeping their variance"""
+    # sin^2 + cos^2 = 1, so uncorrelated segments keep their power through the fade
+    fade_in = np.sin(np.linspace(0, np.pi / 2, head.shape[-1]))
+    return tail * fade_in[::-1] + head * fade_in
+
+
+class RecordWriter:
+    """Write a (channels x samples) record block by block as .npy, CSV and min/max pyramid
+
+    The files have the same layout as the ones written in one go by
+    save_data_to_npy, save_data_to_csv and save_pyramid.
+    """
+
+    def __init__(self, session_id, channels, n_samples, dtype, block_size):
+        self.channels = list(channels)
+        self.npy_path = f"static/npy/{session_id}_data.npy"
+        self.csv_path = f"static/csv/{session_id}_data.csv"
+        self.pyramid_path = f"static/npy/{session_id}_pyramid.npy"
+        self.levels, n_bins = pyramid_layout(n_samples)
+        shape = (len(self.channels), n_samples)
+        self.data = np.lib.format.open_memmap(self.npy_path, mode='w+', dtype=dtype, shape=shape)
+        self.pyramid = np.lib.format.open_memmap(self.pyramid_path, mode='w+', dtype=dtype,
+                                                 shape=(shape[0], n_bins, 2))
+        self.pyramid_writer = PyramidWriter(self.pyramid, self.levels, block_size)
+        self.csv = open(self.csv_path, 'w', newline='')
+        pd.DataFrame(columns=self.channels).to_csv(self.csv, index=False)
+        self.offset = 0
+
+    def write(self, block):
+        """Append the next (channels x samples) block"""
+        n = block.shape[1]
+        with stage('save_data_to_npy'):
+            self.data[:, self.offset:self.offset + n] = block
+        with stage('save_pyramid'):
+            self.pyramid_writer.write(block, self.offset)
+        with stage('save_data_to_csv'):
+            pd.DataFrame(block.T, columns=self.channels).to_csv(self.csv, header=False, index=False)
+        self.offset += n
+
+    def close(self):
+        """Finish the pyramid and flush every file, returning (csv, npy, pyramid path, levels)"""
+        with stage('save_pyramid'):
+            self.pyramid_writer.finish()
+        self._release()
+        return self.csv_path, self.npy_path, self.pyramid_path, self.levels
+
+    def abort(self):
+        """Close and delete the partly written files"""
+        self._release()
+        for path in (self.csv_path, self.npy_path, self.pyramid_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _release(self):
+        self.csv.close()
+        for array in (self.data, self.pyramid):
+            array.flush()
+        self.data = self.pyramid = None
+
+
+class BandPowerAccumulator:
+    """Whole-record band power from consecutive blocks
+
+    Welch's method averages the periodograms of short segments, so the
+    PSDs of the blocks, weighted by their length, give the record's PSD
+    (minus the few segments that would straddle block boundaries).
+    """
+
+    def __init__(self, sampling_rate, nperseg=256):
+        self.sampling_rate = sampling_rate
+        self.nperseg = nperseg
+        self.freqs = None
+        self.total = None
+        self.samples = 0
+
+    def add(self, block):
+        if block.shape[1] < self.nperseg and self.samples:
+            return  # too short for a full segment; the blocks before it stand for the record
+        with stage('extract_band_power'):
+            freqs, psd = scipy_signal.welch(block, fs=self.sampling_rate, nperseg=self.nperseg, axis=-1)
+            weighted = psd.astype(np.float64) * block.shape[1]
+            if self.total is None:
+                self.freqs, self.total = freqs, weighted
+            else:
+                self.total += weighted
+            self.samples += block.shape[1]
+
+    def result(self):
+        """Band power features like extract_band_power returns"""
+        return band_power_table(self.freqs, self.total / self.samples)
+
+
+class EpochPowerAccumulator:
+    """Epoch-wise band power from consecutive blocks, carrying partial epochs over"""
+
+    def __init__(self, sampling_rate, epoch_seconds):
+        self.sampling_rate = sampling_rate
+        self.epoch_seconds = epoch_seconds
+        self.epoch_samples = int(round(epoch_seconds * sampling_rate))
+        self.carry = None
+        self.parts = []
+
+    def add(self, block):
+        if self.carry is not None and self.carry.shape[1]:
+            block = np.concatenate((self.carry, block), axis=1)
+        whole = block.shape[1] // self.epoch_samples * self.epoch_samples
+        if whole:
+            self.parts.append(extract_epoch_band_power(block[:, :whole], self.sampling_rate, self.epoch_seconds))
+        self.carry = block[:, whole:].copy()
+
+    def result(self):
+        """(epochs x channels x bands) array like extract_epoch_band_power returns"""
+        return np.concatenate(self.parts) if self.parts else None
@@ -1,59 +1,343 @@
+import json
 import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from math import gcd
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.signal import butter, filtfilt, welch
-import neurokit2 as nk
+from .annotations import EVENT_CODES
+from .instrumentation import instrumented
+from .lazy import lazy_import
+from .pyramid import PYRAMID_FACTOR, build_pyramid
+
+# Heavy dependencies are imported on first use to keep startup fast
+pd = lazy_import('pandas')
+plt = lazy_import('matplotlib.pyplot')
+nk = lazy_import('neurokit2')
+scipy_signal = lazy_import('scipy.signal')
+
+# Frequency bands (Hz) used for EEG band power features
+EEG_BANDS = {
+    "delta": (1, 4),
+    "theta": (4, 8),
+    "alpha": (8, 12),
+    "beta": (13, 30),
+    "gamma": (30, 45)
+}
+
+# Sample types accepted for generated signals
+SIGNAL_DTYPES = ("float64", "float32")
+
+# Unit of the samples of each signal
+SIGNAL_UNITS = {"eeg": "uV", "ecg": "mV"}
+
+# Fidelity/speed tiers of a generate request:
+# - filter: "causal" single-pass filtering, "zero_phase" filtfilt at a reduced
+#   rate where the band allows, or "full_rate" filtfilt at the output rate
+#   (which also bypasses the noise bank)
+# - hrv: "time" domain only from a light R-peak detection, or "all" (time,
+#   frequency and nonlinear) indices from the full neurokit processing
+# - hrv_rate: rate (Hz) the ECG is upsampled to before R-peak detection, so
+#   peak times are not quantized to the sampling interval (None keeps it)
+# - plot_dpi, and plot_seconds to only draw the seconds shown (None draws the whole record)
+QUALITY_TIERS = {
+    "draft": {"filter": "causal", "hrv": "time", "hrv_rate": None, "plot_dpi": 72, "plot_seconds": 10},
+    "standard": {"filter": "zero_phase", "hrv": "all", "hrv_rate": None, "plot_dpi": 300, "plot_seconds": None},
+    "high": {"filter": "full_rate", "hrv": "all", "hrv_rate": 1000, "plot_dpi": 300, "plot_seconds": None}
+}
+DEFAULT_QUALITY = "standard"
+
+# Tier of the generate call running in this context
+_active_quality = ContextVar('active_quality', default=DEFAULT_QUALITY)
+
+def resolve_quality(quality=None):
+    """Validate a quality tier name (None for the default tier)"""
+    if quality is None:
+        return DEFAULT_QUALITY
+    if not isinstance(quality, str) or quality not in QUALITY_TIERS:
+        raise ValueError(f"Unsupported quality. Available: {', '.join(QUALITY_TIERS)}")
+    return quality
+
+@contextmanager
+def use_quality(quality):
+    """Make the stages inside the block run at a quality tier"""
+    token = _active_quality.set(resolve_quality(quality))
+    try:
+        yield
+    finally:
+        _active_quality.reset(token)
+
+def current_quality():
+    """Name of the quality tier active in this context"""
+    return _active_quality.get()
+
+def quality_tier():
+    """Settings of the quality tier active in this context"""
+    return QUALITY_TIERS[_active_quality.get()]
+
+def resolve_dtype(dtype=None):
+    """Map a dtype name to one of the supported sample types"""
+    if dtype is None:
+        return np.dtype(np.float64)
+    try:
+        dtype = np.dtype(dtype)
+    except TypeError:
+        dtype = None
+    if dtype is None or dtype.name not in SIGNAL_DTYPES:
+        raise ValueError(f"Unsupported dtype. Available: {', '.join(SIGNAL_DTYPES)}")
+    return dtype
 
 def create_output_directories():
     """Create necessary output directories"""
     directories = [
         "static/plots",
         "static/csv",
+        "static/npy",
+        "static/profiles",
         "data"
     ]
     
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
 
-def band_limited_noise(low, high, samples, sr):
-    """Generate band-limited noise"""
+# Bands are synthesized at an internal rate of at least this multiple of their
+# upper edge, then interpolated to the output rate
+MULTIRATE_OVERSAMPLING = 4
+
+# Extra low-rate samples on each side, trimmed to drop interpolation edge effects
+MULTIRATE_PAD = 16
+
+def multirate_factor(high, sr):
+    """Integer factor by which a band can be synthesized below the output rate"""
+    return max(1, int(sr // (MULTIRATE_OVERSAMPLING * high)))
+
+@lru_cache(maxsize=64)
+def interpolation_filter(factor, half_width=4):
+    """Polyphase interpolation filter for upsampling by an integer factor
+    
+    The internal rate leaves a wide transition band, so a filter spanning
+    half_width low-rate samples on each side suppresses images to about
+    1e-6 of the band power. That is less than half the taps of the
+    resample_poly default.
+    """
+    return scipy_signal.firwin(2 * half_width * factor + 1, 1 / factor, window=('kaiser', 5.0))
+
+@lru_cache(maxsize=256)
+def bandpass_coefficients(low, high, sr, order=4):
+    """Design (and cache) a Butterworth band-pass filter as second-order sections"""
     nyq = sr / 2
-    b, a = butter(4, [low / nyq, high / nyq], btype='band')
-    white = np.random.randn(samples)
-    return filtfilt(b, a, white)
+    return scipy_signal.butter(order, [low / nyq, high / nyq], btype='band', output='sos')
+
+# Cycles of the lowest band frequency a causal filter runs before its output is kept
+CAUSAL_SETTLE_CYCLES = 3
+
+@lru_cache(maxsize=256)
+def causal_filter(low, high, sr):
+    """(gain, settle samples) that make single-pass filtered noise match filtfilt output
+
+    A single pass applies |H| instead of |H|^2, which lets more power through
+    the skirts; the gain brings the total power back to that of filtfilt.
+    The filter starts at rest, so the first settle samples are dropped.
+    """
+    _, h = scipy_signal.sosfreqz(bandpass_coefficients(low, high, sr), worN=8192)
+    power = np.abs(h) ** 2
+    gain = np.sqrt(np.sum(power ** 2) / np.sum(power))
+    return gain, int(np.ceil(CAUSAL_SETTLE_CYCLES * sr / low))
+
+# Optional NoiseBank serving pre-filtered noise instead of filtering per call
+noise_bank = None
+
+def set_noise_bank(bank):
+    """Route band_limited_noise through a NoiseBank (None restores exact filtering)"""
+    global noise_bank
+    noise_bank = bank
+
+# Seeded requests draw from a RandomState of their own, set per thread
+_random = threading.local()
+
+def random_state():
+    """RandomState of the current seeded block, or the global np.random module"""
+    state = getattr(_random, "state", None)
+    return np.random if state is None else state
+
+def make_random_state(seed=None):
+    """RandomState for a request seed; None keeps drawing from the global state"""
+    return None if seed is None else np.random.RandomState(seed)
+
+def check_seed(seed):
+    """Validate a request seed (None for a fresh random record)"""
+    if seed is None:
+        return None
+    if isinstance(seed, bool) or not isinstance(seed, int) or not 0 <= seed < 2 ** 32:
+        raise ValueError("seed must be an integer between 0 and 2**32 - 1")
+    return seed
+
+@contextmanager
+def use_random_state(state):
+    """Make random_state() return `state` (None for the global one) inside the block"""
+    previous = getattr(_random, "state", None)
+    _random.state = state
+    try:
+        yield
+    finally:
+        _random.state = previous
+
+def _bank_noise(low, high, samples, sr, dtype, n_rows, states):
+    """Rows drawn from the noise bank for every state, or None if any draw misses"""
+    batches = []
+    for state in states:
+        with use_random_state(state):
+            rows = [noise_bank.draw(low, high, samples, sr, dtype) for _ in range(n_rows)]
+        if any(row is None for row in rows):
+            return None
+        batches.append(np.stack(rows))
+    return batches
 
+@instrumented
+def band_limited_noise(low, high, samples, sr, dtype=np.float64, rows=None, states=None):
+    """Generate band-limited noise
+
+    Returns one series, or (rows x samples) when `rows` is given. With
+    `states`, a list of RandomStates (None for the global one), each state
+    draws its own rows and all of them are filtered in one pass. A list with
+    one array per state is returned in that case, with the same values each
+    state would get from a call of its own.
+    """
+    batched = states is not None
+    if not batched:
+        states = [random_state()]
+    n_rows = rows or 1
+    
+    tier = quality_tier()
+    noise = None
+    if noise_bank is not None and tier["filter"] != "full_rate":
+        noise = _bank_noise(low, high, samples, sr, dtype, n_rows, states)
+    if noise is None:
+        factor = 1 if tier["filter"] == "full_rate" else multirate_factor(high, sr)
+        causal = tier["filter"] == "causal"
+        gain, settle = causal_filter(low, high, sr / factor) if causal else (1.0, 0)
+        # Slow bands are filtered at a reduced rate and interpolated back up
+        n_white = samples if factor == 1 else -(-samples // factor) + 2 * MULTIRATE_PAD
+        white = np.concatenate([(state or np.random).randn(n_rows, n_white + settle) for state in states])
+        sos = bandpass_coefficients(low, high, sr / factor)
+        if factor > 1:
+            # White noise at 1/factor of the rate is scaled so the band power matches
+            white /= np.sqrt(factor)
+        if causal:
+            filtered = scipy_signal.sosfilt(sos, white, axis=-1)[:, settle:] * gain
+        else:
+            # The recursion runs in float64: narrow low bands drift in float32
+            filtered = scipy_signal.sosfiltfilt(sos, white, axis=-1)
+        if factor > 1:
+            filtered = scipy_signal.resample_poly(filtered, factor, 1, axis=-1, window=interpolation_filter(factor))
+            start = MULTIRATE_PAD * factor
+            filtered = filtered[:, start:start + samples]
+        noise = np.split(filtered.astype(dtype, copy=False), len(states))
+    
+    if batched:
+        return noise
+    return noise[0] if rows else noise[0][0]
+
+def gaussian_noise(scale, shape, dtype=np.float64):
+    """Zero-mean Gaussian noise, drawn row by row so float32 never needs a float64 copy"""
+    if np.dtype(dtype) == np.float64:
+        return random_state().normal(0, scale, shape)
+    noise = np.empty(shape, dtype=dtype)
+    for row in noise.reshape(-1, noise.shape[-1]):
+        row[:] = random_state().normal(0, scale, noise.shape[-1])
+    return noise
+
+@instrumented
 def extract_band_power(eeg_data, sampling_rate=256):
     """Extract band power features from EEG data"""
-    bands = {
-        "delta": (1, 4), 
-        "theta": (4, 8), 
-        "alpha": (8, 12),
-        "beta": (13, 30), 
-        "gamma": (30, 45)
-    }
-    
-    power = {k: [] for k in bands}
-    
-    for ch in eeg_data:
-        f, Pxx = welch(ch, fs=sampling_rate)
-        for band, (low, high) in bands.items():
-            idx = np.logical_and(f >= low, f <= high)
-            power[band].append(np.trapz(Pxx[idx], f[idx]))
-    
+    f, Pxx = scipy_signal.welch(np.atleast_2d(eeg_data), fs=sampling_rate, axis=-1)
+    return band_power_table(f, Pxx)
+
+def band_power_table(freqs, psd):
+    """Band power features, one row per channel, from (channels x freqs) power spectral densities"""
+    power = {}
+    for band, (low, high) in EEG_BANDS.items():
+        idx = np.logical_and(freqs >= low, freqs <= high)
+        power[band] = np.trapz(psd[:, idx], freqs[idx], axis=-1)
     return pd.DataFrame(power)
 
+def check_record_size(duration, sampling_rate):
+    """Validate the duration (s) and sampling rate (Hz) of a request"""
+    for name, value in (("duration", duration), ("sampling_rate", sampling_rate)):
+        if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+            raise ValueError(f"{name} must be a positive integer")
+
+def check_epoch_seconds(epoch_seconds, duration):
+    """Validate the epoch length used for epoch-wise features"""
+    if epoch_seconds is None:
+        return None
+    if isinstance(epoch_seconds, bool) or not isinstance(epoch_seconds, (int, float)):
+        raise ValueError("epoch_seconds must be a number")
+    if not 0 < epoch_seconds <= duration:
+        raise ValueError("epoch_seconds must be positive and at most the duration")
+    return epoch_seconds
+
+@instrumented
+def extract_epoch_band_power(eeg_data, sampling_rate=256, epoch_seconds=30, max_block_bytes=64 * 1024 ** 2):
+    """Band power per epoch as an (epochs x channels x bands) float32 array
+
+    The record is viewed as (channels x epochs x epoch samples) and a single
+    batched spectrogram with Welch's defaults runs over all epochs at once.
+    Averaging its segments within an epoch gives that epoch's Welch PSD, and
+    the bands are integrated over precomputed frequency slices. Epochs are
+    processed in blocks to bound the size of the spectrogram. A trailing
+    partial epoch is dropped.
+    """
+    eeg_data = np.atleast_2d(eeg_data)
+    n_channels, n_samples = eeg_data.shape
+    epoch_samples = int(round(epoch_seconds * sampling_rate))
+    n_epochs = n_samples // epoch_samples
+    epochs = eeg_data[:, :n_epochs * epoch_samples].reshape(n_channels, n_epochs, epoch_samples)
+
+    nperseg = min(256, epoch_samples)
+    freqs = np.fft.rfftfreq(nperseg, 1 / sampling_rate)
+    slices = []
+    for low, high in EEG_BANDS.values():
+        idx = np.flatnonzero((freqs >= low) & (freqs <= high))
+        slices.append(slice(idx[0], idx[-1] + 1) if idx.size else slice(0, 0))
+
+    power = np.zeros((n_epochs, n_channels, len(EEG_BANDS)), dtype=np.float32)
+    per_epoch = n_channels * freqs.size * max(1, 2 * epoch_samples // nperseg) * 8
+    block = max(1, max_block_bytes // per_epoch)
+    for start in range(0, n_epochs, block):
+        _, _, sxx = scipy_signal.spectrogram(epochs[:, start:start + block], fs=sampling_rate,
+                                             window='hann', nperseg=nperseg, noverlap=nperseg // 2,
+                                             axis=-1)
+        psd = sxx.mean(axis=-1)  # channels x epochs x freqs
+        for band, band_slice in enumerate(slices):
+            if band_slice.stop > band_slice.start:
+                power[start:start + block, :, band] = np.trapz(
+                    psd[..., band_slice], freqs[band_slice], axis=-1).T
+    return power
+
+@instrumented
 def extract_hrv_features(ecg_data, sampling_rate=256):
-    """Extract HRV features from ECG data"""
+    """Extract HRV features from ECG data, at the detail and peak timing precision of the quality tier"""
     try:
+        tier = quality_tier()
+        if tier["hrv"] == "time":
+            cleaned = nk.ecg_clean(ecg_data, sampling_rate=sampling_rate)
+            _, info = nk.ecg_peaks(cleaned, sampling_rate=sampling_rate)
+            return nk.hrv_time(info, sampling_rate=sampling_rate)
+        if tier["hrv_rate"] and sampling_rate < tier["hrv_rate"]:
+            divisor = gcd(tier["hrv_rate"], sampling_rate)
+            ecg_data = scipy_signal.resample_poly(ecg_data, tier["hrv_rate"] // divisor, sampling_rate // divisor)
+            sampling_rate = tier["hrv_rate"]
         _, info = nk.ecg_process(ecg_data, sampling_rate=sampling_rate)
-        hrv = nk.hrv(info, sampling_rate=sampling_rate, features=['time', 'frequency'], show=False)
+        hrv = nk.hrv(info, sampling_rate=sampling_rate, show=False)
         return hrv
     except Exception as e:
         print(f"HRV extraction failed: {e}")
         return pd.DataFrame()
 
-def create_eeg_plot(eeg_data, channels, title, session_id, sampling_rate=256):
+@instrumented
+def create_eeg_plot(eeg_data, channels, title, session_id, sampling_rate=256, dpi=300):
     """Create clinical-style EEG plot"""
     fig, ax = plt.subplots(figsize=(15, 10))
     
@@ -76,25 +360,32 @@ def create_eeg_plot(eeg_data, channels, title, session_id, sampling_rate=256):
     ax.set_yticks([])
     ax.grid(True, alpha=0.3)
     
-    plt.tight_layout()
+    fig.tight_layout()
     
-    # Save plot
+    # Save plot through the figure itself: pyplot's current figure is shared between request threads
     plot_path = f"static/plots/{session_id}_plot.png"
-    plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    fig.savefig(plot_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
     
     return plot_path
 
-def create_ecg_plot(ecg_data, title, session_id, sampling_rate=256):
+@instrumented
+def create_ecg_plot(ecg_data, title, session_id, sampling_rate=256, dpi=300):
     """Create clinical-style ECG plot with red grid"""
-    fig, ax = plt.subplots(figsize=(15, 4))
+    leads = list(ecg_data.columns)
+    spacing = 3  # mV between stacked leads
+    fig, ax = plt.subplots(figsize=(15, 4 + 1.5 * (len(leads) - 1)))
     
-    # Plot ECG signal
-    ax.plot(ecg_data.index / sampling_rate, ecg_data.values, color='black', linewidth=1.2)
+    # Plot ECG signal, one trace per lead from top to bottom
+    for i, lead in enumerate(leads):
+        offset = -i * spacing
+        ax.plot(ecg_data.index / sampling_rate, ecg_data[lead].values + offset, color='black', linewidth=1.2)
+        if len(leads) > 1:
+            ax.text(-0.3, offset, lead, fontsize=10, va='center', fontweight='bold')
     
     # Red grid like ECG paper
     ax.set_facecolor('#fffafa')
-    for y in np.arange(-2, 2.5, 0.5):
+    for y in np.arange(-2 - (len(leads) - 1) * spacing, 2.5, 0.5):
         ax.axhline(y, color='red', linewidth=0.3, alpha=0.4)
     for x in np.arange(0, len(ecg_data) / sampling_rate + 1, 0.2):
         ax.axvline(x, color='red', linewidth=0.3, alpha=0.4)
@@ -105,21 +396,115 @@ def create_ecg_plot(ecg_data, title, session_id, sampling_rate=256):
     ax.set_ylabel("mV", fontsize=12)
     ax.grid(False)
     
-    plt.tight_layout()
+    fig.tight_layout()
     
-    # Save plot
+    # Save plot through the figure itself: pyplot's current figure is shared between request threads
     plot_path = f"static/plots/{session_id}_plot.png"
-    plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    fig.savefig(plot_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
     
     return plot_path
 
+@instrumented
+def create_multimodal_plot(eeg_data, ecg_data, title, session_id, sampling_rate=256, dpi=300):
+    """Plot EEG channels above the ECG leads of the same record on one time axis"""
+    shown_channels = list(eeg_data.columns[:10])
+    leads = list(ecg_data.columns)
+    fig, (eeg_ax, ecg_ax) = plt.subplots(
+        2, 1, sharex=True, figsize=(15, 12), gridspec_kw={"height_ratios": [len(shown_channels), 2 + len(leads)]})
+    
+    spacing = 200
+    colors = plt.cm.tab10(np.linspace(0, 1, len(shown_channels)))
+    for i, ch in enumerate(shown_channels):
+        eeg_ax.plot(eeg_data.index / sampling_rate, eeg_data[ch].values + i * spacing, color=colors[i],
+                    linewidth=0.8)
+        eeg_ax.text(-1, i * spacing, ch, fontsize=10, va='center', fontweight='bold')
+    eeg_ax.set_ylim(-spacing, (len(shown_channels) + 0.5) * spacing)
+    eeg_ax.set_ylabel("EEG (μV)", fontsize=12)
+    eeg_ax.set_yticks([])
+    eeg_ax.grid(True, alpha=0.3)
+    eeg_ax.set_title(title, fontsize=14, fontweight='bold')
+    
+    lead_spacing = 3  # mV between stacked leads
+    for i, lead in enumerate(leads):
+        offset = -i * lead_spacing
+        ecg_ax.plot(ecg_data.index / sampling_rate, ecg_data[lead].values + offset, color='black', linewidth=1.0)
+        ecg_ax.text(-1, offset, lead, fontsize=10, va='center', fontweight='bold')
+    ecg_ax.set_facecolor('#fffafa')
+    ecg_ax.grid(True, color='red', linewidth=0.3, alpha=0.4)
+    ecg_ax.set_ylabel("ECG (mV)", fontsize=12)
+    ecg_ax.set_xlabel("Time (s)", fontsize=12)
+    ecg_ax.set_xlim(0, 10)
+    
+    fig.tight_layout()
+    
+    # Save plot through the figure itself: pyplot's current figure is shared between request threads
+    plot_path = f"static/plots/{session_id}_plot.png"
+    fig.savefig(plot_path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    
+    return plot_path
+
+@instrumented
 def save_data_to_csv(data, session_id, data_type):
     """Save data to CSV file"""
     csv_path = f"static/csv/{session_id}_data.csv"
     data.to_csv(csv_path, index=False)
     return csv_path
 
+@instrumented
+def save_data_to_npy(data, session_id, sync=False):
+    """Save the raw (channels x samples) array in NumPy's binary format, flushed to disk with sync"""
+    npy_path = f"static/npy/{session_id}_data.npy"
+    with open(npy_path, 'wb') as f:
+        np.save(f, np.atleast_2d(data))
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    return npy_path
+
+@instrumented
+def save_pyramid(data, session_id):
+    """Save the min/max decimation pyramid of the raw array, returning (path, levels)"""
+    pyramid, levels = build_pyramid(data)
+    pyramid_path = f"static/npy/{session_id}_pyramid.npy"
+    np.save(pyramid_path, pyramid)
+    return pyramid_path, levels
+
+@instrumented
+def save_epoch_features(power, session_id):
+    """Save the (epochs x channels x bands) band power array"""
+    epochs_path = f"static/npy/{session_id}_epochs.npy"
+    np.save(epochs_path, power)
+    return epochs_path
+
+@instrumented
+def save_annotations(events, session_id):
+    """Save the ground-truth event annotations of a record (see annotations.annotation_dtype)"""
+    annotations_path = f"static/npy/{session_id}_annotations.npy"
+    np.save(annotations_path, events)
+    return annotations_path
+
+def save_signal_metadata(session_id, channels, sampling_rate, signal_type, pyramid_levels=None,
+                         epoch_seconds=None, units=None, channel_types=None, events=None):
+    """Save the channel names, units, sampling rate and array layouts that describe the .npy files"""
+    meta_path = f"static/npy/{session_id}_meta.json"
+    meta = {"channels": list(channels), "sampling_rate": sampling_rate, "signal_type": signal_type,
+            "units": list(units or [SIGNAL_UNITS[signal_type]] * len(channels))}
+    if channel_types is not None:
+        meta["channel_types"] = list(channel_types)
+    if pyramid_levels is not None:
+        meta["pyramid"] = {"factor": PYRAMID_FACTOR, "levels": pyramid_levels}
+    if epoch_seconds is not None:
+        meta["epochs"] = {"seconds": epoch_seconds, "bands": list(EEG_BANDS)}
+    if events is not None:
+        meta["annotations"] = {"count": len(events), "codes": EVENT_CODES,
+                               "max_duration": int(events["duration"].max()) if len(events) else 0}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return meta_path
+
+@instrumented
 def save_features_to_csv(features, session_id):
     """Save features to CSV file"""
     if not features.empty:
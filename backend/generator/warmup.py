@@ -0,0 +1,54 @@
+import io
+import time
+from .utils import (
+    EEG_BANDS, pd, plt, nk, scipy_signal, bandpass_coefficients, causal_filter, interpolation_filter,
+    multirate_factor
+)
+
+# Sampling rates offered by the UI and API clients
+WARMUP_RATES = (128, 256, 512, 1024, 2048)
+
+# Bands filtered by the generators besides the feature bands (burst suppression)
+EXTRA_BANDS = ((1, 30),)
+
+
+def warm_up(sampling_rates=WARMUP_RATES, noise_bank=None):
+    """Import heavy modules and prebuild filter banks ahead of the first request"""
+    timings = {}
+
+    start = time.perf_counter()
+    for module in (pd, scipy_signal, nk, plt):
+        module.load()
+    timings["imports"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bands = list(EEG_BANDS.values()) + list(EXTRA_BANDS)
+    for sr in sampling_rates:
+        for low, high in bands:
+            if high < sr / 2:
+                factor = multirate_factor(high, sr)
+                bandpass_coefficients(low, high, sr / factor)
+                causal_filter(low, high, sr / factor)  # draft quality
+                if factor > 1:
+                    interpolation_filter(factor)
+    timings["filter_bank"] = time.perf_counter() - start
+
+    if noise_bank is not None:
+        start = time.perf_counter()
+        for sr in sampling_rates:
+            for low, high in bands:
+                if high < sr / 2:
+                    noise_bank.build(low, high, sr)
+        timings["noise_bank"] = time.perf_counter() - start
+
+    # First calls pay for template setup, font loading and renderer caches
+    start = time.perf_counter()
+    nk.ecg_simulate(duration=2, sampling_rate=256, heart_rate=75)
+    fig, ax = plt.subplots(figsize=(2, 1))
+    ax.plot([0, 1], [0, 1])
+    ax.set_title("warm-up")
+    fig.savefig(io.BytesIO(), format='png', dpi=50)
+    plt.close(fig)
+    timings["templates"] = time.perf_counter() - start
+
+    return timings
@@ -0,0 +1,232 @@
+import threading
+
+# Histogram buckets in seconds, from fast stages up to long records
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a monotonic count that is kept by another component"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_max(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.counter(
+    "generator_http_requests_total", "HTTP requests handled",
+    ("endpoint", "method", "status"))
+ERRORS = registry.counter(
+    "generator_http_errors_total", "HTTP requests that failed with a server error",
+    ("endpoint",))
+REQUEST_DURATION = registry.histogram(
+    "generator_http_request_duration_seconds", "HTTP request latency",
+    ("endpoint",))
+IN_PROGRESS = registry.gauge(
+    "generator_generate_in_progress", "Generate requests currently queued or running",
+    ("signal",))
+STAGE_WALL = registry.histogram(
+    "generator_stage_duration_seconds", "Wall time spent in a pipeline stage per request",
+    ("signal", "stage"))
+STAGE_CPU = registry.histogram(
+    "generator_stage_cpu_seconds", "CPU time spent in a pipeline stage per request",
+    ("signal", "stage"))
+STAGE_PEAK = registry.gauge(
+    "generator_stage_peak_bytes", "Largest traced memory peak seen for a pipeline stage",
+    ("signal", "stage"))
+STORAGE_BYTES = registry.gauge(
+    "generator_storage_bytes", "Bytes used by generated artifacts")
+STORAGE_SESSIONS = registry.gauge(
+    "generator_storage_sessions", "Sessions with artifacts on disk")
+
+NOISE_BANK_BYTES = registry.gauge(
+    "generator_noise_bank_bytes", "Bytes held by the pre-filtered noise bank")
+NOISE_BANK_DRAWS = registry.counter(
+    "generator_noise_bank_draws_total", "Noise bank lookups by outcome (hit, miss, fallback)",
+    ("result",))
+NOISE_BANK_REFRESHES = registry.counter(
+    "generator_noise_bank_refreshes_total", "Noise bank segments rebuilt after reaching the reuse limit")
+
+ADMISSION_DECISIONS = registry.counter(
+    "generator_admission_decisions_total",
+    "Generate requests by admission outcome (inline, chunked, queued, rejected, timeout, queue_full)",
+    ("result",))
+ADMISSION_RESERVED_BYTES = registry.gauge(
+    "generator_admission_reserved_bytes", "Estimated peak memory reserved by running generate requests")
+ADMISSION_WAITING = registry.gauge(
+    "generator_admission_waiting", "Generate requests queued for memory")
+
+COALESCED_REQUESTS = registry.counter(
+    "generator_coalesced_requests_total", "EEG generate requests by coalescing outcome (shared, batched, alone)",
+    ("result",))
+COALESCED_BATCHES = registry.counter(
+    "generator_coalesced_batches_total", "Batches of two or more EEG generate requests run together")
+COALESCED_LARGEST_BATCH = registry.gauge(
+    "generator_coalesced_largest_batch", "Largest batch of EEG generate requests run together")
+
+
+def observe_timings(signal, timings):
+    """Feed the stage breakdown of one generate call into the histograms"""
+    for stage_name, entry in timings.items():
+        STAGE_WALL.observe(entry["wall"], signal=signal, stage=stage_name)
+        STAGE_CPU.observe(entry["cpu"], signal=signal, stage=stage_name)
+        if "peak_bytes" in entry:
+            STAGE_PEAK.set_max(entry["peak_bytes"], signal=signal, stage=stage_name)
+
+
+def observe_noise_bank(stats):
+    """Copy noise bank statistics into the registry"""
+    NOISE_BANK_BYTES.set(stats["bytes"])
+    for result, count_key in (("hit", "hits"), ("miss", "misses"), ("fallback", "fallbacks")):
+        NOISE_BANK_DRAWS.set_total(stats[count_key], result=result)
+    NOISE_BANK_REFRESHES.set_total(stats["refreshes"])
+
+
+def observe_coalescer(stats):
+    """Copy request coalescing statistics into the registry"""
+    for result in ("shared", "batched", "alone"):
+        COALESCED_REQUESTS.set_total(stats[result], result=result)
+    COALESCED_BATCHES.set_total(stats["batches"])
+    COALESCED_LARGEST_BATCH.set(stats["largest_batch"])
+
+
+def observe_admission(stats):
+    """Copy admission control statistics into the registry"""
+    for result, count_key in (("inline", "inline"), ("chunked", "chunked"), ("queued", "queued"),
+                              ("rejected", "rejected"), ("timeout", "timeouts"), ("queue_full", "queue_full")):
+        ADMISSION_DECISIONS.set_total(stats[count_key], result=result)
+    ADMISSION_RESERVED_BYTES.set(stats["reserved_bytes"])
+    ADMISSION_WAITING.set(stats["waiting"])
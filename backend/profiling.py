@@ -0,0 +1,85 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Accepted values of the profile query parameter / X-Profile header
+PROFILE_MODES = {
+    "1": "cprofile",
+    "true": "cprofile",
+    "cprofile": "cprofile",
+    "sample": "sample",
+    "flamegraph": "sample"
+}
+
+# Artifact type and file suffix written by each mode
+MODE_ARTIFACTS = {
+    "cprofile": "profile",
+    "sample": "flamegraph"
+}
+
+
+def requested_mode(query_value, header_value):
+    """Resolve the profiling mode asked for by a request, if any"""
+    value = (query_value or header_value or "").strip().lower()
+    return PROFILE_MODES.get(value)
+
+
+class StackSampler:
+    """Sample the stack of one thread and aggregate it as collapsed stacks"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write samples in the collapsed format read by flamegraph.pl and speedscope"""
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile_call(mode, path, fn, *args, **kwargs):
+    """Run fn under the given profiler and save the profile to path"""
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            profiler.dump_stats(path)
+
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        sampler.stop()
+        if not sampler.samples:
+            # Calls shorter than one interval still produce a usable file
+            sampler.samples[fn.__qualname__] = max(1, int((time.perf_counter() - start) / sampler.interval))
+        sampler.write(path)
@@ -0,0 +1,224 @@
+"""Production server: a warmed-up master process forking single-threaded workers
+
+The master imports the app, imports the heavy modules and builds the filter
+banks, templates and optional noise bank once, then binds the listening
+socket and forks the workers. Workers share that warm state copy-on-write
+and accept from the shared socket. The master also runs the storage sweep,
+so artifacts are evicted once for all workers. Each worker is recycled after
+SERVER_MAX_REQUESTS requests (plus jitter) and replaced by a fresh fork of
+the master, so memory growth in one worker never outlives it.
+
+    python serve.py --workers 4 --port 5000
+"""
+import argparse
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+# Must be set before the app is imported so it leaves background threads to the workers and sweeping to the master
+os.environ['PREFORK'] = '1'
+# Workers serve one request at a time, so there is nothing to coalesce and a window would only add latency
+os.environ.setdefault('COALESCE_WINDOW_MS', '0')
+
+import numpy as np
+from werkzeug.serving import make_server
+
+import app as backend
+from config import Config
+
+
+def worker_count(workers=None, per_core=None):
+    """Number of workers to fork, from an explicit count or the CPU count"""
+    workers = Config.SERVER_WORKERS if workers is None else workers
+    if workers > 0:
+        return workers
+    per_core = Config.SERVER_WORKERS_PER_CORE if per_core is None else per_core
+    return max(1, (os.cpu_count() or 1) * per_core)
+
+
+class RequestCounter:
+    """WSGI middleware counting the requests a worker has started"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.count = 0
+
+    def __call__(self, environ, start_response):
+        self.count += 1
+        return self.wsgi_app(environ, start_response)
+
+
+def run_worker(listener, host, port, max_requests):
+    """Serve requests from the shared socket until recycled or told to stop"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles Ctrl+C
+
+    # Forked workers would otherwise all draw the same random sequences
+    np.random.seed()
+    random.seed()
+    backend.start_background_tasks()
+
+    try:
+        counter = RequestCounter(backend.app)
+        server = make_server(host, port, counter, fd=listener.fileno())
+        server.timeout = 1.0  # wake up regularly to notice SIGTERM
+        while not stopping and not (max_requests and counter.count >= max_requests):
+            server.handle_request()
+        server.server_close()
+    finally:
+        # The worker leaves through os._exit, which would orphan its render processes
+        backend.stop_background_tasks()
+    return counter.count
+
+
+class Master:
+    """Forks the workers, replaces the ones that exit and shuts them down gracefully"""
+
+    def __init__(self, host, port, workers, max_requests, max_requests_jitter, graceful_timeout, storage=None):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.storage = storage  # swept from the master loop, which must not start threads it would fork
+        self.children = {}  # pid -> worker number
+        self.listener = None
+        self.stopping = False
+
+    def bind(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(128)
+        # Workers poll before accepting, so a connection taken by a sibling must not block them
+        listener.setblocking(False)
+        self.listener = listener
+
+    def spawn(self, number):
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                served = run_worker(self.listener, self.host, self.port, max_requests)
+                print(f"Worker {number} (pid {os.getpid()}) exiting after {served} requests")
+            except BaseException as e:
+                print(f"Worker {number} (pid {os.getpid()}) failed: {e}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        self.children[pid] = number
+
+    def reap(self):
+        """Collect exited workers and fork replacements while running"""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            number = self.children.pop(pid, None)
+            if number is not None and not self.stopping:
+                if os.waitstatus_to_exitcode(status) != 0:
+                    print(f"Worker {number} (pid {pid}) exited abnormally, restarting")
+                    time.sleep(1)  # avoid a tight fork loop if workers keep crashing
+                self.spawn(number)
+
+    def sweep_storage(self):
+        try:
+            self.storage.sweep()
+        except Exception as e:
+            print(f"Storage sweep failed: {e}")
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def shutdown(self):
+        """Ask the workers to finish their current request, then kill any stragglers"""
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in list(self.children):
+            print(f"Worker pid {pid} did not stop in time, killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.children.pop(pid)
+
+    def run(self):
+        self.bind()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for number in range(self.workers):
+            self.spawn(number)
+        print(f"Serving on http://{self.host}:{self.port} with {self.workers} workers (master pid {os.getpid()})")
+
+        next_sweep = time.monotonic()
+        while not self.stopping:
+            self.reap()
+            if self.storage is not None and time.monotonic() >= next_sweep:
+                self.sweep_storage()
+                next_sweep = time.monotonic() + self.storage.sweep_interval
+            time.sleep(0.2)
+        print("Shutting down workers")
+        self.shutdown()
+        self.listener.close()
+
+
+def warm_master():
+    """Build the shared warm state once so every fork starts ready"""
+    if Config.WARMUP_ON_START:
+        start = time.perf_counter()
+        backend.run_warmup()
+        print(f"Warm-up finished in {time.perf_counter() - start:.2f} s")
+        if backend.warmup_state["error"]:
+            print(f"Warm-up error: {backend.warmup_state['error']}")
+    else:
+        backend.ready.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the backend with preforked workers")
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of workers (default: SERVER_WORKERS, or CPU count x --workers-per-core)")
+    parser.add_argument('--workers-per-core', type=int, default=None)
+    parser.add_argument('--max-requests', type=int, default=Config.SERVER_MAX_REQUESTS,
+                        help="recycle a worker after this many requests (0 disables)")
+    parser.add_argument('--max-requests-jitter', type=int, default=Config.SERVER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--graceful-timeout', type=int, default=Config.SERVER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, 'fork'):
+        print("serve.py needs os.fork; use start_backend.py on this platform")
+        return 1
+
+    warm_master()
+    master = Master(
+        host=args.host,
+        port=args.port,
+        workers=worker_count(args.workers, args.workers_per_core),
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=args.graceful_timeout,
+        storage=backend.storage
+    )
+    master.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
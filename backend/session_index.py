@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from storage import DERIVED_SUFFIXES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    signal TEXT,
+    type TEXT,
+    created REAL NOT NULL,
+    duration INTEGER,
+    sampling_rate INTEGER,
+    channels INTEGER,
+    dtype TEXT,
+    seed INTEGER,
+    parent_session_id TEXT,
+    params TEXT,
+    timings TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'active',
+    expired_at REAL,
+    last_access REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created DESC, session_id DESC);
+CREATE INDEX IF NOT EXISTS sessions_type ON sessions (signal, type, created DESC);
+CREATE INDEX IF NOT EXISTS sessions_status ON sessions (status, created DESC);
+CREATE TABLE IF NOT EXISTS artifacts (
+    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    file_type TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    PRIMARY KEY (session_id, file_type)
+);
+"""
+
+# Result fields that describe files or measurements rather than generation parameters
+_NON_PARAMS = ("timings", "profile_url", "pending")
+
+# Filters accepted by list_sessions, mapped to their column
+FILTER_COLUMNS = {
+    "signal": "signal",
+    "type": "type",
+    "dtype": "dtype",
+    "sampling_rate": "sampling_rate",
+    "duration": "duration",
+    "seed": "seed",
+    "parent_session_id": "parent_session_id"
+}
+
+MAX_PAGE_SIZE = 500
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _params(result):
+    return {key: value for key, value in result.items()
+            if key not in _NON_PARAMS and not key.endswith("_path")}
+
+
+class SessionIndex:
+    """SQLite index of generated sessions: parameters, artifacts, sizes, checksums and timings
+
+    Each session is written in one transaction when it is generated, so
+    lookups and listings never have to probe or scan the artifact
+    directories. Every thread (and every forked worker) opens its own
+    connection; WAL mode lets readers run alongside a writer.
+    """
+
+    def __init__(self, path, checksums=True):
+        self.path = path
+        self.checksums = checksums
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(sessions)")}
+            if "last_access" not in columns:
+                # Index written before sessions recorded their last access
+                conn.execute("ALTER TABLE sessions ADD COLUMN last_access REAL")
+                conn.execute("UPDATE sessions SET last_access = created")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_access ON sessions (status, last_access)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        # A connection must not cross a fork
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, session_id, signal, result, files, sizes=None, created=None):
+        """Store a freshly generated session and its artifacts in one transaction"""
+        sizes = sizes or {}
+        artifacts = []
+        for file_type, path in files.items():
+            size = sizes.get(file_type)
+            if size is None:
+                size = os.path.getsize(path)
+            digest = file_sha256(path) if self.checksums else None
+            artifacts.append((session_id, file_type, path, size, digest))
+
+        params = _params(result)
+        created = created or time.time()
+        row = (
+            session_id, signal, result.get(f"{signal}_type"), created, created,
+            result.get("duration"), result.get("sampling_rate"),
+            len(result.get("channels") or result.get("leads") or []) or None, result.get("dtype"),
+            result.get("seed"), result.get("parent_session_id"),
+            json.dumps(params, default=str), json.dumps(result.get("timings")),
+            sum(artifact[3] for artifact in artifacts)
+        )
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM artifacts WHERE session_id = ?", (session_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, signal, type, created, last_access, duration,"
+                " sampling_rate, channels, dtype, seed, parent_session_id, params, timings, size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            conn.executemany(
+                "INSERT INTO artifacts (session_id, file_type, path, size, sha256) VALUES (?, ?, ?, ?, ?)",
+                artifacts)
+
+    def add_file(self, session_id, file_type, path, checksum=True):
+        """Attach an artifact written after generation (e.g. a profile or a compressed copy)"""
+        size = os.path.getsize(path)
+        digest = file_sha256(path) if self.checksums and checksum else None
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO artifacts (session_id, file_type, path, size, sha256)"
+                " SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?)",
+                (session_id, file_type, path, size, digest, session_id))
+            if cursor.rowcount:
+                conn.execute("UPDATE sessions SET size = (SELECT SUM(size) FROM artifacts WHERE session_id = ?)"
+                             " WHERE session_id = ?", (session_id, session_id))
+        return bool(cursor.rowcount)
+
+    def files(self, session_id):
+        """{file_type: path} of an active session, or None if it is unknown or expired
+
+        Derived copies (e.g. precompressed downloads) are left out.
+        """
+        rows = self._connect().execute(
+            "SELECT a.file_type, a.path FROM sessions s JOIN artifacts a USING (session_id)"
+            " WHERE s.session_id = ? AND s.status = 'active'", (session_id,)).fetchall()
+        return {row["file_type"]: row["path"] for row in rows
+                if not row["file_type"].endswith(DERIVED_SUFFIXES)} or None
+
+    def artifact(self, session_id, file_type):
+        """Path of one artifact of an active session, or None"""
+        row = self._connect().execute(
+            "SELECT a.path FROM sessions s JOIN artifacts a USING (session_id)"
+            " WHERE s.session_id = ? AND a.file_type = ? AND s.status = 'active'",
+            (session_id, file_type)).fetchone()
+        return row["path"] if row else None
+
+    def is_expired(self, session_id):
+        row = self._connect().execute("SELECT status FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None and row["status"] == "expired"
+
+    def get(self, session_id):
+        """Full record of a session with its artifacts, or None"""
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        session = self._summary(row)
+        session["params"] = json.loads(row["params"]) if row["params"] else None
+        session["timings"] = json.loads(row["timings"]) if row["timings"] else None
+        session["artifacts"] = {
+            a["file_type"]: {"path": a["path"], "size": a["size"], "sha256": a["sha256"]}
+            for a in conn.execute("SELECT * FROM artifacts WHERE session_id = ? ORDER BY file_type",
+                                  (session_id,))
+        }
+        return session
+
+    def list_sessions(self, filters=None, status="active", since=None, until=None, limit=50, cursor=None):
+        """One page of sessions, newest first, and the cursor of the next page (None at the end)
+
+        The cursor is "<created>:<session_id>" of the last session returned;
+        paging by it stays fast however deep the page is.
+        """
+        clauses, args = [], []
+        for name, value in (filters or {}).items():
+            clauses.append(f"{FILTER_COLUMNS[name]} = ?")
+            args.append(value)
+        if status != "all":
+            clauses.append("status = ?")
+            args.append(status)
+        if since is not None:
+            clauses.append("created >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created < ?")
+            args.append(until)
+        if cursor:
+            created, _, session_id = cursor.partition(":")
+            clauses.append("(created < ? OR (created = ? AND session_id < ?))")
+            args.extend((float(created), float(created), session_id))
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT * FROM sessions {where} ORDER BY created DESC, session_id DESC LIMIT ?",
+            args + [limit + 1]).fetchall()
+        sessions = [self._summary(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last['created']!r}:{last['session_id']}"
+        return sessions, next_cursor
+
+    def touch(self, session_id):
+        """Record an access to an active session, moving it to the back of the eviction order"""
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ? AND status = 'active'",
+                         (time.time(), session_id))
+
+    def evict(self, max_bytes, ttl_seconds):
+        """Expire the sessions idle for longer than the TTL, then the least recently used ones over budget
+
+        Victims are chosen and marked expired in one write transaction, so
+        concurrent sweepers never pick the same session. Returns
+        {session_id: [artifact paths]} for the caller to delete.
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT session_id, size, last_access FROM sessions WHERE status = 'active'"
+                                " ORDER BY last_access").fetchall()
+            total = sum(row["size"] for row in rows)
+            victims = []
+            for row in rows:
+                if now - row["last_access"] <= ttl_seconds and total <= max_bytes:
+                    break
+                victims.append(row["session_id"])
+                total -= row["size"]
+            paths = {session_id: [row["path"] for row in conn.execute(
+                         "SELECT path FROM artifacts WHERE session_id = ?", (session_id,))]
+                     for session_id in victims}
+            conn.executemany("UPDATE sessions SET status = 'expired', expired_at = ? WHERE session_id = ?",
+                             [(now, session_id) for session_id in victims])
+        return paths
+
+    def mark_expired(self, session_ids):
+        """Flag sessions whose artifacts were evicted; their rows stay for history"""
+        conn = self._connect()
+        with conn:
+            conn.executemany("UPDATE sessions SET status = 'expired', expired_at = ? WHERE session_id = ?",
+                             [(time.time(), session_id) for session_id in session_ids])
+
+    def sync(self, records):
+        """Reconcile with the sessions found on disk at startup
+
+        Sessions on disk but not in the index (e.g. generated before it
+        existed) are added with what their metadata tells; indexed sessions
+        whose files are gone are marked expired.
+        """
+        conn = self._connect()
+        known = {row["session_id"] for row in conn.execute("SELECT session_id FROM sessions WHERE status = 'active'")}
+        on_disk = {record.session_id for record in records}
+        missing = [record for record in records if record.session_id not in known]
+        with conn:
+            for record in missing:
+                meta = _read_meta(record.files.get("meta"))
+                result = {"sampling_rate": meta.get("sampling_rate"), "channels": meta.get("channels")}
+                # Checksums of existing files are left out to keep startup fast
+                artifacts = [(record.session_id, file_type, path, record.sizes.get(file_type, 0), None)
+                             for file_type, path in record.files.items()]
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, signal, created, last_access, sampling_rate,"
+                    " channels, params, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record.session_id, meta.get("signal_type"), record.created, record.created,
+                     result["sampling_rate"],
+                     len(result["channels"] or []) or None, json.dumps(result), record.size))
+                conn.execute("DELETE FROM artifacts WHERE session_id = ?", (record.session_id,))
+                conn.executemany(
+                    "INSERT INTO artifacts (session_id, file_type, path, size, sha256) VALUES (?, ?, ?, ?, ?)",
+                    artifacts)
+        self.mark_expired(known - on_disk)
+        return len(missing)
+
+    def stats(self):
+        """Number of sessions and bytes by status"""
+        rows = self._connect().execute(
+            "SELECT status, COUNT(*) AS sessions, COALESCE(SUM(size), 0) AS bytes FROM sessions GROUP BY status")
+        return {row["status"]: {"sessions": row["sessions"], "bytes": row["bytes"]} for row in rows}
+
+    @staticmethod
+    def _summary(row):
+        return {
+            "session_id": row["session_id"],
+            "signal": row["signal"],
+            "type": row["type"],
+            "created": row["created"],
+            "duration": row["duration"],
+            "sampling_rate": row["sampling_rate"],
+            "channels": row["channels"],
+            "dtype": row["dtype"],
+            "seed": row["seed"],
+            "parent_session_id": row["parent_session_id"],
+            "size": row["size"],
+            "status": row["status"],
+            "expired_at": row["expired_at"]
+        }
+
+
+def _read_meta(path):
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
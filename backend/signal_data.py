@@ -0,0 +1,167 @@
+import json
+import os
+import struct
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is only offered when the package is installed
+    pa = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+RAW_MIMETYPE = 'application/octet-stream'
+
+# Samples per channel written per chunk / Arrow record batch
+CHUNK_SAMPLES = 65536
+
+# Offset of the raw sample data is rounded up to this many bytes
+RAW_ALIGNMENT = 64
+
+
+def supported_formats():
+    """Binary data formats this server can produce, in order of preference"""
+    formats = ["raw"]
+    if pa is not None:
+        formats.insert(0, "arrow")
+    return formats
+
+
+def negotiate_format(format_param, accept):
+    """Pick the requested data format; raw float32 unless Arrow is asked for"""
+    if format_param:
+        return format_param.strip().lower()
+    if ARROW_MIMETYPE in (accept or ""):
+        return "arrow"
+    return "raw"
+
+
+def load_signal(npy_path, meta_path, csv_path=None):
+    """Memory-map the (channels x samples) array of a session with its metadata"""
+    data = np.load(npy_path, mmap_mode='r')
+    if meta_path and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    else:
+        # Sessions from before the metadata sidecar: take the names from the CSV header
+        channels = None
+        if csv_path and os.path.exists(csv_path):
+            with open(csv_path) as f:
+                channels = f.readline().strip().split(',')
+        if not channels or len(channels) != data.shape[0]:
+            channels = [f"ch{i}" for i in range(data.shape[0])]
+        meta = {"channels": channels, "sampling_rate": None}
+    return data, meta
+
+
+def load_pyramid(pyramid_path, meta):
+    """Memory-map the min/max pyramid of a session with its level layout, if it has one"""
+    levels = meta.get("pyramid", {}).get("levels", [])
+    if not levels or not pyramid_path or not os.path.exists(pyramid_path):
+        return None, []
+    return np.load(pyramid_path, mmap_mode='r'), levels
+
+
+def units_of(meta):
+    """{channel: unit} of a session; empty for sessions saved before units were recorded"""
+    return dict(zip(meta["channels"], meta.get("units", [])))
+
+
+def select_channels(channels, requested):
+    """Indices of the requested channels (comma separated names), all by default"""
+    if not requested:
+        return list(range(len(channels)))
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in channels]
+    if unknown:
+        raise ValueError(f"Unknown channels: {', '.join(unknown)}")
+    return [channels.index(name) for name in names]
+
+
+def _chunks(n_samples):
+    for start in range(0, n_samples, CHUNK_SAMPLES):
+        yield start, min(start + CHUNK_SAMPLES, n_samples)
+
+
+def raw_header(meta, channels, n_samples, dtype):
+    """Length-prefixed JSON header, padded so the samples start aligned"""
+    header = {
+        "channels": channels,
+        "units": [units_of(meta).get(name) for name in channels],
+        "sampling_rate": meta.get("sampling_rate"),
+        "signal_type": meta.get("signal_type"),
+        "n_samples": n_samples,
+        "dtype": np.dtype(dtype).newbyteorder('<').str,
+        "layout": "channels_first"
+    }
+    body = json.dumps(header).encode()
+    # uint32 length + JSON + spaces, with the total a multiple of RAW_ALIGNMENT
+    total = -(-(4 + len(body)) // RAW_ALIGNMENT) * RAW_ALIGNMENT
+    body += b' ' * (total - 4 - len(body))
+    return struct.pack('<I', len(body)) + body
+
+
+def stream_raw(data, meta, indices, dtype=np.float32):
+    """Content length and a generator of the header followed by each selected channel
+
+    Every channel is written as contiguous little-endian samples, so a client
+    can view the body directly as a (channels x samples) array.
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    channels = [meta["channels"][i] for i in indices]
+    n_samples = data.shape[1]
+    header = raw_header(meta, channels, n_samples, dtype)
+
+    def generate():
+        yield header
+        for index in indices:
+            row = data[index]
+            for start, end in _chunks(n_samples):
+                yield row[start:end].astype(dtype).tobytes()
+
+    return len(header) + len(indices) * n_samples * dtype.itemsize, generate()
+
+
+class _ChunkSink:
+    """Write-only file object collecting what the Arrow writer produces"""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_arrow(data, meta, indices, dtype=np.float32):
+    """Yield an Arrow IPC stream with one column per selected channel"""
+    arrow_type = pa.from_numpy_dtype(np.dtype(dtype))
+    channels = [meta["channels"][i] for i in indices]
+    units = units_of(meta)
+    schema = pa.schema(
+        [pa.field(name, arrow_type, metadata={"unit": units[name]} if name in units else None)
+         for name in channels],
+        metadata={"sampling_rate": json.dumps(meta.get("sampling_rate")),
+                  "signal_type": json.dumps(meta.get("signal_type"))}
+    )
+
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    yield sink.take()
+    for start, end in _chunks(data.shape[1]):
+        columns = [pa.array(data[index, start:end].astype(dtype, copy=False)) for index in indices]
+        writer.write_batch(pa.record_batch(columns, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
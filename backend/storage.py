@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+
+# Artifact locations for a session, relative to the backend directory
+ARTIFACT_TEMPLATES = {
+    "csv": "static/csv/{session_id}_data.csv",
+    "npy": "static/npy/{session_id}_data.npy",
+    "meta": "static/npy/{session_id}_meta.json",
+    "pyramid": "static/npy/{session_id}_pyramid.npy",
+    "epochs": "static/npy/{session_id}_epochs.npy",
+    "annotations": "static/npy/{session_id}_annotations.npy",
+    "features": "static/csv/{session_id}_features.csv",
+    "plot": "static/plots/{session_id}_plot.png",
+    "profile": "static/profiles/{session_id}_profile.pstats",
+    "flamegraph": "static/profiles/{session_id}_profile.collapsed"
+}
+
+# Suffixes of derived copies (e.g. precompressed downloads) kept next to artifacts
+DERIVED_SUFFIXES = ('.gz', '.zst')
+
+
+def artifact_path(session_id, file_type):
+    """Build the path of a session artifact"""
+    return ARTIFACT_TEMPLATES[file_type].format(session_id=session_id)
+
+
+class SessionRecord:
+    def __init__(self, session_id, files, created=None):
+        self.session_id = session_id
+        self.files = dict(files)
+        self.created = created or time.time()
+        self.last_access = self.created
+        self.sizes = {k: _file_size(path) for k, path in self.files.items()}
+
+    @property
+    def size(self):
+        return sum(self.sizes.values())
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "files": self.files,
+            "size": self.size,
+            "created": self.created,
+            "last_access": self.last_access
+        }
+
+
+class StorageManager:
+    """Evict session artifacts by TTL and size budget
+
+    Sessions, their artifact sizes and last access times live in the shared
+    session index, so every process that serves them counts against one
+    budget and one least-recently-used order. Only one process should sweep:
+    the app itself, or the serve.py master.
+    """
+
+    def __init__(self, index, max_bytes, ttl_seconds, sweep_interval=60):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, session_id, files, created=None):
+        """Record of the artifacts written for a session that exist on disk, with their sizes"""
+        files = {k: v for k, v in files.items() if v and os.path.exists(v)}
+        return SessionRecord(session_id, files, created)
+
+    def touch(self, session_id):
+        """Mark a session as recently used"""
+        self.index.touch(session_id)
+
+    def usage(self):
+        """Current storage usage and limits, across every process"""
+        stats = self.index.stats()
+        active = stats.get("active", {})
+        expired = stats.get("expired", {})
+        return {
+            "sessions": active.get("sessions", 0),
+            "bytes": active.get("bytes", 0),
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "evicted_sessions": expired.get("sessions", 0),
+            "evicted_bytes": expired.get("bytes", 0)
+        }
+
+    def scan(self):
+        """Records of the sessions whose artifacts are on disk, for the index to reconcile with"""
+        found = {}
+        for file_type, template in ARTIFACT_TEMPLATES.items():
+            directory, pattern = os.path.split(template)
+            suffix = pattern.replace("{session_id}", "")
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(suffix):
+                    session_id = name[:-len(suffix)]
+                    found.setdefault(session_id, {})[file_type] = os.path.join(directory, name)
+
+        records = []
+        for session_id, files in found.items():
+            for file_type, path in list(files.items()):
+                for suffix in DERIVED_SUFFIXES:
+                    if os.path.exists(path + suffix):
+                        files[file_type + suffix] = path + suffix
+            created = min(os.path.getmtime(path) for path in files.values())
+            records.append(self.register(session_id, files, created))
+        return records
+
+    def sweep(self):
+        """Evict expired sessions, then least recently used ones over budget"""
+        victims = self.index.evict(self.max_bytes, self.ttl_seconds)
+        for paths in victims.values():
+            # Derived copies written since the session was indexed go too
+            _remove_files(paths + [path + suffix for path in paths for suffix in DERIVED_SUFFIXES])
+        return len(victims)
+
+    def start(self):
+        """Run the eviction sweep periodically in a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="storage-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Storage sweep failed: {e}")
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Accuracy of float32 records against the float64 pipeline
+
+Generates the same seeded EEG and ECG records in float64 and float32 and
+compares their band power and HRV features. Exits with status 1 when any
+feature differs by more than the relative tolerance documented in the README.
+
+Examples:
+    python benchmarks/dtype_accuracy.py
+    python benchmarks/dtype_accuracy.py --duration 300 --sampling-rate 512
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import numpy as np
+
+from generator.eeg_generator import EEGGenerator
+from generator.ecg_generator import ECGGenerator
+from generator import utils
+
+# Largest relative difference of a float32 feature from its float64 value
+TOLERANCE = 1e-6
+
+EEG_TYPES = ["normal_awake", "sleep_stage3", "focal_spikes", "spike_wave_3hz"]
+ECG_TYPES = ["normal_sinus", "atrial_fibrillation", "lbbb"]
+HRV_FIELDS = ["HRV_MeanNN", "HRV_SDNN", "HRV_RMSSD", "HRV_pNN50", "HRV_LF", "HRV_HF"]
+
+
+def relative_error(value, reference):
+    """Largest relative difference, against the largest reference magnitude where a reference is 0"""
+    value, reference = np.asarray(value, dtype=np.float64), np.asarray(reference, dtype=np.float64)
+    scale = np.where(reference != 0, np.abs(reference), np.abs(reference).max() or 1.0)
+    return float(np.nanmax(np.abs(value - reference) / scale))
+
+
+def eeg_error(generator, eeg_type, duration, rate, seed):
+    """Relative error of the per-channel band power of a float32 EEG record"""
+    power = {}
+    for dtype in utils.SIGNAL_DTYPES:
+        result = generator.generate(eeg_type, duration=duration, sampling_rate=rate, session_id="accuracy",
+                                    dtype=dtype, seed=seed)
+        power[dtype] = utils.extract_band_power(np.load(result["npy_path"]), rate).to_numpy()
+    return relative_error(power["float32"], power["float64"])
+
+
+def ecg_error(generator, ecg_type, duration, rate, seed):
+    """Relative error of the HRV indices of a float32 ECG record"""
+    hrv = {}
+    for dtype in utils.SIGNAL_DTYPES:
+        result = generator.generate(ecg_type, duration=duration, sampling_rate=rate, session_id="accuracy",
+                                    dtype=dtype, seed=seed)
+        features = utils.extract_hrv_features(np.load(result["npy_path"]).reshape(-1), rate)
+        hrv[dtype] = [float(features[field].iloc[0]) for field in HRV_FIELDS if field in features]
+    return relative_error(hrv["float32"], hrv["float64"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=int, default=120, help="Record length in seconds")
+    parser.add_argument("--sampling-rate", type=int, default=256, help="Sampling rate in Hz")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of every record")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rate = args.sampling_rate
+
+    # Generators write their artifacts relative to the working directory
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="eeg-ecg-dtype-")
+    os.chdir(workdir)
+    utils.create_output_directories()
+    warnings.filterwarnings("ignore")
+    errors = {}
+    try:
+        eeg_generator, ecg_generator = EEGGenerator(), ECGGenerator()
+        for eeg_type in EEG_TYPES:
+            errors[f"eeg.band_power[{eeg_type}]"] = eeg_error(eeg_generator, eeg_type, args.duration, rate, args.seed)
+        for ecg_type in ECG_TYPES:
+            errors[f"ecg.hrv[{ecg_type}]"] = ecg_error(ecg_generator, ecg_type, args.duration, rate, args.seed)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = 0
+    for key, error in errors.items():
+        within = error <= TOLERANCE
+        failures += not within
+        print(f"{key}: {error:.2e}{'' if within else f'  OUT OF TOLERANCE (> {TOLERANCE:g})'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+HTTP load test of a local backend with a mix of generate, download and session requests
+
+The backend is started on 127.0.0.1 in a scratch directory (or an instance
+already running on localhost is targeted with --url). The mix runs at a
+target concurrency (closed loop) or request rate (open loop). The report
+gives throughput, latency percentiles, errors and the server-side stage
+timings of the generate requests.
+
+Examples:
+    python benchmarks/load_test.py --concurrency 8 --seconds 60 --output load.json
+    python benchmarks/load_test.py --rps 4 --seconds 60 --mix generate=1,download=4,session=5
+    python benchmarks/load_test.py --server serve --workers 4 --compare load.json
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --signals ecg --concurrency 2
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+DEFAULT_MIX = {"generate": 1, "download": 3, "session": 6}
+SIGNALS = ("eeg", "ecg", "multimodal")
+DOWNLOAD_TYPES = ("csv", "npy", "plot", "features", "annotations")
+SESSION_CALLS = ("files", "record", "window", "annotations", "list")
+PERCENTILES = (50, 95, 99)
+
+# Sessions kept for the download and session calls
+SESSION_POOL_SIZE = 256
+
+
+def parse_mix(text):
+    """'generate=1,download=3' -> {"generate": 1.0, "download": 3.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, use {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for {name}: {weight!r}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+
+def check_local(url):
+    """Refuse to load anything but this machine"""
+    parts = urlsplit(url)
+    if parts.scheme != "http" or parts.hostname not in LOCAL_HOSTS:
+        raise SystemExit(f"--url must be http:// on {', '.join(LOCAL_HOSTS)}, got {url}")
+    return parts.hostname, parts.port or 80
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Client:
+    """Blocking HTTP calls to the backend, one connection per call"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def call(self, method, path, body=None):
+        """(status, body bytes); status is None when the connection failed"""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            headers = {}
+            if body is not None:
+                body = json.dumps(body)
+                headers["Content-Type"] = "application/json"
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def json(self, method, path, body=None):
+        status, data = self.call(method, path, body)
+        return status, json.loads(data) if data else None
+
+    def wait_ready(self, timeout, process=None):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise SystemExit(f"Backend exited with code {process.returncode} before it was ready")
+            try:
+                if self.call("GET", "/api/ready")[0] == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise SystemExit(f"Backend not ready after {timeout} s")
+
+
+class LocalServer:
+    """The backend running on 127.0.0.1 from a scratch directory, so its artifacts are thrown away"""
+
+    def __init__(self, kind, workers=None, keep=False):
+        self.kind = kind
+        self.workers = workers
+        self.keep = keep
+        self.port = free_port()
+        self.workdir = tempfile.mkdtemp(prefix="eeg-ecg-load-")
+        self.process = None
+        self.log = None
+
+    def start(self):
+        if self.kind == "serve":
+            command = [sys.executable, str(BACKEND_DIR / "serve.py"), "--host", "127.0.0.1",
+                       "--port", str(self.port)]
+            if self.workers:
+                command += ["--workers", str(self.workers)]
+        else:
+            # The Flask app itself, threaded, without the debugger and reloader of `python app.py`
+            command = [sys.executable, "-c",
+                       f"import sys; sys.path.insert(0, {str(BACKEND_DIR)!r}); from app import app; "
+                       f"app.run(host='127.0.0.1', port={self.port}, threaded=True)"]
+        self.log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.process = subprocess.Popen(command, cwd=self.workdir, stdout=self.log, stderr=subprocess.STDOUT)
+        return self
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.log is not None:
+            self.log.close()
+        if self.keep:
+            print(f"Server directory kept at {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class Recorder:
+    """Latencies, statuses and server stage timings of the calls made, by operation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.bytes = defaultdict(int)
+        self.stages = defaultdict(list)
+
+    def add(self, operation, latency, status, n_bytes=0, timings=None):
+        with self._lock:
+            self.latencies[operation].append(latency)
+            self.statuses[operation][status] += 1
+            self.bytes[operation] += n_bytes
+            for name, entry in (timings or {}).items():
+                self.stages[name].append(entry["wall"])
+
+
+class LoadTest:
+    """Picks operations from the mix and runs them against the backend"""
+
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.recorder = Recorder()
+        self.sessions = deque(maxlen=SESSION_POOL_SIZE)
+        self.types = {}
+        operations = [name for name, weight in args.mix.items() if weight > 0]
+        self.operations = operations
+        self.weights = [args.mix[name] for name in operations]
+
+    def prepare(self):
+        """Fetch the type catalogues and generate the first sessions (not measured)"""
+        for signal_type in ("eeg", "ecg"):
+            status, types = self.client.json("GET", f"/api/{signal_type}/types")
+            if status != 200:
+                raise SystemExit(f"GET /api/{signal_type}/types answered {status}")
+            self.types[signal_type] = [value for group in types.values() for value in group.values()]
+        rng = random.Random(self.args.seed)
+        for _ in range(self.args.warm_sessions):
+            path, body = self.generate_request(rng)
+            status, data = self.client.json("POST", path, body)
+            if status == 200:
+                self.sessions.append(data["session_id"])
+        if not self.sessions and set(self.operations) - {"generate"}:
+            raise SystemExit("Could not generate any session to download from or query")
+
+    def generate_request(self, rng):
+        signal_type = rng.choice(self.args.signals)
+        body = {"duration": self.args.record_seconds, "sampling_rate": self.args.sampling_rate}
+        if signal_type == "multimodal":
+            body.update(eeg_type=rng.choice(self.types["eeg"]), ecg_type=rng.choice(self.types["ecg"]))
+        else:
+            body["type"] = rng.choice(self.types[signal_type])
+        return f"/api/generate/{signal_type}", body
+
+    def pick(self, rng):
+        """(operation name, method, path, body) of the next call"""
+        kind = rng.choices(self.operations, self.weights)[0]
+        if kind == "generate":
+            path, body = self.generate_request(rng)
+            return f"generate.{path.rsplit('/', 1)[1]}", "POST", path, body
+        session_id = rng.choice(self.sessions)
+        if kind == "download":
+            file_type = rng.choice(DOWNLOAD_TYPES)
+            return f"download.{file_type}", "GET", f"/api/download/{session_id}/{file_type}", None
+        call = rng.choice(SESSION_CALLS)
+        path = {
+            "files": f"/api/session/{session_id}/files",
+            "record": f"/api/sessions/{session_id}",
+            "window": f"/api/session/{session_id}/window?start=0&end={self.args.record_seconds}&max_points=2000",
+            "annotations": f"/api/session/{session_id}/annotations",
+            "list": "/api/sessions?limit=50"
+        }[call]
+        return f"session.{call}", "GET", path, None
+
+    def run_call(self, rng, scheduled=None):
+        """Make one call; with a schedule, latency counts from when the call should have started"""
+        operation, method, path, body = self.pick(rng)
+        start = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            status, data = self.client.call(method, path, body)
+        except OSError as e:
+            self.recorder.add(operation, time.perf_counter() - start, type(e).__name__)
+            return
+        latency = time.perf_counter() - start
+        timings = None
+        if operation.startswith("generate.") and status == 200:
+            result = json.loads(data)
+            self.sessions.append(result["session_id"])
+            timings = result["data"].get("timings")
+        self.recorder.add(operation, latency, status, len(data), timings)
+
+    def closed_loop(self, concurrency, deadline, max_requests):
+        """`concurrency` clients, each sending its next call when the previous one is answered"""
+        issued = iter(range(max_requests)) if max_requests else None
+        lock = threading.Lock()
+
+        def client(index):
+            rng = random.Random(f"{self.args.seed}-{index}")
+            while time.perf_counter() < deadline:
+                if issued is not None:
+                    with lock:
+                        if next(issued, None) is None:
+                            return
+                self.run_call(rng)
+
+        threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rps, deadline, max_requests, max_in_flight):
+        """Start calls at a fixed rate whether or not earlier ones were answered"""
+        rng = random.Random(self.args.seed)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_in_flight) as pool:
+            i = 0
+            while not max_requests or i < max_requests:
+                scheduled = start + i / rps
+                if scheduled >= deadline:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.run_call, random.Random(rng.random()), scheduled)
+                i += 1
+
+
+def percentiles(values):
+    values = np.asarray(values)
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary.update(mean=float(values.mean()), max=float(values.max()))
+    return summary
+
+
+def summarize(recorder, elapsed):
+    """Throughput, latency percentiles (s) and errors overall and by operation"""
+    def group(operations):
+        latencies = [latency for op in operations for latency in recorder.latencies[op]]
+        statuses = defaultdict(int)
+        for op in operations:
+            for status, count in recorder.statuses[op].items():
+                statuses[str(status)] += count
+        errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+        summary = {
+            "requests": len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "errors": errors,
+            "error_rate": errors / len(latencies) if latencies else 0.0,
+            "statuses": dict(statuses),
+            "bytes": sum(recorder.bytes[op] for op in operations)
+        }
+        if latencies:
+            summary["latency"] = percentiles(latencies)
+        return summary
+
+    operations = sorted(recorder.latencies)
+    kinds = sorted({op.split(".")[0] for op in operations})
+    return {
+        "overall": group(operations),
+        "by_kind": {kind: group([op for op in operations if op.startswith(kind + ".")]) for kind in kinds},
+        "operations": {op: group([op]) for op in operations},
+        "stages": {name: {"calls": len(walls), **percentiles(walls)}
+                   for name, walls in sorted(recorder.stages.items())}
+    }
+
+
+def print_report(summary, elapsed):
+    print(f"\n{summary['overall']['requests']} requests in {elapsed:.1f} s")
+    header = f"{'operation':24} {'requests':>8} {'req/s':>7} {'errors':>6} " + \
+        " ".join(f"{'p' + str(p) + ' ms':>9}" for p in PERCENTILES)
+    print(header)
+    rows = [("overall", summary["overall"])] + sorted(summary["by_kind"].items()) + \
+        sorted(summary["operations"].items())
+    for name, stats in rows:
+        latency = stats.get("latency", {})
+        print(f"{name:24} {stats['requests']:8d} {stats['throughput']:7.2f} {stats['errors']:6d} " +
+              " ".join(f"{latency.get(f'p{p}', float('nan')) * 1000:9.1f}" for p in PERCENTILES))
+    if summary["stages"]:
+        print(f"\n{'server stage':24} {'calls':>8} {'mean ms':>9} {'p95 ms':>9}")
+        for name, stats in summary["stages"].items():
+            print(f"{name:24} {stats['calls']:8d} {stats['mean'] * 1000:9.1f} {stats['p95'] * 1000:9.1f}")
+
+
+def compare(summary, baseline, threshold):
+    """Operations whose p95 latency or error rate got worse than the baseline by more than threshold"""
+    regressions = []
+    previous = baseline.get("summary", {})
+    rows = [("overall", summary["overall"], previous.get("overall"))] + \
+        [(op, stats, previous.get("operations", {}).get(op)) for op, stats in summary["operations"].items()]
+    print()
+    for name, stats, old in rows:
+        if not old or "latency" not in old or "latency" not in stats:
+            continue
+        ratio = stats["latency"]["p95"] / old["latency"]["p95"] if old["latency"]["p95"] > 0 else 1.0
+        print(f"{name:24} p95 {old['latency']['p95'] * 1000:9.1f} -> {stats['latency']['p95'] * 1000:9.1f} ms"
+              f" ({ratio:.2f}x), req/s {old['throughput']:.2f} -> {stats['throughput']:.2f},"
+              f" errors {old['error_rate']:.1%} -> {stats['error_rate']:.1%}")
+        if ratio > 1 + threshold or stats["error_rate"] > old["error_rate"] + threshold:
+            regressions.append(name)
+    for name in regressions:
+        print(f"REGRESSION {name}")
+    if not regressions:
+        print(f"No regressions above {threshold:.0%}")
+    return regressions
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_argument_group("target")
+    target.add_argument("--url", help="Backend already running on localhost (default: start one)")
+    target.add_argument("--server", choices=("app", "serve"), default="app",
+                        help="Backend to start: the threaded Flask app or the preforking serve.py")
+    target.add_argument("--workers", type=int, help="Workers of serve.py")
+    target.add_argument("--keep", action="store_true", help="Keep the started server's directory and log")
+    load = parser.add_argument_group("load")
+    rate = load.add_mutually_exclusive_group()
+    rate.add_argument("--concurrency", type=int, default=4, help="Clients in a closed loop")
+    rate.add_argument("--rps", type=float, help="Requests started per second (open loop)")
+    load.add_argument("--max-in-flight", type=int, default=64, help="Open loop: most calls in flight")
+    load.add_argument("--seconds", type=float, default=30, help="How long to run")
+    load.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0: no limit)")
+    load.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                      help="Operation weights, e.g. generate=1,download=3,session=6")
+    load.add_argument("--signals", nargs="+", choices=SIGNALS, default=["eeg", "ecg"],
+                      help="Signals requested by generate calls")
+    load.add_argument("--record-seconds", type=int, default=10, help="Duration of generated records")
+    load.add_argument("--sampling-rate", type=int, default=256)
+    load.add_argument("--warm-sessions", type=int, default=4, help="Sessions generated before measuring")
+    load.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    load.add_argument("--seed", type=int, default=0, help="Seed of the request mix")
+    output = parser.add_argument_group("output")
+    output.add_argument("--output", help="Write results to this JSON file")
+    output.add_argument("--compare", help="Baseline JSON file to compare against")
+    output.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative p95 slowdown (or error rate increase) that counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    if args.url:
+        host, port = check_local(args.url)
+    else:
+        server = LocalServer(args.server, args.workers, args.keep).start()
+        host, port = "127.0.0.1", server.port
+    client = Client(host, port, args.timeout)
+
+    try:
+        client.wait_ready(120, server.process if server else None)
+        test = LoadTest(client, args)
+        test.prepare()
+        mode = f"{args.rps:g} req/s" if args.rps else f"concurrency {args.concurrency}"
+        print(f"Running {mode} for {args.seconds:g} s against http://{host}:{port}")
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        if args.rps:
+            test.open_loop(args.rps, deadline, args.requests, args.max_in_flight)
+        else:
+            test.closed_loop(args.concurrency, deadline, args.requests)
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.stop()
+
+    summary = summarize(test.recorder, elapsed)
+    print_report(summary, elapsed)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    report = {"environment": environment_info(), "config": config, "elapsed": elapsed, "summary": summary}
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Spectral accuracy of reduced-rate band synthesis against full-rate filtering
+
+band_limited_noise filters slow bands at a fraction of the output rate and
+interpolates them back up. For every EEG band and sampling rate where that
+happens, this compares the averaged Welch spectrum of the result with the
+exact spectrum of noise filtered at the output rate, and exits with status 1
+when the band power or the interpolation images go past the bounds
+documented in the README.
+
+Examples:
+    python benchmarks/multirate_accuracy.py
+    python benchmarks/multirate_accuracy.py --rates 512 2048 --seconds 600
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import numpy as np
+from scipy import signal as scipy_signal
+
+from generator import utils
+
+# Largest |band power / full-rate band power - 1|
+BAND_POWER_TOLERANCE = 0.05
+# Largest share of the power above twice the band's upper edge, where interpolation images land
+IMAGE_POWER_TOLERANCE = 1e-4
+
+DEFAULT_RATES = [256, 512, 1024, 2048]
+
+
+def full_rate_psd(low, high, freqs, sr):
+    """Expected one-sided PSD of unit white noise run through filtfilt at the output rate"""
+    _, h = scipy_signal.sosfreqz(utils.bandpass_coefficients(low, high, sr), worN=freqs, fs=sr)
+    return 2 / sr * np.abs(h) ** 4
+
+
+def compare_band(low, high, sr, seconds, rows, seed):
+    """(|band power / full-rate band power - 1|, share of power above 2 * high) of reduced-rate noise"""
+    with utils.use_random_state(np.random.RandomState(seed)):
+        noise = utils.band_limited_noise(low, high, seconds * sr, sr, rows=rows)
+    freqs, psd = scipy_signal.welch(noise, fs=sr, nperseg=8 * sr, axis=-1)
+    psd = psd.mean(axis=0)
+    band = (freqs >= low) & (freqs <= high)
+    expected = full_rate_psd(low, high, freqs, sr)
+    return abs(psd[band].sum() / expected[band].sum() - 1), psd[freqs > 2 * high].sum() / psd.sum()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rates", type=int, nargs="+", default=DEFAULT_RATES, help="Sampling rates in Hz")
+    parser.add_argument("--seconds", type=int, default=300, help="Length of each noise row")
+    parser.add_argument("--rows", type=int, default=32, help="Rows averaged per spectrum")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = 0
+    for sr in args.rates:
+        for band, (low, high) in utils.EEG_BANDS.items():
+            factor = utils.multirate_factor(high, sr)
+            if factor == 1:
+                continue
+            power_error, image_power = compare_band(low, high, sr, args.seconds, args.rows, args.seed)
+            within = power_error <= BAND_POWER_TOLERANCE and image_power <= IMAGE_POWER_TOLERANCE
+            failures += not within
+            print(f"{band} {low}-{high} Hz at {sr} Hz (1/{factor} rate): band power ±{power_error:.4f}, "
+                  f"images {image_power:.1e}{'' if within else '  OUT OF BOUNDS'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Speed and accuracy of the quality tiers against the standard tier
+
+Times generate(), HRV extraction and plotting at each tier, measures how far
+the draft and high tiers drift from standard, and exits with status 1 when
+a tier misses the speedup or accuracy bounds documented in the README.
+
+Examples:
+    python benchmarks/quality_tiers.py
+    python benchmarks/quality_tiers.py --duration 300 --output tiers.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import numpy as np
+import pandas as pd
+from scipy import signal as scipy_signal
+
+from generator.eeg_generator import EEGGenerator
+from generator.ecg_generator import ECGGenerator
+from generator import utils
+
+# Documented bounds per tier: least speedup over standard (>1 is faster),
+# and the largest accuracy deltas
+BOUNDS = {
+    "draft": {
+        "speedup": {"eeg.generate": 1.5, "ecg.generate": 1.5, "hrv": 10.0, "eeg.plot": 3.0},
+        "in_band_fraction": 0.08,   # absolute drop of the noise power inside its band
+        "power_ratio": 0.05,        # |noise power / standard noise power - 1|
+        "band_profile": 0.03,       # largest change of a relative EEG band power
+        "hrv": 0.02,                # relative error of the HRV indices (see hrv_errors)
+    },
+    "high": {
+        "speedup": {"eeg.generate": 0.5, "ecg.generate": 0.5, "hrv": 0.5, "eeg.plot": 0.5},
+        "in_band_fraction": 0.02,
+        "power_ratio": 0.05,
+        "band_profile": 0.03,
+        "hrv": 0.015,
+    },
+}
+
+# Bands of band_limited_noise checked for accuracy: a slow band that standard
+# filters at a reduced rate and a fast one it filters at the full rate
+NOISE_BANDS = [(1, 4), (8, 12), (13, 30)]
+HRV_FIELDS = ["HRV_MeanNN", "HRV_SDNN", "HRV_RMSSD", "HRV_LF", "HRV_HF"]
+# Rate of the recordings the HRV of each tier is checked against
+HRV_REFERENCE_RATE = 1024
+
+
+def best_time(func, repeat):
+    """Fastest of `repeat` runs after one warm-up run, in seconds"""
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def at_quality(quality, func, *args, **kwargs):
+    with utils.use_quality(quality):
+        return func(*args, **kwargs)
+
+
+def timings(duration, rate, repeat):
+    """{operation: {tier: seconds}}"""
+    eeg_generator = EEGGenerator()
+    ecg_generator = ECGGenerator()
+    import neurokit2 as nk
+    ecg = nk.ecg_simulate(duration=duration, sampling_rate=rate, heart_rate=75, random_state=0)
+    channels = eeg_generator.eeg_channels
+    frame = pd.DataFrame(np.random.randn(duration * rate, len(channels)) * 50, columns=channels)
+
+    operations = {
+        "eeg.generate": lambda quality: eeg_generator.generate(
+            "normal_awake", duration=duration, sampling_rate=rate, session_id="tiers", seed=0, quality=quality),
+        "ecg.generate": lambda quality: ecg_generator.generate(
+            "normal_sinus", duration=duration, sampling_rate=rate, session_id="tiers", seed=0, quality=quality),
+        "hrv": lambda quality: at_quality(quality, utils.extract_hrv_features, ecg, rate),
+        "eeg.plot": lambda quality: at_quality(quality, plot_tier, frame, channels, rate),
+    }
+    return {name: {quality: best_time(lambda: operation(quality), repeat) for quality in utils.QUALITY_TIERS}
+            for name, operation in operations.items()}
+
+
+def plot_tier(frame, channels, rate):
+    """Draw an EEG plot the way the output stage does at the active tier"""
+    tier = utils.quality_tier()
+    samples = None if tier["plot_seconds"] is None else tier["plot_seconds"] * rate + 1
+    return utils.create_eeg_plot(frame.iloc[:samples], channels, "tiers", "tiers", rate, tier["plot_dpi"])
+
+
+def noise_accuracy(quality, rate, seconds=600, seed=0):
+    """(worst drop of in-band power fraction, worst power ratio error) of band_limited_noise vs standard"""
+    fraction_drop, ratio_error = 0.0, 0.0
+    for low, high in NOISE_BANDS:
+        stats = {}
+        for tier in (utils.DEFAULT_QUALITY, quality):
+            with utils.use_random_state(np.random.RandomState(seed)):
+                noise = at_quality(tier, utils.band_limited_noise, low, high, seconds * rate, rate)
+            f, psd = scipy_signal.welch(noise, fs=rate, nperseg=4 * rate)
+            band = (f >= low) & (f <= high)
+            stats[tier] = (psd[band].sum() / psd.sum(), noise.var())
+        fraction_drop = max(fraction_drop, stats[utils.DEFAULT_QUALITY][0] - stats[quality][0])
+        ratio_error = max(ratio_error, abs(stats[quality][1] / stats[utils.DEFAULT_QUALITY][1] - 1))
+    return fraction_drop, ratio_error
+
+
+def band_profile_error(quality, rate, seconds=120, seed=0):
+    """Largest change of a relative band power, averaged over channels, of a normal awake record"""
+    eeg_generator = EEGGenerator()
+    profiles = {}
+    for tier in (utils.DEFAULT_QUALITY, quality):
+        result = eeg_generator.generate("normal_awake", duration=seconds, sampling_rate=rate,
+                                        session_id="tiers", seed=seed, quality=tier)
+        power = utils.extract_band_power(np.load(result["npy_path"]), rate)
+        profiles[tier] = (power.div(power.sum(axis=1), axis=0)).mean()
+    return float((profiles[quality] - profiles[utils.DEFAULT_QUALITY]).abs().max())
+
+
+def hrv_errors(rate, seconds=300, seeds=(0, 1, 2)):
+    """{tier: largest relative error of its HRV indices} against the same ECG recorded at HRV_REFERENCE_RATE
+
+    Draft only computes the time-domain indices, so only those count for it.
+    """
+    import neurokit2 as nk
+    divisor = np.gcd(rate, HRV_REFERENCE_RATE)
+    errors = dict.fromkeys(utils.QUALITY_TIERS, 0.0)
+    for seed in seeds:
+        recording = nk.ecg_simulate(duration=seconds, sampling_rate=HRV_REFERENCE_RATE, heart_rate=70,
+                                    heart_rate_std=2, random_state=seed)
+        reference = at_quality(utils.DEFAULT_QUALITY, utils.extract_hrv_features, recording, HRV_REFERENCE_RATE)
+        ecg = scipy_signal.resample_poly(recording, rate // divisor, HRV_REFERENCE_RATE // divisor)
+        for quality in errors:
+            hrv = at_quality(quality, utils.extract_hrv_features, ecg, rate)
+            errors[quality] = max([errors[quality]] + [
+                abs(float(hrv[field].iloc[0]) / float(reference[field].iloc[0]) - 1)
+                for field in HRV_FIELDS if field in hrv])
+    return errors
+
+
+def check(report):
+    """Failed bounds as readable lines"""
+    failures = []
+    if report["hrv_error"]["high"] > report["hrv_error"][utils.DEFAULT_QUALITY]:
+        failures.append("high hrv: less accurate than standard")
+    for quality, bounds in BOUNDS.items():
+        measured = report["tiers"][quality]
+        for operation, least in bounds["speedup"].items():
+            if measured["speedup"][operation] < least:
+                failures.append(f"{quality} {operation}: speedup {measured['speedup'][operation]:.2f}x < {least}x")
+        for metric in ("in_band_fraction", "power_ratio", "band_profile", "hrv"):
+            value = measured[metric]
+            if value > bounds[metric] + 1e-9:
+                failures.append(f"{quality} {metric}: {value:.4f} > {bounds[metric]}")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=int, default=60, help="Record length of the timed runs, in seconds")
+    parser.add_argument("--sampling-rate", type=int, default=256, help="Sampling rate in Hz")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per operation and tier")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    rate = args.sampling_rate
+
+    # Generators write their artifacts relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="eeg-ecg-tiers-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    utils.create_output_directories()
+    warnings.filterwarnings("ignore")
+    try:
+        times = timings(args.duration, rate, args.repeat)
+        hrv_error = hrv_errors(rate)
+        report = {"duration": args.duration, "sampling_rate": rate, "seconds": times, "hrv_error": hrv_error,
+                  "tiers": {}}
+        for quality in BOUNDS:
+            fraction_drop, ratio_error = noise_accuracy(quality, rate)
+            report["tiers"][quality] = {
+                "speedup": {name: by_tier[utils.DEFAULT_QUALITY] / by_tier[quality] for name, by_tier in times.items()},
+                "in_band_fraction": fraction_drop,
+                "power_ratio": ratio_error,
+                "band_profile": band_profile_error(quality, rate),
+                "hrv": hrv_error[quality],
+            }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for quality, measured in report["tiers"].items():
+        speedups = ", ".join(f"{name} {value:.2f}x" for name, value in measured["speedup"].items())
+        print(f"{quality}: {speedups}")
+        print(f"{' ' * len(quality)}  in-band fraction -{measured['in_band_fraction']:.4f}, "
+              f"power ratio ±{measured['power_ratio']:.4f}, band profile ±{measured['band_profile']:.4f}, "
+              f"HRV ±{measured['hrv']:.4f}")
+    print(f"{utils.DEFAULT_QUALITY}: HRV ±{report['hrv_error'][utils.DEFAULT_QUALITY]:.4f}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {output}")
+
+    failures = check(report)
+    for failure in failures:
+        print(f"OUT OF BOUNDS: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the EEG/ECG generators and their pipeline stages
+
+Examples:
+    python benchmarks/run_benchmarks.py --quick --output bench.json
+    python benchmarks/run_benchmarks.py --filter 'eeg.generate*' --rates 256 512
+    python benchmarks/run_benchmarks.py --quick --compare baseline.json
+    python benchmarks/run_benchmarks.py --quick --dtypes float64 float32 --filter 'eeg.*'
+    python benchmarks/run_benchmarks.py --quick --qualities draft standard high --filter '*.generate*'
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import numpy as np
+import pandas as pd
+
+from generator.eeg_generator import EEGGenerator, EEG_TYPES
+from generator.ecg_generator import ECGGenerator, ECG_TYPES
+from generator import utils
+
+DEFAULT_DURATIONS = [10, 60, 300, 3600]
+DEFAULT_RATES = [128, 256, 512, 1024, 2048]
+QUICK_DURATIONS = [10]
+QUICK_RATES = [256]
+
+
+class Benchmark:
+    def __init__(self, name, params, setup):
+        self.name = name
+        self.params = params
+        self.setup = setup  # returns the callable to time
+
+    @property
+    def key(self):
+        suffix = ",".join(f"{k}={v}" for k, v in self.params.items())
+        return f"{self.name}[{suffix}]" if suffix else self.name
+
+
+def type_values(types):
+    """Flatten an API type catalogue into its type identifiers"""
+    return [value for group in types.values() for value in group.values()]
+
+
+def generator_benchmarks(durations, rates, dtypes=("float64",), qualities=(utils.DEFAULT_QUALITY,)):
+    """End-to-end generate() calls for every EEG and ECG type"""
+    benchmarks = []
+    eeg_generator = EEGGenerator()
+    ecg_generator = ECGGenerator()
+
+    for signal, generator, types in [("eeg", eeg_generator, EEG_TYPES),
+                                     ("ecg", ecg_generator, ECG_TYPES)]:
+        for signal_type in type_values(types):
+            for duration in durations:
+                for rate in rates:
+                    for dtype in dtypes:
+                        for quality in qualities:
+                            def setup(generator=generator, signal_type=signal_type,
+                                      duration=duration, rate=rate, dtype=dtype, quality=quality):
+                                return lambda: generator.generate(
+                                    signal_type, duration=duration, sampling_rate=rate,
+                                    session_id="bench", dtype=dtype, quality=quality
+                                )
+                            params = {"type": signal_type, "duration": duration, "sampling_rate": rate}
+                            # float64 / standard keys stay unsuffixed so older baselines still compare
+                            if dtype != "float64":
+                                params["dtype"] = dtype
+                            if quality != utils.DEFAULT_QUALITY:
+                                params["quality"] = quality
+                            benchmarks.append(Benchmark(f"{signal}.generate", params, setup))
+    return benchmarks
+
+
+def stage_benchmarks(durations, rates):
+    """Individual pipeline stages on precomputed inputs"""
+    benchmarks = []
+    channels = EEGGenerator().eeg_channels
+
+    for duration in durations:
+        for rate in rates:
+            n_samples = duration * rate
+            params = {"duration": duration, "sampling_rate": rate}
+
+            def noise_setup(n_samples=n_samples, rate=rate):
+                return lambda: utils.band_limited_noise(8, 12, n_samples, rate)
+
+            def band_power_setup(n_samples=n_samples, rate=rate):
+                eeg = np.random.randn(len(channels), n_samples)
+                return lambda: utils.extract_band_power(eeg, rate)
+
+            def hrv_setup(duration=duration, rate=rate):
+                import neurokit2 as nk
+                ecg = nk.ecg_simulate(duration=duration, sampling_rate=rate, heart_rate=75)
+                return lambda: utils.extract_hrv_features(ecg, rate)
+
+            def eeg_plot_setup(n_samples=n_samples, rate=rate):
+                df = pd.DataFrame(np.random.randn(n_samples, len(channels)) * 50, columns=channels)
+                return lambda: utils.create_eeg_plot(df, channels, "bench", "bench", rate)
+
+            def ecg_plot_setup(n_samples=n_samples, rate=rate):
+                df = pd.DataFrame({"ECG": np.random.randn(n_samples)})
+                return lambda: utils.create_ecg_plot(df, "bench", "bench", rate)
+
+            def data_csv_setup(n_samples=n_samples):
+                df = pd.DataFrame(np.random.randn(n_samples, len(channels)), columns=channels)
+                return lambda: utils.save_data_to_csv(df, "bench", "eeg")
+
+            benchmarks += [
+                Benchmark("stage.band_limited_noise", params, noise_setup),
+                Benchmark("stage.extract_band_power", params, band_power_setup),
+                Benchmark("stage.extract_hrv_features", params, hrv_setup),
+                Benchmark("stage.create_eeg_plot", params, eeg_plot_setup),
+                Benchmark("stage.create_ecg_plot", params, ecg_plot_setup),
+                Benchmark("stage.save_data_to_csv", params, data_csv_setup),
+            ]
+
+    def features_csv_setup():
+        features = pd.DataFrame(np.random.rand(len(channels), 5),
+                                columns=["delta", "theta", "alpha", "beta", "gamma"])
+        return lambda: utils.save_features_to_csv(features, "bench")
+
+    benchmarks.append(Benchmark("stage.save_features_to_csv", {}, features_csv_setup))
+    return benchmarks
+
+
+def startup_benchmarks():
+    """Cold start of the backend, each measured in a fresh interpreter"""
+    scripts = {
+        "startup.import_generators":
+            "import generator.eeg_generator, generator.ecg_generator",
+        "startup.import_app":
+            "import app",
+        "startup.warm_up":
+            "from generator.warmup import warm_up; warm_up()",
+    }
+    benchmarks = []
+    for name, script in scripts.items():
+        def setup(script=script):
+            code = f"import sys; sys.path.insert(0, {str(BACKEND_DIR)!r}); {script}"
+            env = dict(os.environ, WARMUP_ON_START="0")
+            return lambda: subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        benchmarks.append(Benchmark(name, {}, setup))
+    return benchmarks
+
+
+def run_benchmark(benchmark, repeat):
+    """Time a benchmark and summarise wall-clock durations in seconds"""
+    np.random.seed(0)
+    fn = benchmark.setup()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "name": benchmark.name,
+        "key": benchmark.key,
+        "params": benchmark.params,
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "times": times
+    }
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+
+def compare(results, baseline, threshold, failures=(), names=None, pattern="*"):
+    """Flag benchmarks whose median got slower than the baseline by threshold
+
+    A baseline benchmark that failed in this run counts as a regression, and
+    so does one matching `pattern` whose name is no longer among `names`
+    (the benchmarks this suite defines).
+    """
+    previous = {r["key"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for failure in failures:
+        old = previous.get(failure["key"])
+        if old is not None:
+            regressions.append(dict(failure, baseline_median=old["median"]))
+    measured = {r["key"] for r in results} | {f["key"] for f in failures}
+    for key, old in previous.items():
+        if key not in measured and fnmatch.fnmatch(key, pattern) and names is not None \
+                and old["name"] not in names:
+            regressions.append({"key": key, "name": old["name"], "baseline_median": old["median"],
+                                "error": "missing from this run"})
+    for result in results:
+        old = previous.get(result["key"])
+        if old is None or old["median"] <= 0:
+            continue
+        ratio = result["median"] / old["median"]
+        result["baseline_median"] = old["median"]
+        result["ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--durations", type=int, nargs="+", help="Durations in seconds")
+    parser.add_argument("--rates", type=int, nargs="+", help="Sampling rates in Hz")
+    parser.add_argument("--dtypes", nargs="+", default=["float64"], choices=utils.SIGNAL_DTYPES,
+                        help="Sample types for the generate benchmarks")
+    parser.add_argument("--qualities", nargs="+", default=[utils.DEFAULT_QUALITY], choices=list(utils.QUALITY_TIERS),
+                        help="Quality tiers for the generate benchmarks")
+    parser.add_argument("--quick", action="store_true",
+                        help=f"Use durations {QUICK_DURATIONS} and rates {QUICK_RATES}")
+    parser.add_argument("--filter", default="*",
+                        help="Glob matched against benchmark keys, e.g. 'stage.*'")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    durations = args.durations or (QUICK_DURATIONS if args.quick else DEFAULT_DURATIONS)
+    rates = args.rates or (QUICK_RATES if args.quick else DEFAULT_RATES)
+
+    benchmarks = (startup_benchmarks() + generator_benchmarks(durations, rates, args.dtypes, args.qualities)
+                  + stage_benchmarks(durations, rates))
+    names = {b.name for b in benchmarks}
+    benchmarks = [b for b in benchmarks if fnmatch.fnmatch(b.key, args.filter)]
+
+    # Generators write their artifacts relative to the working directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix="eeg-ecg-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    utils.create_output_directories()
+    warnings.filterwarnings("ignore")
+
+    results, failures = [], []
+    try:
+        for i, benchmark in enumerate(benchmarks, 1):
+            try:
+                result = run_benchmark(benchmark, args.repeat)
+            except Exception as e:
+                print(f"[{i}/{len(benchmarks)}] {benchmark.key}: FAILED ({e})")
+                failures.append({"name": benchmark.name, "key": benchmark.key, "params": benchmark.params,
+                                 "error": str(e)})
+                continue
+            results.append(result)
+            print(f"[{i}/{len(benchmarks)}] {benchmark.key}: "
+                  f"median {result['median'] * 1000:.1f} ms")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": environment_info(), "results": results, "failures": failures}
+
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, failures, names, args.filter)
+        report["regressions"] = [r["key"] for r in regressions]
+        print()
+        for result in regressions:
+            if "error" in result:
+                print(f"REGRESSION {result['key']}: {result['baseline_median'] * 1000:.1f} ms"
+                      f" -> failed ({result['error']})")
+            else:
+                print(f"REGRESSION {result['key']}: {result['baseline_median'] * 1000:.1f} ms"
+                      f" -> {result['median'] * 1000:.1f} ms ({result['ratio']:.2f}x)")
+        if not regressions:
+            print(f"No regressions above {args.threshold:.0%}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {output}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
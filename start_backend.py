@@ -3,6 +3,7 @@
 Startup script for the EEG/ECG Generator Backend
 """
 
+import importlib.util
 import os
 import sys
 import subprocess
@@ -10,17 +11,22 @@ from pathlib import Path
 
 def check_dependencies():
     """Check if required Python packages are installed"""
-    required_packages = [
-        'flask', 'flask-cors', 'neurokit2', 'mne', 'numpy', 
-        'pandas', 'matplotlib', 'scipy', 'scikit-learn'
-    ]
+    # Distribution name -> importable module name
+    required_packages = {
+        'flask': 'flask',
+        'flask-cors': 'flask_cors',
+        'neurokit2': 'neurokit2',
+        'numpy': 'numpy',
+        'pandas': 'pandas',
+        'matplotlib': 'matplotlib',
+        'scipy': 'scipy'
+    }
     
-    missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package.replace('-', '_'))
-        except ImportError:
-            missing_packages.append(package)
+    # find_spec locates packages without importing them
+    missing_packages = [
+        package for package, module in required_packages.items()
+        if importlib.util.find_spec(module) is None
+    ]
     
     if missing_packages:
         print("❌ Missing required packages:")